@@ -0,0 +1,159 @@
+"""
+Synthetic datasets for the benchmarks.
+
+Writes three csv files with the "name:type" headers that every engine's
+Scan reads:
+
+    facts.csv   rows tuples
+                  id:num   row number
+                  k1:num   foreign key into dim (key_card distinct values)
+                  k2:num   group key (group_card distinct values)
+                  grp:str  low cardinality string (str_card values)
+                  v1:num   uniform in [0, 1000)
+                  v2:num   uniform in [0, 1)
+    dim.csv     key_card tuples
+                  d_id:num, d_e:num (foreign key into dim2), d_cat:str, d_w:num
+    dim2.csv    dim2_card tuples
+                  e_id:num, e_name:str
+
+Column names are distinct across tables because the engines merge
+joined tuples into one dict.  k1 and k2 are drawn from a zipf
+distribution with exponent skew (0 means uniform), so a few keys can be
+made to dominate joins and groups.
+
+Rows are written as they are generated, so 100M row tables never need
+to fit in memory.
+"""
+import os
+import json
+import random
+import bisect
+
+# number of fact table rows for each named scale factor
+SCALES = {
+  "10k": 10 ** 4,
+  "100k": 10 ** 5,
+  "1m": 10 ** 6,
+  "10m": 10 ** 7,
+  "100m": 10 ** 8
+}
+
+
+def scale_rows(scale):
+  """
+  @scale  a name in SCALES or a number of rows
+  """
+  if str(scale).lower() in SCALES:
+    return SCALES[str(scale).lower()]
+  return int(scale)
+
+
+def key_sampler(n, skew, rnd):
+  """
+  Function that returns keys in [0, n).  Key i is drawn with
+  probability proportional to 1 / (i+1)^skew
+  """
+  if skew <= 0:
+    return lambda: rnd.randrange(n)
+  cdf = []
+  total = 0.0
+  for i in xrange(n):
+    total += 1.0 / ((i + 1) ** skew)
+    cdf.append(total)
+  def sample():
+    return min(n - 1, bisect.bisect(cdf, rnd.random() * total))
+  return sample
+
+
+def write_table(path, header, rows):
+  """
+  @header list of (name, type)
+  @rows   iterable of lists of values, written with str()
+  """
+  with open(path, "w") as f:
+    f.write(",".join(["%s:%s" % nt for nt in header]) + "\n")
+    for row in rows:
+      f.write(",".join(map(str, row)) + "\n")
+
+
+def gen_facts(rows, key_card, group_card, str_card, skew, rnd):
+  k1 = key_sampler(key_card, skew, rnd)
+  k2 = key_sampler(group_card, skew, rnd)
+  grps = ["g%d" % i for i in xrange(str_card)]
+  for i in xrange(rows):
+    yield [i, k1(), k2(), rnd.choice(grps),
+        "%.2f" % (rnd.random() * 1000), "%.4f" % rnd.random()]
+
+def gen_dim(key_card, dim2_card, str_card, rnd):
+  for i in xrange(key_card):
+    yield [i, i % dim2_card, "c%d" % (i % str_card), "%.2f" % rnd.random()]
+
+def gen_dim2(dim2_card):
+  for i in xrange(dim2_card):
+    yield [i, "e%d" % i]
+
+
+def generate(outdir, rows, key_card=1000, group_card=100, str_card=10,
+    dim2_card=50, skew=0.0, seed=0):
+  """
+  Write facts.csv, dim.csv and dim2.csv into outdir, along with
+  params.json.  Does nothing if outdir already holds a dataset
+  generated with the same parameters.
+
+  @rows        number of fact table rows
+  @key_card    distinct k1 values, and number of dim rows
+  @group_card  distinct k2 values
+  @str_card    distinct grp and d_cat values
+  @dim2_card   number of dim2 rows
+  @skew        zipf exponent of k1 and k2, 0 for uniform keys
+  @seed        random seed, the same parameters give the same files
+
+  @return dict of table name -> csv path
+  """
+  params = dict(rows=rows, key_card=key_card, group_card=group_card,
+      str_card=str_card, dim2_card=dim2_card, skew=skew, seed=seed)
+  paths = dict([(name, os.path.join(outdir, "%s.csv" % name))
+    for name in ("facts", "dim", "dim2")])
+  params_path = os.path.join(outdir, "params.json")
+
+  if os.path.exists(params_path) and all(map(os.path.exists, paths.values())):
+    with open(params_path) as f:
+      if json.load(f) == params:
+        return paths
+
+  if not os.path.exists(outdir):
+    os.makedirs(outdir)
+  rnd = random.Random(seed)
+  write_table(paths["dim2"], [("e_id", "num"), ("e_name", "str")],
+      gen_dim2(dim2_card))
+  write_table(paths["dim"],
+      [("d_id", "num"), ("d_e", "num"), ("d_cat", "str"), ("d_w", "num")],
+      gen_dim(key_card, dim2_card, str_card, rnd))
+  write_table(paths["facts"],
+      [("id", "num"), ("k1", "num"), ("k2", "num"), ("grp", "str"),
+       ("v1", "num"), ("v2", "num")],
+      gen_facts(rows, key_card, group_card, str_card, skew, rnd))
+  with open(params_path, "w") as f:
+    json.dump(params, f)
+  return paths
+
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="generate benchmark csv files")
+  parser.add_argument("outdir")
+  parser.add_argument("--scale", default="10k",
+      help="one of %s, or a number of rows" % ", ".join(sorted(SCALES)))
+  parser.add_argument("--key-card", type=int, default=1000)
+  parser.add_argument("--group-card", type=int, default=100)
+  parser.add_argument("--str-card", type=int, default=10)
+  parser.add_argument("--dim2-card", type=int, default=50)
+  parser.add_argument("--skew", type=float, default=0.0)
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  paths = generate(args.outdir, scale_rows(args.scale), args.key_card,
+      args.group_card, args.str_card, args.dim2_card, args.skew, args.seed)
+  for name, path in sorted(paths.items()):
+    print name, path
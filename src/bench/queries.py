@@ -0,0 +1,153 @@
+"""
+Fixed query mix run by the benchmark runner.
+
+Each query is written once as an engine neutral plan spec of nested
+tuples, which build() turns into a plan of a given engine's operators:
+
+    ("scan", table)
+    ("filter", child, cond)
+    ("project", child, [expr], [alias])
+    ("join", left, right, cond)
+    ("groupby", child, [expr])
+    ("orderby", child, [expr], ["asc" or "desc"])
+    ("limit", child, n)
+
+Expressions are strings in the compiler's expression grammar.  The
+operators of ../sql and ../hwx only parse whole queries, so for them
+build() is passed pyexpr, which looks up the equivalent python function
+in PYEXPRS.  The sql text of every query is only used to describe it.
+"""
+from collections import OrderedDict
+
+
+class Query(object):
+  def __init__(self, name, sql, spec):
+    self.name = name
+    self.sql = sql
+    self.spec = spec
+
+  def tables(self):
+    ret = []
+    def visit(spec):
+      if spec[0] == "scan":
+        ret.append(spec[1])
+      for arg in spec[1:]:
+        if isinstance(arg, tuple):
+          visit(arg)
+    visit(self.spec)
+    return ret
+
+  def __str__(self):
+    return "%s: %s" % (self.name, self.sql)
+
+
+QUERIES = OrderedDict()
+
+def query(name, sql, spec):
+  QUERIES[name] = Query(name, sql, spec)
+
+
+query("filter",
+    "SELECT * FROM facts WHERE v1 < 100",
+    ("filter", ("scan", "facts"), "v1 < 100"))
+
+query("project",
+    "SELECT id, v1 * 2 + v2 AS x, k2 FROM facts",
+    ("project", ("scan", "facts"), ["id", "v1 * 2 + v2", "k2"], ["id", "x", "k2"]))
+
+query("join3",
+    """SELECT id, d_cat, e_name, v1
+       FROM facts, dim, dim2
+       WHERE v1 < 50 AND k1 = d_id AND d_e = e_id""",
+    ("project",
+      ("join",
+        ("join",
+          ("filter", ("scan", "facts"), "v1 < 50"),
+          ("scan", "dim"),
+          "k1 = d_id"),
+        ("scan", "dim2"),
+        "d_e = e_id"),
+      ["id", "d_cat", "e_name", "v1"],
+      ["id", "d_cat", "e_name", "v1"]))
+
+query("groupby",
+    "SELECT k2, count(v1), avg(v1), sum(v2) FROM facts GROUP BY k2",
+    ("project",
+      ("groupby", ("scan", "facts"), ["k2"]),
+      ["k2", "count(v1)", "avg(v1)", "sum(v2)"],
+      ["k2", "n", "avg_v1", "sum_v2"]))
+
+query("orderby",
+    "SELECT id, v1 FROM facts ORDER BY v1 DESC",
+    ("orderby",
+      ("project", ("scan", "facts"), ["id", "v1"], ["id", "v1"]),
+      ["v1"], ["desc"]))
+
+query("topn",
+    "SELECT id, v1 FROM facts ORDER BY v1 DESC LIMIT 10",
+    ("limit",
+      ("orderby",
+        ("project", ("scan", "facts"), ["id", "v1"], ["id", "v1"]),
+        ["v1"], ["desc"]),
+      10))
+
+
+def group(t, attr):
+  """
+  values of attr in the group of a GroupBy output tuple of ../sql, ../hwx
+  """
+  return [row[attr] for row in t["__group__"]]
+
+# python functions of every expression used in QUERIES.  Join conditions
+# take the left and the right tuple.
+PYEXPRS = {
+  "id": lambda t: t["id"],
+  "k2": lambda t: t["k2"],
+  "v1": lambda t: t["v1"],
+  "d_cat": lambda t: t["d_cat"],
+  "e_name": lambda t: t["e_name"],
+  "v1 < 100": lambda t: t["v1"] < 100,
+  "v1 < 50": lambda t: t["v1"] < 50,
+  "v1 * 2 + v2": lambda t: t["v1"] * 2 + t["v2"],
+  "k1 = d_id": lambda l, r: l["k1"] == r["d_id"],
+  "d_e = e_id": lambda l, r: l["d_e"] == r["e_id"],
+  "count(v1)": lambda t: len(t["__group__"]),
+  "avg(v1)": lambda t: sum(group(t, "v1")) / len(t["__group__"]),
+  "sum(v2)": lambda t: sum(group(t, "v2")),
+}
+
+def pyexpr(s):
+  if s not in PYEXPRS:
+    raise Exception("no python function for expression %s" % s)
+  return PYEXPRS[s]
+
+
+def build(spec, ops, paths, expr=lambda s: s, ascdesc=True):
+  """
+  Turn a plan spec into a plan of the engine's operators
+
+  @ops    the engine's ops module
+  @paths  dict of table name -> csv path
+  @expr   turns an expression string into what the engine's operators
+          expect: parseexpr for ../compiler, pyexpr for ../sql and ../hwx
+  @ascdesc  False if the engine's OrderBy has no sort directions
+  """
+  kind, args = spec[0], spec[1:]
+  if kind == "scan":
+    return ops.Scan(paths[args[0]])
+  child = build(args[0], ops, paths, expr, ascdesc)
+  if kind == "filter":
+    return ops.Filter(child, expr(args[1]))
+  if kind == "project":
+    return ops.Project(child, map(expr, args[1]), list(args[2]))
+  if kind == "join":
+    return ops.Join(child, build(args[1], ops, paths, expr, ascdesc), expr(args[2]))
+  if kind == "groupby":
+    return ops.GroupBy(child, map(expr, args[1]))
+  if kind == "orderby":
+    if ascdesc:
+      return ops.OrderBy(child, map(expr, args[1]), args[2])
+    return ops.OrderBy(child, map(expr, args[1]))
+  if kind == "limit":
+    return ops.Limit(child, args[1])
+  raise Exception("unknown plan node %s" % kind)
@@ -0,0 +1,355 @@
+"""
+Performance regression tracking on top of run.py.
+
+    python regress.py record            run the benchmark and store it
+                                        as the result of the current commit
+    python regress.py check             run it again and compare against
+                                        the baseline of this machine;
+                                        exit 1 on a regression (or on
+                                        changed row counts)
+    python regress.py compare A B       compare two stored result files
+
+Results are stored as results/<machine fingerprint>/<commit>.json, so
+timings are only ever compared with runs on the same hardware, OS and
+python.  The baseline is the newest result that record stored for a
+clean working tree; results of modified trees and those of check
+--save (stored as <commit>-check-<time>.json) are never baselines, so
+a regressed run cannot become one.  A check reruns the exact
+configuration (scale, engines, queries, repetitions) of the baseline
+it compares against.  results/ is not committed.
+
+Every (engine, query) is run repeat times.  A query regressed if its
+median latency is more than --threshold slower than the baseline's AND
+the ~95% confidence intervals of the two medians do not overlap, so
+noise between repetitions does not fail a check.
+
+Changes to the files matched by WATCHED must pass a check.  With
+--changed-only the check is skipped when none of them differ from the
+baseline commit, e.g. as a pre-commit hook (.git/hooks/pre-commit):
+
+    #!/bin/sh
+    cd src/bench && exec python regress.py check --changed-only
+"""
+import os
+import sys
+import json
+import math
+import time
+import hashlib
+import platform
+import subprocess
+import run
+from datagen import scale_rows, generate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(HERE, "results")
+
+# git pathspecs of the engines, the table readers they share and the
+# query mix: every module a benchmarked query can execute
+WATCHED = [
+  "src/compiler/*.py",
+  "src/common/*.py",
+  "src/sql/*.py",
+  "src/hwx/*.py",
+  "src/bench/queries.py"
+]
+
+DEFAULT_CONFIG = dict(
+  scale="10k",
+  engines=["compiler"],
+  queries=list(run.QUERIES),
+  repeat=10,
+  warmup=1,
+  key_card=1000,
+  group_card=100,
+  skew=0.0,
+  seed=0
+)
+
+
+def git(*args):
+  try:
+    return subprocess.check_output(("git",) + args, cwd=HERE).strip()
+  except Exception:
+    return None
+
+def current_commit():
+  """
+  @return (commit hash, True if the working tree has changes)
+  """
+  commit = git("rev-parse", "HEAD") or "unknown"
+  dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+  return commit, dirty
+
+
+def machine_info():
+  info = dict(
+    system=platform.system(),
+    release=platform.release(),
+    machine=platform.machine(),
+    python=platform.python_version(),
+    cpus=cpu_count()
+  )
+  try:
+    with open("/proc/cpuinfo") as f:
+      for l in f:
+        if l.startswith("model name"):
+          info["cpu"] = l.split(":", 1)[1].strip()
+          break
+  except IOError:
+    info["cpu"] = platform.processor()
+  return info
+
+def cpu_count():
+  try:
+    import multiprocessing
+    return multiprocessing.cpu_count()
+  except Exception:
+    return 0
+
+def fingerprint(info=None):
+  info = info or machine_info()
+  return hashlib.sha1(json.dumps(info, sort_keys=True)).hexdigest()[:12]
+
+
+def median(vals):
+  vals = sorted(vals)
+  n = len(vals)
+  if n % 2:
+    return vals[n / 2]
+  return (vals[n / 2 - 1] + vals[n / 2]) / 2.0
+
+def median_ci(vals, z=1.96):
+  """
+  Distribution free confidence interval of the median: the order
+  statistics whose ranks are z standard deviations of a
+  Binomial(n, 0.5) away from n/2
+
+  @return (low, high)
+  """
+  vals = sorted(vals)
+  n = len(vals)
+  half = z * math.sqrt(n) / 2.0
+  lo = int(math.floor(n / 2.0 - half))
+  hi = int(math.ceil(n / 2.0 + half))
+  return vals[max(0, lo)], vals[min(n - 1, hi)]
+
+
+def run_config(config):
+  nrows = scale_rows(config["scale"])
+  datadir = os.path.join(HERE, "data", "%s-k%d-g%d-s%g-r%d" % (
+    config["scale"], config["key_card"], config["group_card"],
+    config["skew"], config["seed"]))
+  paths = generate(datadir, nrows, key_card=config["key_card"],
+      group_card=config["group_card"], skew=config["skew"], seed=config["seed"])
+  return run.run_benchmark(config["engines"], config["queries"], paths, nrows,
+      config["repeat"], config["warmup"], timeout=None, out=sys.stderr)
+
+def measure(config, command):
+  """
+  Run the benchmark for the current commit
+
+  @command  "record" or "check", the command that measures
+  @return results dict, as stored by save()
+  """
+  commit, dirty = current_commit()
+  info = machine_info()
+  return dict(
+    command=command,
+    commit=commit,
+    dirty=dirty,
+    fingerprint=fingerprint(info),
+    machine=info,
+    timestamp=time.time(),
+    config=config,
+    results=run_config(config)
+  )
+
+def save(doc, resultsdir=RESULTS_DIR):
+  """
+  @return path of the results file
+  """
+  outdir = os.path.join(resultsdir, doc["fingerprint"])
+  if not os.path.exists(outdir):
+    os.makedirs(outdir)
+  name = doc["commit"]
+  if doc.get("command") == "check":
+    name += "-check-%d" % doc["timestamp"]
+  if doc["dirty"]:
+    name += "-dirty"
+  path = os.path.join(outdir, name + ".json")
+  with open(path, "w") as f:
+    json.dump(doc, f, indent=2)
+  return path
+
+def is_baseline(doc):
+  """
+  whether a results dict can be a baseline: stored by record, for an
+  unmodified working tree
+  """
+  return doc.get("command") == "record" and not doc["dirty"]
+
+def latest(resultsdir=RESULTS_DIR):
+  """
+  path of the newest baseline of this machine
+  """
+  d = os.path.join(resultsdir, fingerprint())
+  if not os.path.isdir(d):
+    return None
+  docs = []
+  for name in os.listdir(d):
+    path = os.path.join(d, name)
+    if not name.endswith(".json"):
+      continue
+    with open(path) as f:
+      doc = json.load(f)
+    if is_baseline(doc):
+      docs.append((doc["timestamp"], path))
+  return docs and max(docs)[1] or None
+
+
+def compare(base, new, threshold=0.1):
+  """
+  @base, new  results dicts as stored by save()
+  @return list of comparison dicts, one per (engine, query) of base;
+          status is "regression", "improvement", "ok", "error",
+          "missing" or "skipped" (an unsupported engine and query pair)
+  """
+  newres = dict([((r["engine"], r["query"]), r) for r in new["results"]])
+  ret = []
+  for b in base["results"]:
+    key = (b["engine"], b["query"])
+    c = dict(engine=key[0], query=key[1])
+    ret.append(c)
+    n = newres.get(key)
+    if n is None:
+      c["status"] = "missing"
+      continue
+    if "skipped" in n or "skipped" in b:
+      c["status"] = "skipped"
+      c["skipped"] = n.get("skipped") or b["skipped"]
+      continue
+    if "error" in n:
+      # queries that already failed on the baseline do not fail a check
+      c["status"] = "error" in b and "ok" or "error"
+      c["error"] = n["error"]
+      continue
+    if "error" in b:
+      c["status"] = "ok"
+      continue
+
+    c["base"], c["new"] = median(b["times"]), median(n["times"])
+    blo, bhi = median_ci(b["times"])
+    nlo, nhi = median_ci(n["times"])
+    c["ratio"] = c["base"] and c["new"] / c["base"] or 1.0
+    if c["ratio"] > 1 + threshold and nlo > bhi:
+      c["status"] = "regression"
+    elif c["ratio"] < 1 - threshold and nhi < blo:
+      c["status"] = "improvement"
+    else:
+      c["status"] = "ok"
+    if n["rows"] != b["rows"]:
+      c["status"] = "error"
+      c["error"] = "%d rows, baseline had %d" % (n["rows"], b["rows"])
+  return ret
+
+def print_comparison(comps, out=sys.stdout):
+  print >>out, "%-18s %-8s %10s %10s %7s  %s" % (
+      "engine", "query", "base ms", "new ms", "ratio", "status")
+  for c in comps:
+    if "ratio" not in c:
+      print >>out, "%-18s %-8s %10s %10s %7s  %s %s" % (
+          c["engine"], c["query"], "", "", "", c["status"],
+          c.get("error", c.get("skipped", "")))
+      continue
+    print >>out, "%-18s %-8s %10.1f %10.1f %6.2fx  %s" % (
+        c["engine"], c["query"], c["base"] * 1000, c["new"] * 1000,
+        c["ratio"], c["status"])
+
+def failed(comps):
+  return any(c["status"] in ("regression", "error", "missing") for c in comps)
+
+
+def watched_changes(commit):
+  """
+  files matched by WATCHED that differ between commit and the working tree
+  """
+  root = git("rev-parse", "--show-toplevel")
+  out = root and git("-C", root, "diff", "--name-only", commit, "--", *WATCHED)
+  if out is None:
+    return list(WATCHED)
+  return filter(bool, out.split("\n"))
+
+
+def load(path):
+  with open(path) as f:
+    return json.load(f)
+
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="track benchmark regressions")
+  parser.add_argument("command", choices=["record", "check", "compare"])
+  parser.add_argument("files", nargs="*", help="for compare: baseline and new results")
+  parser.add_argument("--baseline", default=None,
+      help="results file to check against (default: the newest clean record of this machine)")
+  parser.add_argument("--threshold", type=float, default=0.1,
+      help="relative slowdown of the median that counts as a regression")
+  parser.add_argument("--changed-only", action="store_true",
+      help="skip the check if no watched file changed since the baseline commit")
+  parser.add_argument("--save", action="store_true",
+      help="for check: also store the new results")
+  parser.add_argument("--scale", default=None)
+  parser.add_argument("--engines", default=None)
+  parser.add_argument("--queries", default=None)
+  parser.add_argument("--repeat", type=int, default=None)
+  parser.add_argument("--results-dir", default=RESULTS_DIR)
+  args = parser.parse_args()
+
+  if args.command == "compare":
+    if len(args.files) != 2:
+      parser.error("compare needs a baseline and a new results file")
+    comps = compare(load(args.files[0]), load(args.files[1]), args.threshold)
+    print_comparison(comps)
+    sys.exit(failed(comps) and 1 or 0)
+
+  if args.command == "record":
+    config = dict(DEFAULT_CONFIG)
+    if args.scale:
+      config["scale"] = args.scale
+    if args.engines:
+      config["engines"] = args.engines.split(",")
+    if args.queries:
+      config["queries"] = args.queries.split(",")
+    if args.repeat:
+      config["repeat"] = args.repeat
+    doc = measure(config, "record")
+    path = save(doc, args.results_dir)
+    print "recorded %s" % path
+    if doc["dirty"]:
+      print "the working tree has changes, so this is not a baseline"
+    sys.exit(0)
+
+  basepath = args.baseline or latest(args.results_dir)
+  if basepath is None:
+    print "no baseline recorded on this machine (%s), run on a clean tree: python regress.py record" % fingerprint()
+    sys.exit(1)
+  base = load(basepath)
+  if base["fingerprint"] != fingerprint():
+    print "warning: %s was recorded on another machine" % basepath
+
+  if args.changed_only and not watched_changes(base["commit"]):
+    print "no watched files changed since %s, skipping" % base["commit"][:10]
+    sys.exit(0)
+
+  new = measure(base["config"], "check")
+  print "baseline %s (%s)" % (base["commit"][:10], basepath)
+  print "new      %s%s" % (new["commit"][:10], new["dirty"] and " (modified)" or "")
+  if args.save:
+    print "saved    %s" % save(new, args.results_dir)
+  comps = compare(base, new, args.threshold)
+  print_comparison(comps)
+  if failed(comps):
+    print "FAILED: performance regression against %s" % base["commit"][:10]
+    sys.exit(1)
@@ -0,0 +1,277 @@
+"""
+Benchmark runner.
+
+    python run.py --scale 100k --engines sql,hwx,compiler,compiler:vector
+
+generates (or reuses) the dataset for the scale factor, then runs every
+query of queries.QUERIES on every engine and reports, per engine and
+query:
+
+    rows      tuples the plan produced
+    p50/p90/p99
+              latency percentiles over the repetitions, in ms
+    rows/s    fact table rows processed per second at the median latency
+    peak MB   peak resident memory of the process that ran the query
+
+Before timing a query the runner checks that the engine produces as
+many rows as the compiler engine in row mode; an engine that does not
+gets an error instead of a timing.  Pairs in UNSUPPORTED are skipped.
+
+Engines are the interpretors in ../sql, ../hwx and ../compiler.
+"compiler:<mode>" runs the compiler engine with interpretor.execute()
+in that mode (row, vector, compiled or pull).  The engines share module
+names (ops, parser, interpretor), so every (engine, query) pair runs in
+its own python process, which also makes the peak memory its own.
+"""
+import os
+import sys
+import json
+import math
+import time
+import tempfile
+import resource
+import subprocess
+from queries import QUERIES, build, pyexpr
+from datagen import SCALES, scale_rows, generate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ENGINES = ["sql", "hwx", "compiler"]
+# the engine whose row counts the others are checked against
+REFERENCE = "compiler"
+
+# engine name -> {query: why it is not run}
+UNSUPPORTED = {
+  "sql": dict(orderby="OrderBy does not emit its tuples",
+              topn="OrderBy does not emit its tuples"),
+  "hwx": dict(orderby="OrderBy does not emit its tuples",
+              topn="OrderBy does not emit its tuples"),
+}
+
+
+def unsupported(engine, qname):
+  """
+  @return why the engine cannot run the query, or None
+  """
+  return UNSUPPORTED.get(engine.partition(":")[0], {}).get(qname)
+
+
+def percentile(vals, p):
+  """
+  nearest rank percentile of a non empty list
+  """
+  vals = sorted(vals)
+  idx = int(math.ceil(p / 100.0 * len(vals))) - 1
+  return vals[min(len(vals) - 1, max(0, idx))]
+
+
+def load_engine(engine):
+  """
+  Import the engine's modules.  Only one engine can be loaded per process.
+
+  @return function (query, paths) -> run(), where run() executes the
+          query once and returns the number of output tuples
+  """
+  name, _, mode = engine.partition(":")
+  sys.path.insert(0, os.path.join(HERE, "..", name))
+  sys.path.insert(0, os.path.join(HERE, "..", "common"))
+  import ops
+  import interpretor
+
+  if name == "compiler":
+    from parser import parseexpr
+    from optimizer import optimize
+    def prepare(q, paths):
+      plan = optimize(build(q.spec, ops, paths, parseexpr))
+      def run():
+        out = []
+        interpretor.execute(plan, out.append, mode or "row")
+        return len(out)
+      return run
+    return prepare
+
+  def prepare(q, paths):
+    def run():
+      # plans hold per-run state (e.g. Scan's header), rebuild every time
+      plan = build(q.spec, ops, paths, pyexpr, ascdesc=False)
+      out = []
+      interpretor.run_op(plan, out.append)
+      return len(out)
+    return run
+  return prepare
+
+
+def worker(engine, qname, paths, repeat, warmup):
+  """
+  Run one query on one engine, in this process, and return its stats
+  """
+  stdout = sys.stdout
+  # the engines print plans and debugging output
+  sys.stdout = open(os.devnull, "w")
+  try:
+    run = load_engine(engine)(QUERIES[qname], paths)
+    for i in xrange(warmup):
+      run()
+    times = []
+    for i in xrange(repeat):
+      start = time.time()
+      rows = run()
+      times.append(time.time() - start)
+  finally:
+    sys.stdout = stdout
+  return dict(
+    rows=rows,
+    times=times,
+    maxrss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  )
+
+
+def run_one(engine, qname, paths, repeat, warmup, timeout):
+  """
+  Run worker() in a child process
+
+  @return its stats, or a dict with an "error"
+  """
+  cmd = [sys.executable, os.path.abspath(__file__), "--worker",
+      json.dumps(dict(engine=engine, query=qname, paths=paths,
+        repeat=repeat, warmup=warmup))]
+  out, err = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+  proc = subprocess.Popen(cmd, stdout=out, stderr=err)
+  start = time.time()
+  while proc.poll() is None:
+    if timeout and time.time() - start > timeout:
+      proc.kill()
+      proc.wait()
+      return dict(error="timeout after %ss" % timeout)
+    time.sleep(0.05)
+
+  out.seek(0)
+  err.seek(0)
+  lines = out.read().strip().split("\n")
+  if proc.returncode != 0 or not lines[-1]:
+    errlines = err.read().strip().split("\n")
+    return dict(error=errlines[-1] or "exit status %d" % proc.returncode)
+  return json.loads(lines[-1])
+
+
+def summarize(stats, nrows):
+  """
+  add latency percentiles, throughput and peak memory to worker stats
+  """
+  if "error" in stats or "skipped" in stats:
+    return stats
+  times = stats["times"]
+  p50 = percentile(times, 50)
+  stats.update(
+    p50=p50,
+    p90=percentile(times, 90),
+    p99=percentile(times, 99),
+    rows_per_sec=p50 and nrows / p50 or 0.0,
+    peak_mb=stats["maxrss_kb"] / 1024.0
+  )
+  return stats
+
+
+def checked_run(engine, qname, paths, repeat, warmup, timeout, expected):
+  """
+  run_one(), unless the pair is unsupported or the engine's output has
+  a different number of rows than expected (None: not checked)
+  """
+  why = unsupported(engine, qname)
+  if why:
+    return dict(skipped=why)
+  stats = run_one(engine, qname, paths, repeat, warmup, timeout)
+  if "error" in stats or expected is None or stats["rows"] == expected:
+    return stats
+  return dict(error="wrong result: %d rows, %s produced %d" % (
+    stats["rows"], REFERENCE, expected))
+
+
+def run_benchmark(engines, qnames, paths, nrows, repeat=3, warmup=0,
+    timeout=None, out=sys.stdout, check=True):
+  """
+  @check  compare every result's row count with the REFERENCE engine's
+  @return list of result dicts, one per engine and query
+  """
+  expected = {}
+  if check:
+    for qname in qnames:
+      stats = run_one(REFERENCE, qname, paths, 1, 0, timeout)
+      if "error" in stats:
+        raise Exception("%s failed on %s: %s" % (REFERENCE, qname, stats["error"]))
+      expected[qname] = stats["rows"]
+
+  results = []
+  if out:
+    print >>out, "%-18s %-8s %10s %10s %10s %10s %12s %8s" % (
+      "engine", "query", "rows", "p50 ms", "p90 ms", "p99 ms", "rows/s", "peak MB")
+  for engine in engines:
+    for qname in qnames:
+      stats = summarize(checked_run(engine, qname, paths, repeat, warmup,
+        timeout, expected.get(qname)), nrows)
+      stats.update(engine=engine, query=qname)
+      results.append(stats)
+      if not out:
+        continue
+      if "skipped" in stats:
+        print >>out, "%-18s %-8s  skipped: %s" % (engine, qname, stats["skipped"])
+        continue
+      if "error" in stats:
+        print >>out, "%-18s %-8s  error: %s" % (engine, qname, stats["error"])
+        continue
+      print >>out, "%-18s %-8s %10d %10.1f %10.1f %10.1f %12.0f %8.1f" % (
+        engine, qname, stats["rows"], stats["p50"] * 1000, stats["p90"] * 1000,
+        stats["p99"] * 1000, stats["rows_per_sec"], stats["peak_mb"])
+      out.flush()
+  return results
+
+
+if __name__ == "__main__":
+  if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+    args = json.loads(sys.argv[2])
+    stats = worker(args["engine"], args["query"], args["paths"],
+        args["repeat"], args["warmup"])
+    print json.dumps(stats)
+    sys.exit(0)
+
+  import argparse
+
+  parser = argparse.ArgumentParser(description="run the benchmark query mix")
+  parser.add_argument("--scale", default="10k",
+      help="one of %s, or a number of rows" % ", ".join(sorted(SCALES)))
+  parser.add_argument("--engines", default=",".join(ENGINES),
+      help="comma separated, e.g. sql,hwx,compiler,compiler:vector")
+  parser.add_argument("--queries", default=",".join(QUERIES),
+      help="comma separated subset of %s" % ", ".join(QUERIES))
+  parser.add_argument("--data-dir", default=None,
+      help="where datasets are generated (default: data/ next to this file)")
+  parser.add_argument("--key-card", type=int, default=1000)
+  parser.add_argument("--group-card", type=int, default=100)
+  parser.add_argument("--skew", type=float, default=0.0)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--warmup", type=int, default=0)
+  parser.add_argument("--timeout", type=float, default=600,
+      help="seconds before a query is killed, 0 for no limit")
+  parser.add_argument("--no-check", action="store_true",
+      help="do not compare row counts with the %s engine" % REFERENCE)
+  parser.add_argument("--json", default=None, help="also write results to this file")
+  parser.add_argument("--list", action="store_true", help="print the queries and exit")
+  args = parser.parse_args()
+
+  if args.list:
+    for q in QUERIES.values():
+      print q
+    sys.exit(0)
+
+  nrows = scale_rows(args.scale)
+  datadir = os.path.join(args.data_dir or os.path.join(HERE, "data"),
+      "%s-k%d-g%d-s%g-r%d" % (args.scale, args.key_card, args.group_card, args.skew, args.seed))
+  paths = generate(datadir, nrows, key_card=args.key_card,
+      group_card=args.group_card, skew=args.skew, seed=args.seed)
+
+  results = run_benchmark(args.engines.split(","), args.queries.split(","),
+      paths, nrows, args.repeat, args.warmup, args.timeout,
+      check=not args.no_check)
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(dict(scale=args.scale, rows=nrows, results=results), f, indent=2)
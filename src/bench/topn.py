@@ -0,0 +1,145 @@
+"""
+Timing check of the TopN operator against sorting and then limiting.
+
+    python topn.py --scale 100k
+
+A TopN must never be slower than the ORDER BY + LIMIT it replaces.  On
+the facts table of the scale factor this times, with the compiler
+engine:
+
+    heap    extsort.TopNHeap against sorted()[:n], over tuples that
+            are already in memory, for an ascending, a descending and a
+            mixed direction (number and string) order
+    plan    the optimized plan of the topn query (a TopN) against the
+            same plan before optimization (OrderBy and Limit), in every
+            mode of --modes
+
+and exits 1 if a TopN's median time is more than --threshold slower
+than its sort + limit.
+"""
+import os
+import sys
+import time
+from queries import QUERIES, build
+from datagen import SCALES, scale_rows, generate
+from regress import median
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "compiler"))
+sys.path.insert(0, os.path.join(HERE, "..", "common"))
+
+# name -> (sort keys, descending)
+ORDERS = [
+  ("asc", ["v1"], [False]),
+  ("desc", ["v1"], [True]),
+  ("mixed", ["grp", "v1"], [True, False])
+]
+
+
+def timed(f, repeat):
+  """
+  @return median seconds of repeat calls of f
+  """
+  times = []
+  for i in xrange(repeat):
+    start = time.time()
+    f()
+    times.append(time.time() - start)
+  return median(times)
+
+
+def heap_checks(rows, limit, repeat):
+  """
+  @return list of (name, TopNHeap seconds, sort + limit seconds)
+  """
+  from extsort import TopNHeap
+  ret = []
+  for name, keys, desc in ORDERS:
+    funcs = [lambda t, k=k: t[k] for k in keys]
+    def topn():
+      heap = TopNHeap(funcs, desc, limit)
+      for tup in rows:
+        heap.add(tup)
+      return list(heap)
+    def sort_limit():
+      out = list(rows)
+      for f, d in reversed(zip(funcs, desc)):
+        out.sort(key=f, reverse=d)
+      return out[:limit]
+    if topn() != sort_limit():
+      raise Exception("TopNHeap and sorted() disagree on the %s order" % name)
+    ret.append(("heap " + name, timed(topn, repeat), timed(sort_limit, repeat)))
+  return ret
+
+
+def plan_checks(paths, modes, repeat):
+  """
+  @return list of (name, TopN plan seconds, OrderBy + Limit plan seconds)
+  """
+  import ops
+  import interpretor
+  from parser import parseexpr
+  from optimizer import optimize
+  spec = QUERIES["topn"].spec
+  ret = []
+  for mode in modes:
+    def runner(rewrite):
+      def run():
+        plan = build(spec, ops, paths, parseexpr)
+        if rewrite:
+          plan = optimize(plan)
+        out = []
+        interpretor.execute(plan, out.append, mode)
+        return out
+      return run
+    topn, sort_limit = runner(True), runner(False)
+    if not optimize(build(spec, ops, paths, parseexpr)).collect("TopN"):
+      raise Exception("the optimized topn query has no TopN")
+    if topn() != sort_limit():
+      raise Exception("TopN and OrderBy + Limit disagree in %s mode" % mode)
+    ret.append(("plan " + mode, timed(topn, repeat), timed(sort_limit, repeat)))
+  return ret
+
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description="time TopN against sort + limit")
+  parser.add_argument("--scale", default="100k",
+      help="one of %s, or a number of rows" % ", ".join(sorted(SCALES)))
+  parser.add_argument("--limit", type=int, default=10)
+  parser.add_argument("--modes", default="row,compiled,pull")
+  parser.add_argument("--repeat", type=int, default=5)
+  parser.add_argument("--threshold", type=float, default=0.1,
+      help="relative slowdown against sort + limit that fails the check")
+  parser.add_argument("--data-dir", default=None,
+      help="where datasets are generated (default: data/ next to this file)")
+  args = parser.parse_args()
+
+  nrows = scale_rows(args.scale)
+  datadir = os.path.join(args.data_dir or os.path.join(HERE, "data"),
+      "%s-k1000-g100-s0-r0" % args.scale)
+  paths = generate(datadir, nrows)
+
+  stdout = sys.stdout
+  # the engine prints plans and debugging output
+  sys.stdout = open(os.devnull, "w")
+  try:
+    from ops import Scan
+    rows = list(Scan(paths["facts"]))
+    checks = heap_checks(rows, args.limit, args.repeat)
+    checks.extend(plan_checks(paths, args.modes.split(","), args.repeat))
+  finally:
+    sys.stdout = stdout
+
+  failed = False
+  print "%-14s %10s %14s %7s" % ("check", "topn ms", "sort+limit ms", "ratio")
+  for name, topn, sort_limit in checks:
+    ratio = sort_limit and topn / sort_limit or 1.0
+    slow = ratio > 1 + args.threshold
+    failed = failed or slow
+    print "%-14s %10.1f %14.1f %6.2fx%s" % (
+        name, topn * 1000, sort_limit * 1000, ratio, slow and "  SLOWER" or "")
+  if failed:
+    print "FAILED: TopN is slower than sort + limit"
+    sys.exit(1)
@@ -0,0 +1,155 @@
+"""
+Lazy, chunked reading of csv tables, shared by the engines in ../sql,
+../hwx and ../compiler.
+
+A table is a csv file whose header row names and types its columns
+(a:num,b:str).  A ChunkedScan only opens its file when it is iterated,
+and then converts and holds chunk_size rows at a time; num cells are
+converted to floats.  Engines subclass it and override the hooks
+(reader, set_schema, picker, proc_file) they need.
+"""
+import csv
+from itertools import islice
+try:
+  import instabase.notebook.ipython.utils as ib
+except:
+  pass
+
+
+def open_table(filename):
+  openfile = open
+  try:
+    openfile = ib.open
+  except:
+    pass
+  return openfile(filename)
+
+def parse_header(header):
+  """
+  @return fields and types of a name:type header row
+  """
+  header = [v.split(":") for v in header]
+  return zip(*header)
+
+def sniff(f):
+  """
+  @return csv dialect of the file f, rewound to its start
+  """
+  dialect = csv.Sniffer().sniff(f.read(2048))
+  f.seek(0)
+  return dialect
+
+def to_rows(lines, fields, types):
+  """
+  row dicts of a chunk of csv rows, with the num cells converted
+  """
+  numfields = [field for field, t in zip(fields, types) if t == "num"]
+  rows = [dict(zip(fields, l)) for l in lines]
+  for row in rows:
+    for field in numfields:
+      row[field] = float(row[field])
+  return rows
+
+
+class OffsetFile(object):
+  """
+  Wraps a file so that iterating over it reads one line at a time and
+  offset is where the next line starts.  A csv reader over it can then
+  record where each row starts, and read the row at an offset after a
+  seek().  read() and seek() are for sniff()
+  """
+  def __init__(self, f):
+    self.f = f
+    self.offset = f.tell()
+
+  def read(self, size=-1):
+    data = self.f.read(size)
+    self.offset += len(data)
+    return data
+
+  def seek(self, offset):
+    self.f.seek(offset)
+    self.offset = offset
+
+  def __iter__(self):
+    return self
+
+  def next(self):
+    line = self.f.readline()
+    if not line:
+      raise StopIteration
+    self.offset += len(line)
+    return line
+
+
+class ChunkedScan(object):
+  # default number of rows read and converted at a time
+  chunk_size = 10000
+
+  def __init__(self, filename, chunk_size=None):
+    """
+    The file is only opened when the scan is executed, and then only
+    chunk_size rows are held in memory at a time
+    """
+    self.filename = filename
+    self.chunk_size = chunk_size or self.chunk_size
+
+  @property
+  def data(self):
+    """
+    All rows of the file as a list.  This loads the whole file; prefer
+    iterating over the scan or its chunks()
+    """
+    return list(self)
+
+  def open(self):
+    return open_table(self.filename)
+
+  def chunks(self):
+    """
+    Generate lists of at most chunk_size rows
+    """
+    with self.open() as f:
+      for rows in self.proc_file(f):
+        yield rows
+
+  def __iter__(self):
+    for rows in self.chunks():
+      for row in rows:
+        yield row
+
+  def reader(self, f):
+    """
+    csv reader over the rows of f, positioned after the header, whose
+    fields and types are passed to set_schema
+    """
+    reader = csv.reader(f, sniff(f))
+    self.set_schema(*parse_header(reader.next()))
+    return reader
+
+  def set_schema(self, fields, types):
+    self.fields = tuple(fields)
+    self.types = tuple(types)
+    return self.fields, self.types
+
+  def picker(self):
+    """
+    function that returns the cells of a csv row that are produced
+    """
+    return lambda l: l
+
+  def line_chunks(self, reader):
+    """
+    Generate lists of at most chunk_size picked csv rows
+    """
+    pick = self.picker()
+    while True:
+      lines = map(pick, islice(reader, self.chunk_size))
+      if not lines:
+        return
+      yield lines
+
+  def proc_file(self, f):
+    reader = self.reader(f)
+    for lines in self.line_chunks(reader):
+      yield to_rows(lines, self.fields, self.types)
@@ -0,0 +1,242 @@
+"""
+Persistent table catalog.
+
+The first Scan of a csv file sniffs its dialect and parses its
+name:type header; both are then recorded in the catalog together with
+the file's size and modification time.  Later Scans of the unchanged
+file, in this or any other process, take the dialect and schema from
+the catalog without sniffing or parsing the header, and the schema of
+a table is known without opening its file at all.
+
+Per table, the catalog also records
+
+    stats       the statistics of stats.py
+    indexes     the indexes declared with index.create_index
+    artifacts   files derived from the table (e.g. binary caches),
+                name -> description
+
+Everything but the index declarations belongs to one version of the
+file and is forgotten once its size or modification time change.
+
+The catalog is kept in memory unless the DB_CATALOG environment
+variable names its json file, e.g. DB_CATALOG=~/.dbcatalog.json.
+Changes are not written as they are made: save() writes the changed
+entries at once, after every interpretor.execute() and when the process
+exits, merged into the entries other processes wrote meanwhile.
+
+    python catalog.py             list the catalog
+    python catalog.py --clear     empty it
+"""
+import os
+import json
+import atexit
+import tempfile
+
+path = os.path.expanduser(os.environ.get("DB_CATALOG", ""))
+
+# dialect attributes stored, see csv.Dialect
+DIALECT_ATTRS = ("delimiter", "quotechar", "escapechar", "doublequote",
+    "skipinitialspace", "lineterminator", "quoting")
+
+# table path -> entry dict, loaded on first use
+entries = None
+# paths of the entries changed since the catalog was last saved
+dirty = set()
+
+
+def table_file(filename):
+  """
+  File of a table.  A bare table name is the name.csv file or, if
+  there is no such csv file, the name.tbl table file (tablefile.py) or
+  name.rgf row group file (rowgroup.py)
+  """
+  if "." in filename:
+    return filename
+  if not os.path.exists(filename + ".csv"):
+    for suffix in (".tbl", ".rgf"):
+      if os.path.exists(filename + suffix):
+        return filename + suffix
+  return filename + ".csv"
+
+def table_path(filename):
+  """
+  Absolute path of a table's file
+  """
+  return os.path.abspath(table_file(filename))
+
+def file_stamp(path):
+  st = os.stat(path)
+  return (st.st_size, st.st_mtime)
+
+
+def load():
+  global entries
+  if entries is None:
+    entries = read()
+  return entries
+
+def read():
+  if not path or not os.path.exists(path):
+    return {}
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except (IOError, ValueError):
+    return {}
+
+def save():
+  """
+  Write the changed entries to the catalog file.  Entries written by
+  other processes since it was loaded are kept.
+  """
+  if not path or not dirty:
+    return
+  ondisk = read()
+  for p in dirty:
+    if p in entries:
+      ondisk[p] = entries[p]
+    else:
+      ondisk.pop(p, None)
+  dirty.clear()
+  d = os.path.dirname(os.path.abspath(path))
+  try:
+    fd, tmp = tempfile.mkstemp(dir=d, prefix=".dbcatalog")
+    with os.fdopen(fd, "w") as f:
+      json.dump(ondisk, f)
+    os.rename(tmp, path)
+  except (IOError, OSError):
+    pass
+
+atexit.register(save)
+
+
+def entry(filename, create=False):
+  """
+  Catalog entry of the table, cleared of everything recorded for an
+  older version of its file
+
+  @return entry dict, or None if the table is not in the catalog (or
+          its file does not exist) and not create
+  """
+  p = table_path(filename)
+  try:
+    stamp = file_stamp(p)
+  except OSError:
+    return None
+  e = load().get(p)
+  if e is not None and (e["size"], e["mtime"]) != stamp:
+    e = dict(size=stamp[0], mtime=stamp[1], indexes=e.get("indexes", {}))
+    entries[p] = e
+    dirty.add(p)
+  if e is None and create:
+    e = entries[p] = dict(size=stamp[0], mtime=stamp[1], indexes={})
+  return e
+
+def update(filename, **kwargs):
+  e = entry(filename, create=True)
+  if e is None:
+    return
+  e.update(kwargs)
+  dirty.add(table_path(filename))
+
+
+def lookup(filename):
+  """
+  @return (csv dialect parameters, fields, types) of the table, or
+          None if they are not known for its current file
+  """
+  e = entry(filename)
+  if e is None or "fields" not in e:
+    return None
+  # json loads strings as unicode, which csv.reader does not accept
+  dialect = dict((str(k), encode(v)) for k, v in e["dialect"].items())
+  return dialect, map(encode, e["fields"]), map(encode, e["types"])
+
+def encode(v):
+  if isinstance(v, unicode):
+    return v.encode("utf-8")
+  return v
+
+def register(filename, dialect, fields, types):
+  """
+  Record the sniffed dialect and header of the table's current file
+  """
+  params = dict((a, getattr(dialect, a)) for a in DIALECT_ATTRS)
+  update(filename, dialect=params, fields=list(fields), types=list(types))
+
+
+def stats(filename):
+  e = entry(filename)
+  return e and e.get("stats")
+
+def set_stats(filename, stats):
+  update(filename, stats=stats)
+
+
+def indexes():
+  """
+  @return list of (table path, column, [kinds]) of the declared indexes
+  """
+  return [(p, col, kinds) for p, e in load().items()
+      for col, kinds in e.get("indexes", {}).items()]
+
+def set_indexes(filename, column, kinds):
+  e = entry(filename, create=True)
+  if e is None:
+    return
+  if kinds:
+    e["indexes"][column] = list(kinds)
+  else:
+    e["indexes"].pop(column, None)
+  dirty.add(table_path(filename))
+
+
+def artifact(filename, name):
+  e = entry(filename)
+  return e and e.get("artifacts", {}).get(name)
+
+def set_artifact(filename, name, value):
+  """
+  Record a file derived from the table's current file.  value None
+  forgets it
+  """
+  e = entry(filename, create=True)
+  if e is None:
+    return
+  artifacts = e.setdefault("artifacts", {})
+  if value is None:
+    artifacts.pop(name, None)
+  else:
+    artifacts[name] = value
+  dirty.add(table_path(filename))
+
+
+def drop(filename):
+  """
+  Forget the table
+  """
+  p = table_path(filename)
+  if load().pop(p, None) is not None:
+    dirty.add(p)
+
+
+if __name__ == "__main__":
+  import sys
+  if "--clear" in sys.argv[1:]:
+    for p in list(load()):
+      drop(p)
+    save()
+    sys.exit(0)
+  print "catalog: %s" % (path or "(in memory)")
+  for p, e in sorted(load().items()):
+    print p
+    print "  size %d, mtime %s" % (e["size"], e["mtime"])
+    if "fields" in e:
+      print "  columns %s" % ", ".join(
+          "%s:%s" % ft for ft in zip(e["fields"], e["types"]))
+    if e.get("stats"):
+      print "  stats: %d rows" % e["stats"]["rows"]
+    for col, kinds in sorted(e.get("indexes", {}).items()):
+      print "  index on %s (%s)" % (col, ", ".join(kinds))
+    for name, value in sorted(e.get("artifacts", {}).items()):
+      print "  %s: %s" % (name, value)
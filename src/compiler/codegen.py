@@ -0,0 +1,409 @@
+"""
+Whole-plan code generation.
+
+compiler.py shows that generating and exec-ing a filter function beats
+calling Filter.__call__ for every row.  This module does the same for
+entire plans built from ops.py.
+
+Every pipeline (a chain of operators between two pipeline breakers) is
+generated as one python function whose loops and expressions are
+inlined, so no closure or Op.__call__ is invoked per row.  Join build
+sides, GroupBy and OrderBy inputs are separate pipeline functions that
+fill a hash table, or the ExternalSorter that spills OrderBy's runs,
+which the parent pipeline then loops over.
+A Limit returns from the pipeline it belongs to once it is full.
+
+Compiled plans are cached by fingerprint, so running the same plan
+again (with fresh Scan objects) skips code generation.  The cache keeps
+the CACHE_SIZE most recently used plans.
+
+    run_compiled(plan, f)    run a plan, calling f for each output row
+    plan_source(plan)        the generated python source
+"""
+try:
+  import instabase.notebook.ipython.utils as ib
+  ib.import_pyfile('./interpretor.py', 'interpretor')
+except:
+  pass
+import numpy as np
+from interpretor import *
+from extsort import ExternalSorter, TopNHeap
+
+# most recently used plans kept by compile_plan
+CACHE_SIZE = 64
+
+# fingerprint -> (compiled function, source), least recently used first
+_cache = OrderedDict()
+
+funcs = dict(Func.agg_func_lookup)
+funcs.update(Func.scalar_func_lookup)
+
+unary_code = {
+  "+": "(+%s)",
+  "-": "(-%s)",
+  "not": "(not %s)"
+}
+
+binary_code = {
+  "+": "+", "/": "/", "*": "*", "-": "-",
+  "=": "==", "<>": "!=", "and": "and", "or": "or",
+  "<": "<", ">": ">", "<=": "<=", ">=": ">="
+}
+
+
+def fingerprint(node):
+  """
+  String that identifies a plan (or expression) up to object identity
+  """
+  if isinstance(node, Op):
+    attrs = []
+    for key, val in sorted(node.__dict__.items()):
+      if key == "p" or key.startswith("_"):
+        continue
+      attrs.append("%s=%s" % (key, fingerprint(val)))
+    if isinstance(node, Scan):
+      attrs.append("fields=%r" % (node.fields,))
+    return "%s(%s)" % (node.__class__.__name__, ", ".join(attrs))
+  if isinstance(node, (list, tuple)):
+    return "[%s]" % ", ".join(map(fingerprint, node))
+  return repr(node)
+
+def plan_scans(op):
+  """
+  Scans of the plan in a fixed order; the generated code refers to
+  them by position
+  """
+  scans = []
+  def visit(node):
+    if isinstance(node, Scan):
+      scans.append(node)
+    elif isinstance(node, UnaryOp):
+      visit(node.c)
+    elif isinstance(node, BinaryOp):
+      visit(node.l)
+      visit(node.r)
+  visit(op)
+  return scans
+
+class CodeGen(object):
+  def __init__(self, op):
+    self.n = 0
+    self.scans = plan_scans(op)
+    self.preludes = []
+
+  def var(self, prefix):
+    self.n += 1
+    return "%s%d" % (prefix, self.n)
+
+  def generate(self, op):
+    lines = ["def query(emit, scans):"]
+    def emit_f(v, ind):
+      return [I(ind) + "if emit(%s) == False: return" % v]
+    lines.extend(self.pipeline(op, emit_f, 1))
+    return "\n".join(lines) + "\n"
+
+  def pipeline(self, op, consume, ind):
+    """
+    define and call a function running op's pipeline
+    """
+    name = self.var("pipe")
+    self.preludes.append([])
+    body = self.produce(op, consume, ind + 1)
+    prelude = self.preludes.pop()
+    lines = [I(ind) + "def %s():" % name]
+    lines.extend([I(ind + 1) + l for l in prelude])
+    lines.extend(body or [I(ind + 1) + "pass"])
+    lines.append(I(ind) + "%s()" % name)
+    return lines
+
+  def produce(self, op, consume, ind):
+    """
+    @consume function(var, indent) that returns the code handling one
+             output tuple of op, stored in var
+    @return  lines of code that generate op's tuples
+    """
+    klass = op.__class__.__name__
+
+    if klass in ("Scan", "IndexScan"):
+      v = self.var("row")
+      idx = [i for i, s in enumerate(self.scans) if s is op][0]
+      return [I(ind) + "for %s in scans[%d]:" % (v, idx)] + consume(v, ind + 1)
+
+    if klass in ("Source", "SubQuerySource"):
+      return self.produce(op.c, consume, ind)
+
+    if klass == "Filter":
+      def filter_c(v, i):
+        return [I(i) + "if %s:" % self.expr(op.cond, v)] + consume(v, i + 1)
+      return self.produce(op.c, filter_c, ind)
+
+    if klass == "Project":
+      def project_c(v, i):
+        p = self.var("proj")
+        items = ["%r: %s" % (a, self.expr(e, v)) for e, a in zip(op.exprs, op.aliases)]
+        return [I(i) + "%s = {%s}" % (p, ", ".join(items))] + consume(p, i)
+      return self.produce(op.c, project_c, ind)
+
+    if klass == "Limit":
+      cnt = self.var("cnt")
+      self.preludes[-1].append("%s = 0" % cnt)
+      def limit_c(v, i):
+        code = [I(i) + "if %s >= %d: return" % (cnt, op.offset + op.limit),
+                I(i) + "%s += 1" % cnt]
+        if op.offset:
+          code.append(I(i) + "if %s > %d:" % (cnt, op.offset))
+          i += 1
+        return code + consume(v, i)
+      return self.produce(op.c, limit_c, ind)
+
+    if klass == "TopN":
+      heap = self.var("heap")
+      keys = []
+      for e in op.order_exprs:
+        t = self.var("t")
+        keys.append("lambda %s: %s" % (t, self.expr(e, t)))
+      def heap_c(v, i):
+        return [I(i) + "%s.add(%s)" % (heap, v)]
+      lines = [I(ind) + "%s = TopNHeap([%s], %r, %d, %d)" % (
+        heap, ", ".join(keys), op.descending(), op.limit, op.offset)]
+      lines.extend(self.pipeline(op.c, heap_c, ind))
+      v = self.var("row")
+      return lines + [I(ind) + "for %s in %s:" % (v, heap)] + consume(v, ind + 1)
+
+    if klass == "Print":
+      def print_c(v, i):
+        return [I(i) + "print %s" % v]
+      return self.produce(op.c, print_c, ind)
+
+    if klass == "IndexJoin":
+      return self.index_join(op, consume, ind)
+
+    if klass == "Join":
+      return self.join(op, consume, ind)
+
+    if klass == "GroupBy":
+      aggs = group_aggregates(op)
+      if aggs is not None and all(func.is_incremental() for func in aggs):
+        return self.incremental_group_by(op, aggs, consume, ind)
+      ht = self.var("ht")
+      def group_c(v, i):
+        k, g = self.var("key"), self.var("grp")
+        keyexprs = "".join(["%s, " % self.expr(e, v) for e in op.group_exprs])
+        return [
+          I(i) + "%s = (%s)" % (k, keyexprs),
+          I(i) + "%s = %s.get(%s)" % (g, ht, k),
+          I(i) + "if %s is None:" % g,
+          I(i + 1) + "%s = %s[%s] = [%s, None, []]" % (g, ht, k, k),
+          I(i) + "%s[1] = %s" % (g, v),
+          I(i) + "%s[2].append(%s)" % (g, v)
+        ]
+      lines = [I(ind) + "%s = {}" % ht]
+      lines.extend(self.pipeline(op.c, group_c, ind))
+      k, t, g, out = self.var("k"), self.var("t"), self.var("g"), self.var("gtup")
+      lines.extend([
+        I(ind) + "for %s, %s, %s in %s.itervalues():" % (k, t, g, ht),
+        I(ind + 1) + "%s = dict(%s)" % (out, t),
+        I(ind + 1) + "%s['__key__'] = %s" % (out, k),
+        I(ind + 1) + "%s['__group__'] = %s" % (out, g)
+      ])
+      return lines + consume(out, ind + 1)
+
+    if klass == "OrderBy":
+      sorter = self.var("sorter")
+      keys = []
+      for e in op.order_exprs:
+        t = self.var("t")
+        keys.append("lambda %s: %s" % (t, self.expr(e, t)))
+      def sorter_c(v, i):
+        return [I(i) + "%s.add(%s)" % (sorter, v)]
+      lines = [I(ind) + "%s = ExternalSorter([%s], %r, %r)" % (
+        sorter, ", ".join(keys), op.descending(), op.buffer_rows)]
+      lines.extend(self.pipeline(op.c, sorter_c, ind))
+      v = self.var("row")
+      # closing the sorter removes its run files when a Limit returns early
+      return lines + [
+        I(ind) + "try:",
+        I(ind + 1) + "for %s in %s:" % (v, sorter)
+      ] + consume(v, ind + 2) + [
+        I(ind) + "finally:",
+        I(ind + 1) + "%s.close()" % sorter
+      ]
+
+    raise Exception("can't generate code for %s" % klass)
+
+  def incremental_group_by(self, op, aggs, consume, ind):
+    """
+    GroupBy whose aggregates are all incremental: like GroupTable, every
+    group keeps one accumulator per aggregate instead of its tuples, and
+    the output tuples carry their values in "__aggs__"
+    """
+    specs = OrderedDict()
+    for func in aggs:
+      specs[str(func)] = func
+    ht = self.var("ht")
+    def group_c(v, i):
+      k, g, s = self.var("key"), self.var("grp"), self.var("states")
+      keyexprs = "".join(["%s, " % self.expr(e, v) for e in op.group_exprs])
+      inits = ", ".join(["states[%r]()" % func.name for func in specs.values()])
+      code = [
+        I(i) + "%s = (%s)" % (k, keyexprs),
+        I(i) + "%s = %s.get(%s)" % (g, ht, k),
+        I(i) + "if %s is None:" % g,
+        I(i + 1) + "%s = %s[%s] = [%s, None, [%s]]" % (g, ht, k, k, inits),
+        I(i) + "%s[1] = %s" % (g, v),
+        I(i) + "%s = %s[2]" % (s, g)
+      ]
+      for idx, func in enumerate(specs.values()):
+        code.append(I(i) + "%s[%d].add(%s)" % (s, idx, self.expr(func.args[0], v)))
+      return code
+    lines = [I(ind) + "%s = {}" % ht]
+    lines.extend(self.pipeline(op.c, group_c, ind))
+    k, t, s, out = self.var("k"), self.var("t"), self.var("s"), self.var("gtup")
+    values = ", ".join(["%r: %s[%d].value()" % (name, s, idx)
+        for idx, name in enumerate(specs)])
+    lines.extend([
+      I(ind) + "for %s, %s, %s in %s.itervalues():" % (k, t, s, ht),
+      I(ind + 1) + "%s = dict(%s)" % (out, t),
+      I(ind + 1) + "%s['__key__'] = %s" % (out, k),
+      I(ind + 1) + "%s['__aggs__'] = {%s}" % (out, values)
+    ])
+    return lines + consume(out, ind + 1)
+
+  def join(self, op, consume, ind):
+    lfields, rfields = schema(op.l), schema(op.r)
+    keys, residual = [], conjuncts(op.cond)
+    if lfields is not None and rfields is not None:
+      keys, residual = split_join_cond(op.cond, lfields, rfields)
+
+    build = self.var("build")
+    if keys:
+      def build_c(v, i):
+        key = "".join(["%s, " % self.expr(r, v) for l, r in keys])
+        return [I(i) + "%s.setdefault((%s), []).append(%s)" % (build, key, v)]
+      lines = [I(ind) + "%s = {}" % build]
+    else:
+      def build_c(v, i):
+        return [I(i) + "%s.append(%s)" % (build, v)]
+      lines = [I(ind) + "%s = []" % build]
+    lines.extend(self.pipeline(op.r, build_c, ind))
+
+    def probe_c(lv, i):
+      rv, j = self.var("right"), self.var("join")
+      if keys:
+        key = "".join(["%s, " % self.expr(l, lv) for l, r in keys])
+        code = [I(i) + "for %s in %s.get((%s), ()):" % (rv, build, key)]
+      else:
+        code = [I(i) + "for %s in %s:" % (rv, build)]
+      conds = [self.expr(c, lv, rv, lfields) for c in residual]
+      if conds:
+        code.append(I(i + 1) + "if %s:" % " and ".join(["(%s)" % c for c in conds]))
+        i += 1
+      code.extend([
+        I(i + 1) + "%s = dict(%s)" % (j, lv),
+        I(i + 1) + "%s.update(%s)" % (j, rv)
+      ])
+      return code + consume(j, i + 1)
+    return lines + self.produce(op.l, probe_c, ind)
+
+  def index_join(self, op, consume, ind):
+    inner, idx, fetch = op.inner(), self.var("idx"), self.var("fetch")
+    pos = [i for i, s in enumerate(self.scans) if s is inner][0]
+    lines = [
+      I(ind) + "%s = get_index(scans[%d], %r, %r)" % (idx, pos, op.column, op.kind),
+      I(ind) + "%s = scans[%d].fetcher()" % (fetch, pos)
+    ]
+    lfields = schema(op.l)
+
+    def probe_c(ov, i):
+      mv, j = self.var("match"), self.var("join")
+      lv, rv = op.index_side == "l" and (mv, ov) or (ov, mv)
+      code = [I(i) + "for %s in %s(%s.lookup(%s)):" % (mv, fetch, idx, self.expr(op.key, ov))]
+      conds = [self.expr(c, lv, rv, lfields) for c in op.residual]
+      if conds:
+        code.append(I(i + 1) + "if %s:" % " and ".join(["(%s)" % c for c in conds]))
+        i += 1
+      code.extend([
+        I(i + 1) + "%s = dict(%s)" % (j, lv),
+        I(i + 1) + "%s.update(%s)" % (j, rv)
+      ])
+      return code + consume(j, i + 1)
+    return lines + [I(ind) + "try:"] + self.produce(op.outer(), probe_c, ind + 1) + [
+      I(ind) + "finally:",
+      I(ind + 1) + "%s.close()" % fetch
+    ]
+
+  def expr(self, e, v, v2=None, lfields=None):
+    """
+    python source for expression e over the tuple in variable v (and
+    v2 for join conditions, where lfields are the fields of v if known)
+    """
+    klass = e.__class__.__name__
+    rec = lambda x: self.expr(x, v, v2, lfields)
+
+    if klass in ("Literal", "Bool"):
+      return repr(e.v)
+    if klass == "Attr":
+      if v2 is None or (lfields is not None and e.attr in lfields):
+        return "%s[%r]" % (v, e.attr)
+      if lfields is not None:
+        return "%s[%r]" % (v2, e.attr)
+      return "(%s[%r] if %r in %s else %s[%r])" % (v, e.attr, e.attr, v, v2, e.attr)
+    if klass == "Star":
+      return v
+    if klass == "Expr":
+      if e.r is None:
+        return unary_code[e.op.lower()] % rec(e.l)
+      if e.op not in binary_code:
+        return "True"
+      return "(%s %s %s)" % (rec(e.l), binary_code[e.op], rec(e.r))
+    if klass == "Between":
+      return "(%s <= %s <= %s)" % (rec(e.lower), rec(e.expr), rec(e.upper))
+    if klass == "Func":
+      if e.name in Func.agg_func_lookup:
+        # same argument shape as Func.__call__: one sequence per argument
+        g = self.var("g")
+        args = [self.expr(a, g) for a in e.args]
+        if len(args) == 1:
+          group = "funcs[%r]([%s for %s in %s['__group__']])" % (e.name, args[0], g, v)
+        else:
+          group = "funcs[%r](*zip(*[(%s) for %s in %s['__group__']]))" % (
+              e.name, ", ".join(args), g, v)
+        # incremental GroupBys computed the value already
+        return "(%s['__aggs__'][%r] if '__aggs__' in %s else %s)" % (v, str(e), v, group)
+      if e.name in Func.scalar_func_lookup:
+        return "funcs[%r](%s)" % (e.name, ", ".join(map(rec, e.args)))
+      raise Exception("I don't recognize function %s" % e.name)
+    raise Exception("can't generate code for expression %s" % e)
+
+
+def I(ind):
+  return "  " * ind
+
+def compile_plan(op):
+  """
+  @return (function(emit, scans), source) for the plan, from the cache
+          if an identical plan was compiled before
+  """
+  key = fingerprint(op)
+  if key in _cache:
+    _cache[key] = _cache.pop(key)
+    return _cache[key]
+  src = CodeGen(op).generate(op)
+  ns = dict(funcs=funcs, states=Func.agg_state_lookup, np=np,
+      ExternalSorter=ExternalSorter, TopNHeap=TopNHeap, get_index=get_index)
+  exec compile(src, "<plan>", "exec") in ns
+  _cache[key] = (ns["query"], src)
+  while len(_cache) > CACHE_SIZE:
+    _cache.popitem(last=False)
+  return _cache[key]
+
+def plan_source(op):
+  return compile_plan(op)[1]
+
+def run_compiled(op, f=lambda t:t):
+  """
+  Execute op with generated code and call f for every output tuple,
+  like run_op
+  """
+  query, src = compile_plan(op)
+  query(f, plan_scans(op))
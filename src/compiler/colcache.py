@@ -0,0 +1,326 @@
+"""
+Binary columnar cache of parsed csv files.
+
+The first Scan that reads a file to the end also writes the columns it
+parsed to the cache, in binary:
+
+    num columns   float64 values
+    other columns int32 codes into a sorted dictionary of the distinct
+                  strings, stored as one heap of bytes plus offsets
+
+Later Scans of the same version of the file (same path, size and
+modification time) memory map these files instead of parsing the csv:
+Scan.tables() slices the mapped arrays without copying and Scan.chunks()
+converts them to row dicts.
+
+The cache is off unless the DB_CACHE environment variable names its
+root directory, e.g. DB_CACHE=~/.dbcache.  Each version of a file gets
+its own directory under the root.  After every write the least
+recently used directories are removed until the cache holds at most
+max_bytes (DB_CACHE_BYTES, 8GB by default); directories of files that
+changed are removed first.
+
+Scans of the same file can run at the same time, e.g. both inputs of a
+self join, in one or several processes.  Only one of them per process
+writes the cache, and every writer spools to temporary files of its
+own, which are renamed into place when it finishes.
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import catalog
+from table import Table
+from catalog import table_path, file_stamp
+
+root = os.path.expanduser(os.environ.get("DB_CACHE", ""))
+max_bytes = int(os.environ.get("DB_CACHE_BYTES", 8 << 30))
+
+META = "meta.json"
+
+# cache directories that a CacheWriter of this process is writing
+writing = set()
+
+
+def cache_key(path, stamp):
+  return hashlib.sha1("%s|%d|%r" % (path, stamp[0], stamp[1])).hexdigest()[:16]
+
+def cache_dir(filename):
+  """
+  @return (table path, directory of its current version's cache), or
+          None if the cache is disabled or the file does not exist
+  """
+  if not root:
+    return None
+  path = table_path(filename)
+  try:
+    stamp = file_stamp(path)
+  except OSError:
+    return None
+  return path, os.path.join(root, cache_key(path, stamp))
+
+def read_meta(d):
+  try:
+    with open(os.path.join(d, META)) as f:
+      return json.load(f)
+  except (IOError, ValueError):
+    return None
+
+def write_meta(d, meta):
+  fd, tmp = tempfile.mkstemp(dir=d, prefix=META, suffix=".tmp")
+  with os.fdopen(fd, "w") as f:
+    json.dump(meta, f)
+  os.rename(tmp, os.path.join(d, META))
+
+
+class CachedTable(object):
+  """
+  The cached columns of a file
+  """
+  def __init__(self, d, meta):
+    self.dir = d
+    self.meta = meta
+    self.nrows = meta["nrows"]
+    self.arrays = {}
+    self.dictionaries = {}
+
+  def column(self, field):
+    """
+    memory mapped values (num columns) or codes (others) of a column
+    """
+    if field not in self.arrays:
+      info = self.meta["columns"][field]
+      dtype = info["type"] == "num" and np.float64 or np.int32
+      if self.nrows:
+        arr = np.memmap(os.path.join(self.dir, info["file"]), dtype=dtype,
+            mode="r", shape=(self.nrows,))
+      else:
+        arr = np.empty(0, dtype=dtype)
+      self.arrays[field] = arr
+    return self.arrays[field]
+
+  def dictionary(self, field):
+    if field not in self.dictionaries:
+      name = os.path.join(self.dir, self.meta["columns"][field]["file"])
+      offsets = np.fromfile(name + ".off", dtype=np.int64)
+      with open(name + ".dict", "rb") as f:
+        heap = f.read()
+      uniq = np.empty(len(offsets) - 1, dtype=object)
+      uniq[:] = [heap[offsets[i]:offsets[i+1]] for i in xrange(len(uniq))]
+      self.dictionaries[field] = uniq
+    return self.dictionaries[field]
+
+  def tables(self, fields, types, chunk_size):
+    """
+    Generate Tables of at most chunk_size rows over slices of the mapped
+    columns
+    """
+    dictionaries = dict((f, self.dictionary(f))
+        for f, t in zip(fields, types) if t != "num")
+    columns = dict((f, self.column(f)) for f in fields)
+    table = Table(fields, types, columns, dictionaries)
+    if not self.nrows:
+      yield table
+      return
+    for batch in table.batches(chunk_size):
+      yield batch
+
+  def rows(self, fields, types, chunk_size):
+    """
+    Generate lists of at most chunk_size row dicts, as Scan.proc_file
+    """
+    for table in self.tables(fields, types, chunk_size):
+      rows = list(table)
+      if rows:
+        yield rows
+
+
+def lookup(filename, fields):
+  """
+  @return CachedTable with the fields of the file's current version, or
+          None if some of them are not cached
+  """
+  found = cache_dir(filename)
+  if found is None:
+    return None
+  path, d = found
+  meta = read_meta(d)
+  if meta is None or not all(f in meta["columns"] for f in fields):
+    return None
+  try:
+    os.utime(os.path.join(d, META), None)
+  except OSError:
+    pass
+  return CachedTable(d, meta)
+
+
+class CacheWriter(object):
+  """
+  Writes the columns of a file to the cache as it is read chunk by
+  chunk.  Nothing is cached unless finish() is called, and every write
+  ends with finish() or abort().
+  """
+  def __init__(self, filename, fields, types, path, d):
+    self.filename = filename
+    self.path = path
+    self.dir = d
+    self.stamp = file_stamp(path)
+    self.fields = fields
+    self.types = types
+    self.nrows = 0
+    if not os.path.isdir(d):
+      os.makedirs(d)
+    self.names = [hashlib.md5(f).hexdigest()[:12] for f in fields]
+    self.tmps = []
+    self.files = []
+    try:
+      for name in self.names:
+        fd, tmp = tempfile.mkstemp(dir=d, prefix=name, suffix=".tmp")
+        self.tmps.append(tmp)
+        self.files.append(os.fdopen(fd, "wb"))
+    except:
+      self.abort()
+      raise
+    writing.add(d)
+    # value -> code of string columns, in first seen order
+    self.codes = [None if t == "num" else {} for t in types]
+
+  def add(self, lines):
+    """
+    @lines list of rows of raw csv cells, in fields order
+    """
+    if not lines:
+      return
+    self.nrows += len(lines)
+    for f, t, codes, cells in zip(self.files, self.types, self.codes, zip(*lines)):
+      if t == "num":
+        np.array(cells, dtype=np.float64).tofile(f)
+      else:
+        np.array([codes.setdefault(v, len(codes)) for v in cells], dtype=np.int32).tofile(f)
+
+  def abort(self):
+    """
+    Remove the temporary files
+    """
+    writing.discard(self.dir)
+    for f in self.files:
+      f.close()
+    for tmp in self.tmps:
+      for name in (tmp, tmp + ".off", tmp + ".dict"):
+        if os.path.exists(name):
+          os.remove(name)
+
+  def finish(self):
+    """
+    Move the written columns into the cache.  If that fails the
+    temporary files are removed and the error is raised
+    """
+    try:
+      for f in self.files:
+        f.close()
+      if file_stamp(self.path) != self.stamp:
+        self.abort()
+        return
+      meta = read_meta(self.dir) or dict(path=self.path, nrows=self.nrows, columns={})
+      for field, t, name, tmp, codes in zip(self.fields, self.types, self.names,
+          self.tmps, self.codes):
+        final = os.path.join(self.dir, name)
+        if codes is not None:
+          self.write_dictionary(tmp, codes)
+          os.rename(tmp + ".off", final + ".off")
+          os.rename(tmp + ".dict", final + ".dict")
+        os.rename(tmp, final)
+        meta["columns"][field] = dict(file=name, type=t == "num" and "num" or "str")
+      # columns only count as cached once meta lists them
+      write_meta(self.dir, meta)
+    except:
+      self.abort()
+      raise
+    writing.discard(self.dir)
+    catalog.set_artifact(self.filename, "colcache", self.dir)
+    evict(keep=self.dir)
+
+  def write_dictionary(self, tmp, codes):
+    """
+    Write the sorted dictionary of a string column next to its codes
+    (tmp.off, tmp.dict) and renumber the codes written so far in first
+    seen order
+    """
+    uniq = sorted(codes)
+    remap = np.empty(len(uniq), dtype=np.int32)
+    for i, v in enumerate(uniq):
+      remap[codes[v]] = i
+    if self.nrows:
+      arr = np.memmap(tmp, dtype=np.int32, mode="r+", shape=(self.nrows,))
+      step = 1 << 20
+      for lo in xrange(0, self.nrows, step):
+        arr[lo:lo+step] = remap[arr[lo:lo+step]]
+      arr.flush()
+      del arr
+    offsets = np.zeros(len(uniq) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(v) for v in uniq])
+    offsets.tofile(tmp + ".off")
+    with open(tmp + ".dict", "wb") as f:
+      f.write("".join(uniq))
+
+
+def writer(filename, fields, types):
+  """
+  CacheWriter for a scan of fields, or None if they are already cached,
+  another scan of this process is writing the file's cache (or it
+  cannot be cached)
+  """
+  found = cache_dir(filename)
+  if found is None or found[1] in writing or lookup(filename, fields) is not None:
+    return None
+  try:
+    return CacheWriter(filename, fields, types, *found)
+  except (IOError, OSError):
+    return None
+
+
+def dir_size(d):
+  size = 0
+  for name in os.listdir(d):
+    try:
+      size += os.path.getsize(os.path.join(d, name))
+    except OSError:
+      pass
+  return size
+
+def evict(keep=None):
+  """
+  Remove the directories of files that changed, then the least recently
+  used ones until the cache holds at most max_bytes
+  """
+  if not root or not os.path.isdir(root):
+    return
+  dirs = []
+  for name in os.listdir(root):
+    d = os.path.join(root, name)
+    meta = read_meta(d)
+    if meta is None:
+      # unfinished (or concurrent) first write
+      continue
+    found = cache_dir(meta["path"])
+    if found is None or found[1] != d:
+      shutil.rmtree(d, ignore_errors=True)
+      continue
+    used = os.path.getmtime(os.path.join(d, META))
+    dirs.append((used, d, dir_size(d), meta["path"]))
+
+  total = sum(size for _, _, size, _ in dirs)
+  for used, d, size, path in sorted(dirs):
+    if total <= max_bytes:
+      break
+    if d == keep:
+      continue
+    shutil.rmtree(d, ignore_errors=True)
+    catalog.set_artifact(path, "colcache", None)
+    total -= size
+
+def clear():
+  if root and os.path.isdir(root):
+    shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,164 @@
+"""
+EXPLAIN ANALYZE for plans run by run_op.
+
+    report = explain_analyze("EXPLAIN ANALYZE SELECT ...")
+    print report.text()
+    report.to_json()        # nested dicts, ready for json.dumps
+
+Every time run_op executes an operator the analyzer counts a loop and
+wraps the callback it passes up, so it can count output rows and tell
+the time spent in the operator's subtree from the time spent by its
+consumers.  For every operator the report has:
+
+    loops     number of times the subtree was executed
+    rows_in   tuples received from its children
+    rows_out  tuples passed to its parent
+    time      seconds spent in the operator and its children
+    self      time minus the time of its children
+"""
+try:
+  import instabase.notebook.ipython.utils as ib
+  ib.import_pyfile('./interpretor.py', 'interpretor')
+  ib.import_pyfile('./optimizer.py', 'optimizer')
+except:
+  pass
+import re
+import json
+import time
+import interpretor
+from interpretor import *
+from optimizer import optimize
+
+
+class OpStats(object):
+  def __init__(self):
+    self.loops = 0
+    self.rows = 0
+    self.total = 0.0
+    self.downstream = 0.0
+
+  @property
+  def time(self):
+    return self.total - self.downstream
+
+
+class Analyzer(object):
+  """
+  Installed as interpretor.tracer while a plan runs
+  """
+  def __init__(self):
+    self.stats = {}
+
+  def get(self, op):
+    if id(op) not in self.stats:
+      self.stats[id(op)] = OpStats()
+    return self.stats[id(op)]
+
+  def run(self, op, f, run_f):
+    st = self.get(op)
+    st.loops += 1
+    clock = time.time
+
+    def counted_f(tup):
+      st.rows += 1
+      start = clock()
+      ret = f(tup)
+      st.downstream += clock() - start
+      return ret
+
+    start = clock()
+    try:
+      return run_f(op, counted_f)
+    finally:
+      st.total += clock() - start
+
+  def wrap_expr(self, e, fn):
+    return fn
+
+
+def plan_children(op):
+  if isinstance(op, Scan):
+    return []
+  if isinstance(op, UnaryOp):
+    return [op.c]
+  if isinstance(op, BinaryOp):
+    return [op.l, op.r]
+  if isinstance(op, NaryOp):
+    return list(op.cs)
+  return []
+
+def label(op):
+  """
+  One line description of op, taken from its __str__
+  """
+  if isinstance(op, IndexJoin):
+    return "INDEX JOIN: ON %s USING %s(%s)" % (op.cond, op.kind, op.column)
+  if isinstance(op, Join):
+    return "JOIN: ON %s" % op.cond
+  return str(op).split("\n")[0]
+
+
+class Report(object):
+  def __init__(self, plan, analyzer, elapsed):
+    self.plan = plan
+    self.analyzer = analyzer
+    self.elapsed = elapsed
+
+  def node(self, op):
+    st = self.analyzer.stats.get(id(op), OpStats())
+    children = [self.node(c) for c in plan_children(op)]
+    child_time = sum([c["time"] for c in children])
+    return dict(
+      op=op.__class__.__name__,
+      label=label(op),
+      loops=st.loops,
+      rows_in=sum([c["rows_out"] for c in children]),
+      rows_out=st.rows,
+      time=st.time,
+      self=max(0.0, st.time - child_time),
+      children=children
+    )
+
+  def to_json(self):
+    return dict(total_time=self.elapsed, plan=self.node(self.plan))
+
+  def json(self, **kwargs):
+    return json.dumps(self.to_json(), **kwargs)
+
+  def text(self):
+    lines = []
+    def visit(node, depth):
+      prefix = depth and ("  " * depth + "-> ") or ""
+      lines.append("%s%s  (loops=%d rows_in=%d rows_out=%d time=%.3fms self=%.3fms)" % (
+        prefix, node["label"], node["loops"], node["rows_in"], node["rows_out"],
+        node["time"] * 1000, node["self"] * 1000))
+      for child in node["children"]:
+        visit(child, depth + 1)
+    visit(self.to_json()["plan"], 0)
+    lines.append("Total time: %.3fms" % (self.elapsed * 1000))
+    return "\n".join(lines)
+
+  def __str__(self):
+    return self.text()
+
+
+def explain_analyze(q, f=lambda t:t):
+  """
+  Run a plan under the analyzer and return its Report
+
+  @q  a plan, or a SQL string (optionally prefixed with EXPLAIN ANALYZE)
+      that is parsed and optimized first
+  @f  called for every output tuple, as in run_op
+  """
+  if isinstance(q, basestring):
+    q = re.sub(r"^\s*EXPLAIN\s+ANALYZE\s+", "", q, flags=re.I)
+    q = optimize(parse(q))
+
+  analyzer = Analyzer()
+  prev, interpretor.tracer = interpretor.tracer, analyzer
+  start = time.time()
+  try:
+    run_op(q, f)
+  finally:
+    interpretor.tracer = prev
+  return Report(q, analyzer, time.time() - start)
@@ -0,0 +1,231 @@
+"""
+External merge sort used by OrderBy, and the bounded heap of TopN.
+
+Tuples are sorted in memory until the buffer holds about
+SORT_BUFFER_BYTES of tuples (or buffer_rows tuples if given).  The
+buffer is then sorted and written to a temporary file as a run.  When
+the input ends the runs and the buffer are merged with heapq.merge and
+tuples are generated one at a time, so a consumer that stops early
+(e.g. Limit) does not pay for the rest of the merge.
+
+Sort keys are plain python values or tuples of them, so every
+comparison runs in C: descending numbers are negated, descending byte
+strings are replaced by a byte string that sorts in the reverse order,
+and only other descending values are wrapped in Descending.
+"""
+import os
+import sys
+import heapq
+import tempfile
+from operator import itemgetter
+import cPickle as pickle
+
+# memory for the tuples an ExternalSorter sorts before spilling a run
+SORT_BUFFER_BYTES = 512 << 20
+# tuples whose size is measured to estimate the tuples per run
+SIZE_SAMPLE = 100
+NUMBERS = frozenset([int, long, float, bool])
+# maps every byte b to 255 - b
+INVERTED = "".join(map(chr, reversed(xrange(256))))
+
+
+class Descending(object):
+  """
+  Value that sorts in the reverse order of v
+  """
+  __slots__ = ("v",)
+
+  def __init__(self, v):
+    self.v = v
+
+  def __lt__(self, other):
+    return other.v < self.v
+
+  def __eq__(self, other):
+    return self.v == other.v
+
+  def __ne__(self, other):
+    return self.v != other.v
+
+  def __getstate__(self):
+    return self.v
+
+  def __setstate__(self, v):
+    self.v = v
+
+
+def descending_value(v):
+  if type(v) in NUMBERS:
+    return -v
+  if type(v) is str:
+    # escaping NUL and terminating with two makes the strings prefix
+    # free without changing their order, so inverting every byte
+    # reverses it
+    if "\0" in v:
+      v = v.replace("\0", "\0\xff")
+    return (v + "\0\0").translate(INVERTED)
+  return Descending(v)
+
+def sort_key(key_funcs, descending):
+  """
+  @return function that maps a tuple to its sort key, generated so that
+          no closure is called per key column
+  """
+  if len(key_funcs) == 1 and not descending[0]:
+    return key_funcs[0]
+  ns = dict(desc=descending_value)
+  terms = []
+  for i, (f, desc) in enumerate(zip(key_funcs, descending)):
+    ns["f%d" % i] = f
+    terms.append(desc and "desc(f%d(tup))" % i or "f%d(tup)" % i)
+  if len(terms) == 1:
+    return eval("lambda tup: %s" % terms[0], ns)
+  return eval("lambda tup: (%s)" % "".join([t + ", " for t in terms]), ns)
+
+def tuple_bytes(tup):
+  """
+  estimated memory of a tuple (a dict) and its values
+  """
+  return sys.getsizeof(tup) + sum(map(sys.getsizeof, tup.itervalues()))
+
+
+class TopNHeap(object):
+  """
+  Keeps the first offset+limit tuples in sort order, so ORDER BY ...
+  LIMIT n needs O(n) memory.  Entries are (key, seq, tuple), where seq
+  keeps ties in arrival order.  Once the entries outgrow twice the size
+  they are cut down with heapq.nsmallest, and later tuples whose key is
+  not below the last kept key are dropped after one comparison.  When
+  every key is descending the keys are kept as they are and the entries
+  are cut down with heapq.nlargest instead.
+  """
+  def __init__(self, key_funcs, descending, limit, offset=0):
+    self.reverse = bool(descending) and all(descending)
+    if self.reverse:
+      self.key = sort_key(key_funcs, [False] * len(key_funcs))
+      self.first = heapq.nlargest
+    else:
+      self.key = sort_key(key_funcs, descending)
+      self.first = heapq.nsmallest
+    self.limit = limit
+    self.offset = offset
+    self.size = limit + offset
+    self.entries = []
+    # key of the last kept entry once the entries were cut down
+    self.worst = None
+    self.pruned = False
+    self.seq = 0
+
+  def add(self, tup):
+    if self.size <= 0:
+      return
+    key = self.key(tup)
+    if self.pruned:
+      if self.reverse and not key > self.worst:
+        return
+      if not self.reverse and not key < self.worst:
+        return
+    # with nlargest, earlier tuples need the larger seq
+    self.seq += 1
+    self.entries.append((key, self.reverse and -self.seq or self.seq, tup))
+    if len(self.entries) >= 2 * self.size + 64:
+      self.prune()
+
+  def prune(self):
+    self.entries = self.first(self.size, self.entries)
+    self.worst = self.entries[-1][0]
+    self.pruned = True
+
+  def __iter__(self):
+    for key, seq, tup in self.first(self.size, self.entries)[self.offset:]:
+      yield tup
+
+
+class ExternalSorter(object):
+  def __init__(self, key_funcs, descending, buffer_rows=None, tmpdir=None):
+    """
+    @key_funcs   functions that compute each sort column from a tuple
+    @descending  booleans, one per key function
+    @buffer_rows max tuples kept in memory before spilling a run,
+                 estimated from SORT_BUFFER_BYTES if None
+    @tmpdir      directory for run files, system default if None
+    """
+    self.key = sort_key(key_funcs, descending)
+    self.buffer_rows = buffer_rows or sys.maxint
+    self.estimate = not buffer_rows
+    self.tmpdir = tmpdir
+    self.buffer = []
+    self.runs = []
+
+  def add(self, tup):
+    if len(self.buffer) >= self.buffer_rows:
+      self.spill()
+    self.buffer.append((self.key(tup), tup))
+    if self.estimate and len(self.buffer) == SIZE_SAMPLE:
+      self.estimate = False
+      sample = sum([tuple_bytes(t) for k, t in self.buffer])
+      self.buffer_rows = max(SIZE_SAMPLE, SORT_BUFFER_BYTES * SIZE_SAMPLE // sample)
+
+  def sort_buffer(self):
+    # stable, and only the keys are compared
+    self.buffer.sort(key=itemgetter(0))
+
+  def spill(self):
+    self.sort_buffer()
+    fd, path = tempfile.mkstemp(prefix="sortrun", dir=self.tmpdir)
+    with os.fdopen(fd, "wb") as f:
+      pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+      for kt in self.buffer:
+        pickler.dump(kt)
+        # the pickler would otherwise remember every tuple it wrote
+        pickler.clear_memo()
+    self.runs.append(path)
+    self.buffer = []
+
+  def read_run(self, path, i):
+    """
+    (key, i, tuple) for the tuples of a run; i orders equal keys by run
+    and keeps heapq.merge from comparing tuples
+    """
+    with open(path, "rb") as f:
+      unpickler = pickle.Unpickler(f)
+      while True:
+        try:
+          key, tup = unpickler.load()
+        except EOFError:
+          return
+        yield key, i, tup
+
+  def __iter__(self):
+    """
+    Generate the tuples in sorted order.  Run files are removed once
+    the generator finishes or is closed.
+    """
+    runs = []
+    try:
+      self.sort_buffer()
+      if not self.runs:
+        for keys, tup in self.buffer:
+          yield tup
+        return
+
+      # the buffer holds the last tuples, so it merges as the last run
+      last = len(self.runs)
+      runs = [self.read_run(path, i) for i, path in enumerate(self.runs)]
+      merged = runs + [((key, last, tup) for key, tup in self.buffer)]
+      for key, i, tup in heapq.merge(*merged):
+        yield tup
+    finally:
+      for run in runs:
+        # closes the run file
+        run.close()
+      self.close()
+
+  def close(self):
+    self.buffer = []
+    for path in self.runs:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+    self.runs = []
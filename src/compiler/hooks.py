@@ -0,0 +1,239 @@
+"""
+Profiling and tracing hooks for run_op.
+
+Subclass Hooks, override the methods you need and attach an instance
+while running a query:
+
+    class Metrics(Hooks):
+      def op_close(self, op, stats):
+        send("op.%s.rows" % op.__class__.__name__, stats["rows"])
+
+    with attach(plan, Metrics()):
+      run_op(plan)
+
+When nothing is attached run_op does not wrap anything: it checks
+interpretor.tracer once per operator execution and never per tuple.
+The run_op of ../sql and ../hwx have the same check, and attach()
+traces the engine whose ops module defines the plan's operators.
+
+Hook methods (all optional):
+
+    start()              the hooks were attached
+    stop()               the hooks were detached
+    op_open(op)          an operator starts executing.  An operator can
+                         execute more than once, e.g. the inner input
+                         of a block nested loop join
+    op_close(op, stats)  it finished.  stats is a dict with
+                           rows     tuples it produced
+                           seconds  wall time, including the time its
+                                    consumers spent on those tuples
+                           memory_before, memory_after
+                                    memory_snapshot() results, only if
+                                    the hook sets memory = True
+                           memory_delta_kb
+                                    change of the current resident
+                                    size while it ran, likewise
+    row(op, tup)         every sample_every-th tuple each operator
+                         produces; only called if sample_every > 0
+    expr_eval(e)         every evaluation of an expression bound by
+                         run_op or the pull executor (volcano.py);
+                         only called if count_exprs is True
+"""
+try:
+  import instabase.notebook.ipython.utils as ib
+  ib.import_pyfile('./interpretor.py', 'interpretor')
+except:
+  pass
+import os
+import sys
+import time
+import resource
+from collections import defaultdict
+from contextlib import contextmanager
+import interpretor
+
+
+def current_rss_kb():
+  """
+  Current resident set size of this process, or None where /proc is
+  not available
+  """
+  try:
+    with open("/proc/self/statm") as f:
+      pages = int(f.read().split()[1])
+  except (IOError, OSError, IndexError, ValueError):
+    return None
+  return pages * resource.getpagesize() // 1024
+
+
+def memory_snapshot():
+  """
+  rss_kb     current resident set size (None without /proc)
+  maxrss_kb  peak resident set size of this process so far.  It only
+             grows, so it shows an operator's footprint only if the
+             operator raised the peak
+  """
+  return dict(
+    rss_kb=current_rss_kb(),
+    maxrss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  )
+
+
+class Hooks(object):
+  # call row() for every sample_every-th output tuple (0 = never)
+  sample_every = 0
+  # call expr_eval() for every expression evaluation
+  count_exprs = False
+  # include memory snapshots in op_close() stats
+  memory = False
+
+  def start(self):
+    pass
+
+  def stop(self):
+    pass
+
+  def op_open(self, op):
+    pass
+
+  def op_close(self, op, stats):
+    pass
+
+  def row(self, op, tup):
+    pass
+
+  def expr_eval(self, e):
+    pass
+
+
+class HookTracer(object):
+  """
+  interpretor.tracer that calls a list of Hooks.  Wraps the previously
+  installed tracer, if any, so hooks can be combined with other tracers
+  """
+  def __init__(self, hooks, prev=None):
+    self.hooks = hooks
+    self.prev = prev
+    self.samplers = [h for h in hooks if h.sample_every > 0]
+    self.counters = [h for h in hooks if h.count_exprs]
+    self.memory = any(h.memory for h in hooks)
+
+  def run(self, op, f, run_f):
+    for h in self.hooks:
+      h.op_open(op)
+
+    rows = [0]
+    samplers = self.samplers
+    def hooked_f(tup):
+      rows[0] += 1
+      for h in samplers:
+        if rows[0] % h.sample_every == 0:
+          h.row(op, tup)
+      return f(tup)
+
+    before = self.memory and memory_snapshot()
+    start = time.time()
+    try:
+      if self.prev is not None:
+        return self.prev.run(op, hooked_f, run_f)
+      return run_f(op, hooked_f)
+    finally:
+      stats = dict(rows=rows[0], seconds=time.time() - start)
+      if self.memory:
+        after = memory_snapshot()
+        stats["memory_before"] = before
+        stats["memory_after"] = after
+        if before["rss_kb"] is not None and after["rss_kb"] is not None:
+          stats["memory_delta_kb"] = after["rss_kb"] - before["rss_kb"]
+      for h in self.hooks:
+        h.op_close(op, stats)
+
+  def wrap_expr(self, e, fn):
+    if self.prev is not None:
+      fn = self.prev.wrap_expr(e, fn)
+    counters = self.counters
+    if not counters:
+      return fn
+    def counted_fn(*args):
+      for h in counters:
+        h.expr_eval(e)
+      return fn(*args)
+    return counted_fn
+
+
+def engine_of(op):
+  """
+  interpretor module of the engine (this one, ../sql or ../hwx) whose
+  ops module defines op's class: the loaded interpretor module in the
+  same directory
+  """
+  ops = sys.modules.get(op.__class__.__module__)
+  opsfile = getattr(ops, "__file__", None)
+  if opsfile is None:
+    return interpretor
+  opsdir = os.path.dirname(os.path.abspath(opsfile))
+  for module in sys.modules.values():
+    filename = getattr(module, "__file__", None)
+    if (filename and hasattr(module, "tracer") and
+        os.path.dirname(os.path.abspath(filename)) == opsdir and
+        os.path.basename(filename).split(".")[0] == "interpretor"):
+      return module
+  raise Exception("no interpretor module is loaded for the operators of %s" % opsfile)
+
+@contextmanager
+def attach(plan, *hooks):
+  """
+  Attach hooks to every run_op call made inside the with block, in the
+  engine that runs plan (see engine_of)
+  """
+  engine = engine_of(plan)
+  prev = engine.tracer
+  engine.tracer = HookTracer(list(hooks), prev)
+  for h in hooks:
+    h.start()
+  try:
+    yield
+  finally:
+    engine.tracer = prev
+    for h in hooks:
+      h.stop()
+
+
+class ProfileHooks(Hooks):
+  """
+  Run cProfile while the hooks are attached
+  """
+  def __init__(self, sortby="cumulative"):
+    import cProfile
+    self.profile = cProfile.Profile()
+    self.sortby = sortby
+
+  def start(self):
+    self.profile.enable()
+
+  def stop(self):
+    self.profile.disable()
+
+  def print_stats(self, out=sys.stdout):
+    import pstats
+    pstats.Stats(self.profile, stream=out).sort_stats(self.sortby).print_stats(20)
+
+
+class CountHooks(Hooks):
+  """
+  Count operator executions, output tuples and expression evaluations
+  """
+  count_exprs = True
+
+  def __init__(self):
+    self.ops = defaultdict(lambda: dict(loops=0, rows=0, seconds=0.0))
+    self.exprs = defaultdict(int)
+
+  def op_close(self, op, stats):
+    counts = self.ops[op.__class__.__name__]
+    counts["loops"] += 1
+    counts["rows"] += stats["rows"]
+    counts["seconds"] += stats["seconds"]
+
+  def expr_eval(self, e):
+    self.exprs[str(e)] += 1
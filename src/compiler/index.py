@@ -0,0 +1,260 @@
+"""
+Secondary indexes on Scan columns.
+
+    create_index("data.csv", "a")              # hash index, for a = v
+    create_index("data.csv", "b", "sorted")    # for <, <=, >, >=, =, BETWEEN
+
+Declaring an index is cheap: it is built the first time a query uses it
+by one pass over the file that only parses the indexed column.  Declarations
+are recorded in the table catalog (catalog.py), so they hold for later
+processes too when the catalog is saved to a file.
+
+optimizer.index_rewrite turns a Filter directly over a Scan whose
+condition has a sargable conjunct on an indexed column into an
+IndexScan, which only produces the matching rows.
+
+Indexes hold the column's values, sorted, and the positions of their
+rows (Scan.column_positions: byte offsets in csv files, row numbers in
+native table files).  Lookups return positions, and Scan.fetcher()
+reads just the rows at them.
+
+A built index is kept in memory and shared by every later query and
+Scan of the same file.  If the DB_INDEX environment variable names a
+directory (e.g. DB_INDEX=~/.dbindex) it is also saved there, one file
+per table, column and kind, so later processes load it instead of
+building it again; without DB_INDEX indexes are only kept in memory.
+A saved index records the size and modification time of the table
+file it was built from.  It is not loaded once they change: the index
+is built again and overwrites it.  The file is also recorded as an
+artifact of the table in the catalog, and drop_index removes it.
+"""
+import os
+import hashlib
+import numpy as np
+from collections import defaultdict
+import catalog
+from catalog import table_path, file_stamp
+
+KINDS = ("hash", "sorted")
+
+root = os.path.expanduser(os.environ.get("DB_INDEX", ""))
+
+
+class Index(object):
+  def __init__(self, column):
+    self.column = column
+    self.keys = np.empty(0)
+    self.positions = np.empty(0, dtype=np.int64)
+
+  def build(self, values, positions):
+    """
+    @values     the column's values
+    @positions  positions of their rows, in the same order
+    """
+    order = np.argsort(values, kind="mergesort")
+    self.set(values[order], positions[order])
+
+  def set(self, keys, positions):
+    """
+    @keys       sorted values
+    @positions  positions of their rows
+    """
+    self.keys = keys
+    self.positions = positions
+
+  def save(self, path, stamp):
+    """
+    @stamp  file_stamp() of the table file the index was built from
+    """
+    keys = self.keys
+    if keys.dtype == object:
+      keys = np.array(keys.tolist(), dtype=str)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+      np.savez(f, keys=keys, positions=self.positions, stamp=np.array(stamp, dtype=float))
+    os.rename(tmp, path)
+
+  def load(self, path, stamp):
+    """
+    @return False, without loading, if the index was saved for another
+            version of the table file than stamp
+    """
+    data = np.load(path, allow_pickle=False)
+    if tuple(data["stamp"].tolist()) != tuple(map(float, stamp)):
+      return False
+    keys = data["keys"]
+    if keys.dtype.kind == "S":
+      keys = keys.astype(object)
+    self.set(keys, data["positions"])
+    return True
+
+  def __len__(self):
+    return len(self.positions)
+
+
+class HashIndex(Index):
+  kind = "hash"
+
+  def set(self, keys, positions):
+    super(HashIndex, self).set(keys, positions)
+    # value -> (start, end) of its run of positions
+    self.table = {}
+    keys = keys.tolist()
+    start = 0
+    for i in xrange(1, len(keys) + 1):
+      if i == len(keys) or keys[i] != keys[start]:
+        self.table[keys[start]] = (start, i)
+        start = i
+
+  def lookup(self, v):
+    start, end = self.table.get(v, (0, 0))
+    return self.positions[start:end]
+
+
+class SortedIndex(Index):
+  kind = "sorted"
+
+  def lookup(self, v):
+    return self.range(v, v)
+
+  def range(self, lo=None, hi=None, lo_incl=True, hi_incl=True):
+    """
+    positions of the rows whose key is between lo and hi, in key
+    order.  None means unbounded
+    """
+    start, end = 0, len(self.keys)
+    if lo is not None:
+      start = np.searchsorted(self.keys, lo, lo_incl and "left" or "right")
+    if hi is not None:
+      end = np.searchsorted(self.keys, hi, hi_incl and "right" or "left")
+    return self.positions[start:end]
+
+
+index_classes = dict(hash=HashIndex, sorted=SortedIndex)
+
+# (path, column) -> list of declared kinds, see declarations()
+declared = None
+# (path, column, kind) -> (file stamp, built index)
+built = {}
+
+
+def declarations():
+  """
+  the declared indexes, loaded from the catalog on first use
+  """
+  global declared
+  if declared is None:
+    declared = defaultdict(list)
+    for path, column, kinds in catalog.indexes():
+      declared[(catalog.encode(path), catalog.encode(column))] = map(catalog.encode, kinds)
+  return declared
+
+
+def create_index(filename, column, kind="hash"):
+  if kind not in KINDS:
+    raise Exception("unknown index kind %s, expected one of %s" % (kind, ", ".join(KINDS)))
+  kinds = declarations()[(table_path(filename), column)]
+  if kind not in kinds:
+    kinds.append(kind)
+    catalog.set_indexes(filename, column, kinds)
+    catalog.save()
+
+def drop_index(filename, column=None, kind=None):
+  """
+  Drop the indexes of a table, optionally only those on one column
+  and/or of one kind
+  """
+  path = table_path(filename)
+  for (p, col), kinds in declarations().items():
+    if p != path or (column is not None and col != column):
+      continue
+    for k in list(kinds):
+      if kind is None or k == kind:
+        kinds.remove(k)
+        built.pop((p, col, k), None)
+        forget(filename, col, k)
+    if not kinds:
+      del declared[(p, col)]
+    catalog.set_indexes(filename, col, kinds)
+  catalog.save()
+
+def index_kinds(filename, column):
+  """
+  kinds of the indexes declared on a column
+  """
+  return list(declarations().get((table_path(filename), column), ()))
+
+
+def indexed_columns(filename):
+  path = table_path(filename)
+  return [col for (p, col) in declarations() if p == path]
+
+
+def artifact_name(column, kind):
+  return "index.%s.%s" % (column, kind)
+
+def index_file(path, column, kind):
+  return os.path.join(root, hashlib.sha1(
+    "%s|%s|%s" % (path, column, kind)).hexdigest()[:16] + ".npz")
+
+def forget(filename, column, kind):
+  """
+  Remove the saved file of an index
+  """
+  catalog.set_artifact(filename, artifact_name(column, kind), None)
+  if not root:
+    return
+  saved = index_file(table_path(filename), column, kind)
+  if os.path.exists(saved):
+    os.remove(saved)
+
+def load_index(filename, column, kind):
+  """
+  the saved index of the table's current file, or None
+  """
+  if not root:
+    return None
+  path = table_path(filename)
+  saved = index_file(path, column, kind)
+  if not os.path.exists(saved):
+    return None
+  index = index_classes[kind](column)
+  try:
+    if not index.load(saved, file_stamp(path)):
+      return None
+  except Exception:
+    return None
+  return index
+
+def save_index(filename, index, stamp):
+  if not root:
+    return
+  path = index_file(table_path(filename), index.column, index.kind)
+  try:
+    if not os.path.isdir(root):
+      os.makedirs(root)
+    index.save(path, stamp)
+  except (IOError, OSError):
+    return
+  catalog.set_artifact(filename, artifact_name(index.column, index.kind), path)
+
+
+def get_index(scan, column, kind):
+  """
+  The index on scan's file and column: kept in memory, else loaded
+  from its saved file, else built (again if the file changed) from a
+  scan of the column, and saved
+  """
+  path = table_path(scan.filename)
+  if kind not in declarations().get((path, column), ()):
+    raise Exception("no %s index on %s.%s" % (kind, scan.filename, column))
+  key = (path, column, kind)
+  stamp = file_stamp(path)
+  if key not in built or built[key][0] != stamp:
+    index = load_index(scan.filename, column, kind)
+    if index is None:
+      index = index_classes[kind](column)
+      index.build(*scan.column_positions(column))
+      save_index(scan.filename, index, stamp)
+    built[key] = (stamp, index)
+  return built[key][1]
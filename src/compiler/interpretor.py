@@ -4,11 +4,312 @@ try:
   ib.import_pyfile('./ops.py', 'ops')
   import instabase.notebook.ipython.utils as ib
   ib.import_pyfile('./parser.py', 'parser')
+  ib.import_pyfile('./extsort.py', 'extsort')
 
 except:
   pass
 from ops import *
 from parser import parse, parseexpr
+from extsort import ExternalSorter, TopNHeap
+from index import get_index
+import catalog
+
+
+# Object that observes execution, None when nothing is attached (see
+# hooks.attach and explain.explain_analyze).  It has two methods:
+#   run(op, f, run_f)   execute op by calling run_f(op, f), possibly
+#                       with a wrapped f
+#   wrap_expr(e, fn)    return the callable to use for expression e,
+#                       bound to fn
+tracer = None
+
+def bind_expr(e):
+  fn = bind(e)
+  if tracer is not None:
+    return tracer.wrap_expr(e, fn)
+  return fn
+
+
+def equijoin_candidates(cond):
+  """
+  conjuncts of a join condition of the form <expr> = <expr> where both
+  sides reference attributes.  Whether each side belongs to a single
+  input depends on the inputs' schemas (see split_join_cond).
+  """
+  if not isinstance(cond, Op):
+    return []
+  ret = []
+  for c in conjuncts(cond):
+    if isinstance(c, Expr) and c.op == "=" and c.r is not None:
+      if attr_names(c.l) and attr_names(c.r):
+        ret.append(c)
+  return ret
+
+def split_join_cond(cond, left, right=None):
+  """
+  Split the join condition into hash keys and a residual predicate.
+
+  Attr looks up the left tuple before the right one, so an expression
+  belongs to the left input if all of its attributes are in the left
+  tuple, and to the right input if none of them are.
+
+  @left   field names of the left input
+  @right  field names of the right input, or None if unknown: then any
+          attribute not in the left input is the right input's
+  @return ([(left expr, right expr)], [residual conjuncts])
+  """
+  keys = []
+  residual = []
+  candidates = equijoin_candidates(cond)
+  lnames = set(left)
+  in_right = lambda names: right is None or names <= set(right)
+  for c in conjuncts(cond):
+    if c in candidates:
+      cl, cr = attr_names(c.l), attr_names(c.r)
+      if cl <= lnames and in_right(cr) and not (cr & lnames):
+        keys.append((c.l, c.r))
+        continue
+      if cr <= lnames and in_right(cl) and not (cl & lnames):
+        keys.append((c.r, c.l))
+        continue
+    residual.append(c)
+  return keys, residual
+
+def schema(op):
+  """
+  Field names of the tuples op produces, or None if unknown
+  """
+  klass = op.__class__.__name__
+  if klass in ("Scan", "IndexScan"):
+    return list(op.fields)
+  if klass == "Project":
+    if any(a is None for a in op.aliases):
+      return None
+    return list(op.aliases)
+  if klass in ("Join", "IndexJoin"):
+    l, r = schema(op.l), schema(op.r)
+    if l is None or r is None:
+      return None
+    return l + r
+  if klass == "GroupBy":
+    c = schema(op.c)
+    return c is not None and c + ["__key__", "__group__"] or None
+  if isinstance(op, UnaryOp):
+    return schema(op.c)
+  return None
+
+def join_tup(left, right):
+  newtup = dict()
+  newtup.update(left)
+  newtup.update(right)
+  return newtup
+
+def join_keys(op):
+  """
+  Hash keys and residual conjuncts of a join, from the schemas of its
+  inputs (see split_join_cond).  Without the left input's schema no
+  equality is a key.
+
+  @return ([(left expr, right expr)], [residual conjuncts])
+  """
+  lfields = schema(op.l)
+  if lfields is None:
+    return [], conjuncts(op.cond)
+  return split_join_cond(op.cond, lfields, schema(op.r))
+
+class HashJoinTable(object):
+  """
+  Build side of a hash join: the buffered right (inner) input, hashed
+  on the join keys, which are chosen from the plan before any tuple is
+  seen (see join_keys).  Used by both run_op and volcano.iter_op.
+  """
+  def __init__(self, op, build):
+    keys, residual = join_keys(op)
+    self.build = build
+    self.bound = bind_expr(op.cond)
+    self.lkeys = [bind_expr(l) for (l, r) in keys]
+    self.residual = map(bind_expr, residual)
+    self.table = None
+    if keys:
+      table = defaultdict(list)
+      rkeys = [bind_expr(r) for (l, r) in keys]
+      for right in build:
+        table[tuple([e(right) for e in rkeys])].append(right)
+      self.table = table
+
+  def probe(self, left):
+    """
+    @return (right tuples that may match left, conjuncts every pair
+            must satisfy)
+    """
+    if self.table is None:
+      # no usable equality, fall back to a nested loop over the buffer
+      return self.build, [self.bound]
+    key = tuple([e(left) for e in self.lkeys])
+    return self.table.get(key, ()), self.residual
+
+def hash_join(op, f):
+  """
+  Build a hash table over the right (inner) input once, then stream
+  the left input and probe it.  Conjuncts that are not equalities
+  between the two inputs are checked on every matching pair.
+  """
+  build = []
+  run_op(op.r, build.append)
+  if not build:
+    return
+  table = HashJoinTable(op, build)
+
+  def probe_f(left):
+    matches, conds = table.probe(left)
+    for right in matches:
+      if all(c(left, right) for c in conds):
+        f(join_tup(left, right))
+
+  run_op(op.l, probe_f)
+
+def block_nested_loop_join(op, f):
+  """
+  Nested loop join that never runs the inner input once per outer tuple.
+
+  By default the inner (right) input is run once into a buffer that
+  every outer tuple loops over.  If the join has a block_size, the
+  outer input is instead cut into blocks of that many tuples and the
+  inner input is run once per block, so only one block is in memory.
+  """
+  cond = bind_expr(op.cond)
+  def emit(left, right):
+    if cond(left, right):
+      f(join_tup(left, right))
+
+  if not op.block_size:
+    inner = []
+    run_op(op.r, inner.append)
+    if not inner:
+      return
+    def outer_loop(left):
+      for right in inner:
+        emit(left, right)
+    run_op(op.l, outer_loop)
+    return
+
+  block = []
+  def join_block():
+    def inner_loop(right):
+      for left in block:
+        emit(left, right)
+    run_op(op.r, inner_loop)
+    del block[:]
+
+  def outer_loop(left):
+    block.append(left)
+    if len(block) >= op.block_size:
+      join_block()
+  run_op(op.l, outer_loop)
+  if block:
+    join_block()
+
+def index_join(op, f):
+  """
+  Look up every tuple of the outer input in the index of the inner
+  Scan, instead of scanning or hashing the inner input
+  """
+  idx = get_index(op.inner(), op.column, op.kind)
+  fetch = op.inner().fetcher()
+  key = bind_expr(op.key)
+  residual = map(bind_expr, op.residual)
+  inner_is_left = op.index_side == "l"
+
+  def probe_f(tup):
+    for match in fetch(idx.lookup(key(tup))):
+      left, right = inner_is_left and (match, tup) or (tup, match)
+      if all(c(left, right) for c in residual):
+        f(join_tup(left, right))
+  try:
+    run_op(op.outer(), probe_f)
+  finally:
+    fetch.close()
+
+def group_aggregates(op):
+  """
+  Aggregate functions that will be evaluated over the output of the
+  GroupBy op: those in the HAVING and SELECT clauses above it.
+
+  @return list of Func, or None if a consumer may need the raw groups
+  """
+  aggs = []
+  n = op.p
+  while n is not None:
+    klass = n.__class__.__name__
+    if klass == "Filter":
+      exprs = [n.cond]
+    elif klass == "Project":
+      exprs = n.exprs
+    elif klass == "OrderBy":
+      exprs = n.order_exprs
+    elif klass in ("Limit", "Print"):
+      exprs = []
+    else:
+      return None
+
+    for e in exprs:
+      if not isinstance(e, Op) or e.collect(Star):
+        return None
+      aggs.extend([func for func in e.collect(Func) if func.is_agg()])
+    if klass == "Project":
+      return aggs
+    n = getattr(n, "p", None)
+  return None
+
+class GroupTable(object):
+  """
+  Hash table of the groups of a GroupBy, fed one input tuple at a time
+  with add() and iterated over for the output tuples.  Used by both
+  run_op and volcano.iter_op.
+
+  If every aggregate evaluated above the GroupBy is incremental, only
+  one accumulator per aggregate and group is kept, and output tuples
+  carry the aggregate values in "__aggs__", keyed by str(func).
+  Otherwise the group's tuples are kept in "__group__".
+  """
+  def __init__(self, op):
+    self.group_exprs = map(bind_expr, op.group_exprs)
+    aggs = group_aggregates(op)
+    self.specs = None
+    if aggs is not None and all(func.is_incremental() for func in aggs):
+      specs = OrderedDict()
+      for func in aggs:
+        specs[str(func)] = (bind_expr(func.args[0]), Func.agg_state_lookup[func.name])
+      self.specs = specs.items()
+    # key -> [key, last tuple, accumulators or tuples]
+    self.hashtable = dict()
+
+  def add(self, tup):
+    key = tuple([e(tup) for e in self.group_exprs])
+    group = self.hashtable.get(key)
+    if self.specs is None:
+      if group is None:
+        group = self.hashtable[key] = [key, None, []]
+      group[1] = tup
+      group[2].append(tup)
+      return
+    if group is None:
+      group = self.hashtable[key] = [key, None, [klass() for _, (_, klass) in self.specs]]
+    group[1] = tup
+    for (_, (arg, _)), state in zip(self.specs, group[2]):
+      state.add(arg(tup))
+
+  def __iter__(self):
+    for key, tup, group in self.hashtable.itervalues():
+      tup = dict(tup)
+      tup["__key__"] = key
+      if self.specs is None:
+        tup["__group__"] = group
+      else:
+        tup["__aggs__"] = dict([(name, state.value())
+          for (name, _), state in zip(self.specs, group)])
+      yield tup
+
 
 def run_op(op, f=lambda t:t):
   """
@@ -18,6 +319,11 @@ def run_op(op, f=lambda t:t):
   @op current operator to execute
   @f the function to call for every output tuple of this operator (op)
   """
+  if tracer is not None:
+    return tracer.run(op, f, interpret_op)
+  return interpret_op(op, f)
+
+def interpret_op(op, f):
   klass = op.__class__.__name__
 
   if klass == "Print":
@@ -25,21 +331,22 @@ def run_op(op, f=lambda t:t):
       print tup
     run_op(op.c, print_f)
 
-  elif klass == "Scan":
-    for tup in op.data:
+  elif klass in ("Scan", "IndexScan"):
+    for tup in op:
       if f(tup) == False:
         break
 
+  elif klass in ("Source", "SubQuerySource"):
+    run_op(op.c, f)
+
+  elif klass == "IndexJoin":
+    index_join(op, f)
+
   elif klass == "Join":
-    def outer_loop(left):
-      def inner_loop(right):
-        if op.cond(left, right):
-          newtup = dict()
-          newtup.update(left)
-          newtup.update(right)
-          f(newtup)
-      run_op(op.r, inner_loop)
-    run_op(op.l, outer_loop)
+    if equijoin_candidates(op.cond):
+      hash_join(op, f)
+    else:
+      block_nested_loop_join(op, f)
 
   elif klass == "Limit":
     # super ugly object hack because int counter doesn't work
@@ -47,45 +354,52 @@ def run_op(op, f=lambda t:t):
       def __init__(self):
         self.i = 0
     def __f__(i):
+      end = op.offset + op.limit
       def limit_f(tup):
-        if i.i >= op.limit:
+        if i.i >= end:
           return False
         i.i += 1
-        f(tup)
+        if i.i > op.offset:
+          f(tup)
       return limit_f
     run_op(op.c, __f__(I()))
 
+  elif klass == "TopN":
+    heap = TopNHeap(map(bind_expr, op.order_exprs), op.descending(), op.limit, op.offset)
+    run_op(op.c, heap.add)
+    for tup in heap:
+      if f(tup) == False:
+        break
+
   elif klass == "GroupBy":
-    hashtable = defaultdict(lambda: [None, None, []])
-    def group_f(tup):
-      key = tuple([e(tup) for e in op.group_exprs])
-      hashtable[key][0] = key
-      hashtable[key][1] = tup
-      hashtable[key][2].append(tup)
-    run_op(op.c, group_f)
-
-    for _, (key, tup, group) in hashtable.iteritems():
-      tup = dict(tup)
-      tup["__key__"] = key
-      tup["__group__"] = group
+    groups = GroupTable(op)
+    run_op(op.c, groups.add)
+    for tup in groups:
       f(tup)
 
   elif klass == "OrderBy":
-    tup_buffer = []
-    def order_f(tup):
-      tup_buffer.append(tup)
-    run_op(op.c, order_f)
+    sorter = ExternalSorter(
+        map(bind_expr, op.order_exprs), op.descending(), op.buffer_rows)
+    run_op(op.c, sorter.add)
+    try:
+      for tup in sorter:
+        if f(tup) == False:
+          break
+    finally:
+      sorter.close()
 
   elif klass == "Filter":
+    cond = bind_expr(op.cond)
     def where_f(tup):
-      if op.cond(tup):
+      if cond(tup):
         f(tup)
     run_op(op.c, where_f)
 
   elif klass == "Project":
+    exprs = zip(map(bind_expr, op.exprs), op.aliases)
     def project_f(tup):
       ret = dict()
-      for exp, alias in zip(op.exprs, op.aliases):
+      for exp, alias in exprs:
         ret[alias] = exp(tup)
       f(ret)
     run_op(op.c, project_f)
@@ -93,3 +407,31 @@ def run_op(op, f=lambda t:t):
 
 
 
+
+
+def execute(op, f=lambda t:t, mode="row"):
+  """
+  Run a plan with the chosen executor
+
+  @mode  "row" runs run_op, one tuple at a time
+         "vector" runs vectorized.run_vectorized over column batches
+         "compiled" runs python code generated for the whole plan
+         "pull" runs volcano.run_pull, where consumers pull tuples
+
+  What the plan's Scans recorded in the catalog is saved once it ran.
+  """
+  try:
+    if mode == "row":
+      return run_op(op, f)
+    if mode == "vector":
+      from vectorized import run_vectorized
+      return run_vectorized(op, f)
+    if mode == "compiled":
+      from codegen import run_compiled
+      return run_compiled(op, f)
+    if mode == "pull":
+      from volcano import run_pull
+      return run_pull(op, f)
+    raise Exception("unknown execution mode %s" % mode)
+  finally:
+    catalog.save()
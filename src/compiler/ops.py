@@ -3,7 +3,18 @@ import math
 import numpy as np
 import inspect
 import types
+import logging
+import operator
+from csvscan import ChunkedScan, OffsetFile, parse_header, sniff, to_rows
+from table import Table
+import catalog
+import colcache
+from tablefile import TableFile, is_tablefile
+from rowgroup import RowGroupFile, is_rowgroupfile
+from index import get_index
+from stats import collector as stats_collector
 
+log = logging.getLogger(__name__)
 
 
 class Op(object):
@@ -147,58 +158,419 @@ class SubQuerySource(Source):
   def __str__(self):
     return "Source: (%s AS %s)" % (self.c, self.alias)
 
-class Scan(Source):
-  def __init__(self, filename, alias=None):
-    if "." not in filename:
-      filename += ".csv"
+class Scan(Source, ChunkedScan):
+  """
+  Lazy chunked csv scan (csvscan.py) that also reads the native table
+  formats, prunes columns and uses the catalog and column cache
+  """
+  # read from and write to the binary column cache (colcache.py), if
+  # it is enabled with DB_CACHE
+  cache = True
+  # collect the statistics of the columns read (stats.py) even without
+  # DB_AUTO_STATS; set by stats.analyze
+  collect_stats = False
+
+  def __init__(self, filename, alias=None, chunk_size=None):
+    """
+    The file is not touched until the scan is executed (or its schema
+    is asked for), and then only chunk_size rows are held at a time.
+    """
+    self.filename = catalog.table_file(filename)
+    self.alias = alias or self.filename
+    self.chunk_size = chunk_size or self.chunk_size
+    # columns to produce, None for all (see prune)
+    self.columns = None
+    self._fields = None
+    self._types = None
+    self._keep = None
+    # (column, op, value) conjuncts, as optimizer.sargable returns them,
+    # that row groups of a row group file (rowgroup.py) are skipped for
+    # when their min and max show that no row satisfies them
+    self.skip_preds = ()
+
+  def prune(self, columns):
+    """
+    Only parse and produce the given columns.  fields and types then
+    describe the produced columns, in file order
+    """
+    self.columns = columns
+    self._fields = self._types = None
+
+  def full(self):
+    """
+    Scan of the same file that produces every column
+    """
+    return Scan(self.filename, self.alias, self.chunk_size)
+
+  @property
+  def fields(self):
+    if self._fields is None:
+      self.read_header()
+    return self._fields
+
+  @property
+  def types(self):
+    if self._types is None:
+      self.read_header()
+    return self._types
+
+  def read_header(self):
+    if self.is_native():
+      try:
+        self.set_schema(*self.native().schema())
+      except Exception as e:
+        self._fields, self._types = (), ()
+        print e
+      return
+    known = catalog.lookup(self.filename)
+    if known is not None:
+      self.set_schema(known[1], known[2])
+      return
+    self._fields, self._types = (), ()
+    try:
+      with self.open() as f:
+        self.reader(f)
+    except Exception as e:
+      print e
 
-    self.filename = filename
-    self.alias = alias or filename
-    self.fields = []
-    self.types = []
-    self.data = []
+  def set_schema(self, fields, types):
+    """
+    @fields, types  of all the columns of the file
+    """
+    fields, types = tuple(fields), tuple(types)
+    self._keep = None
+    if self.columns is not None:
+      self._keep = [i for i, f in enumerate(fields) if f in self.columns]
+      fields = tuple([fields[i] for i in self._keep])
+      types = tuple([types[i] for i in self._keep])
+    self._fields = fields
+    self._types = types
+    return fields, types
+
+  def picker(self):
+    """
+    function that returns the kept cells of a csv row, in fields order
+    """
+    keep = self._keep
+    if keep is None:
+      return lambda l: l
+    if len(keep) == 1:
+      i = keep[0]
+      return lambda l: (l[i],)
+    if not keep:
+      return lambda l: ()
+    return operator.itemgetter(*keep)
+
+  def cached(self):
+    """
+    CachedTable with the columns of the scan, or None
+    """
+    if not self.cache or self.is_native() or not self.fields:
+      return None
+    return colcache.lookup(self.filename, self.fields)
+
+  def chunks(self):
+    """
+    Generate lists of at most chunk_size rows
+    """
+    if self.is_native():
+      for table in self.native_tables():
+        yield list(table)
+      return
+    cached = self.cached()
+    if cached is not None:
+      for rows in cached.rows(self.fields, self.types, self.chunk_size):
+        yield rows
+      return
+    with self.open() as f:
+      for rows in self.proc_file(f):
+        yield rows
+
+  def reader(self, f):
+    """
+    csv reader over the rows of f, positioned after the header.  The
+    dialect and header of files in the catalog are not parsed again
+    """
+    known = catalog.lookup(self.filename)
+    if known is not None:
+      dialect, fields, types = known
+      reader = csv.reader(f, **dialect)
+      reader.next()
+      self.set_schema(fields, types)
+      return reader
+
+    dialect = sniff(f)
+    reader = csv.reader(f, dialect)
+    fields, types = parse_header(reader.next())
+    catalog.register(self.filename, dialect, fields, types)
+    self.set_schema(fields, types)
+    return reader
+
+  def proc_file(self, f):
+    """
+    Also collects the statistics of the parsed columns (see stats.py)
+    if they are asked for and not known yet, and writes them to the
+    column cache, if the file is read to the end
+    """
+    reader = self.reader(f)
+    fields, types = self._fields, self._types
+    collector = stats_collector(self.filename, fields, types, self.collect_stats)
+    writer = self.cache_writer()
 
     try:
-      openfile = open
+      for lines in self.line_chunks(reader):
+        if collector:
+          collector.add(lines)
+        if writer:
+          writer.add(lines)
+        yield to_rows(lines, fields, types)
+    except:
+      if writer:
+        writer.abort()
+      raise
+    if collector:
+      collector.finish()
+    if writer:
+      self.finish_cache(writer)
+
+  def cache_writer(self):
+    if not self.cache or not self._fields:
+      return None
+    return colcache.writer(self.filename, self._fields, self._types)
+
+  def finish_cache(self, writer):
+    """
+    The rows were all produced already, so a failure to write the cache
+    is logged rather than raised
+    """
+    try:
+      writer.finish()
+    except (IOError, OSError) as e:
+      log.warning("could not cache the columns of %s: %s", self.filename, e)
+
+  def tables(self):
+    """
+    Generate a columnar Table per chunk of at most chunk_size rows.
+    Each chunk is converted to arrays in bulk, or sliced from the
+    memory mapped column cache or native table file.
+    """
+    if self.is_native():
+      for table in self.native_tables():
+        yield table
+      return
+    cached = self.cached()
+    if cached is not None:
+      for table in cached.tables(self.fields, self.types, self.chunk_size):
+        yield table
+      return
+    with self.open() as f:
+      reader = self.reader(f)
+      fields, types = self._fields, self._types
+      writer = self.cache_writer()
       try:
-        openfile = ib.open
+        for lines in self.line_chunks(reader):
+          if writer:
+            writer.add(lines)
+          yield Table.from_strings(fields, types, zip(*lines))
       except:
-        pass
+        if writer:
+          writer.abort()
+        raise
+      if writer:
+        self.finish_cache(writer)
 
-      with openfile(self.filename) as f:
-          self.proc_file(f)
-    except Exception as e:
-      print e
+  def is_native(self):
+    return is_tablefile(self.filename) or is_rowgroupfile(self.filename)
+
+  def native(self):
+    """
+    TableFile (tablefile.py) or RowGroupFile (rowgroup.py) of the file
+    """
+    if is_tablefile(self.filename):
+      return TableFile(self.filename)
+    return RowGroupFile(self.filename)
+
+  def native_tables(self):
+    """
+    Tables of at most chunk_size rows of a native table file.  Only the
+    scanned columns are read, and row groups that cannot satisfy
+    skip_preds are skipped
+    """
+    native = self.native()
+    fields, types = self.set_schema(*native.schema())
+    if isinstance(native, TableFile):
+      tables = native.tables(fields, self.chunk_size)
+    else:
+      tables = native.tables(fields, self.skip_preds)
+    collector = stats_collector(self.filename, fields, types, self.collect_stats)
+    for table in tables:
+      for batch in table.batches(self.chunk_size):
+        if collector:
+          collector.add_columns([batch.column(f).tolist() for f in fields])
+        yield batch
+    # statistics of scans that skipped rows would be wrong
+    if collector and collector.rows == native.nrows:
+      collector.finish()
+
+  def column_positions(self, column):
+    """
+    Values of a column and the positions of their rows, which fetcher()
+    reads rows at: row numbers in native table files, byte offsets of
+    the rows in csv files.  Only the column is parsed
+
+    @return (values, positions) numpy arrays
+    """
+    scan = self.full()
+    scan.prune([column])
+    if scan.is_native():
+      values = [table.column(column) for table in scan.native_tables()]
+      values = np.concatenate(values) if values else np.empty(0)
+      return values, np.arange(len(values), dtype=np.int64)
+
+    values, positions = [], []
+    with scan.open() as f:
+      f = OffsetFile(f)
+      reader = scan.reader(f)
+      pick = scan.picker()
+      while True:
+        pos = f.offset
+        line = next(reader, None)
+        if line is None:
+          break
+        if line:
+          positions.append(pos)
+          values.append(pick(line)[0])
+    if scan.types and scan.types[0] == "num":
+      values = np.array(values, dtype=np.float64)
+    else:
+      values = np.array(values, dtype=object)
+    return values, np.array(positions, dtype=np.int64)
+
+  def fetcher(self):
+    """
+    Fetcher of the rows of the scan at a list of positions (see
+    column_positions).  It keeps the file open until its close()
+    """
+    fields = self.fields
+    if self.is_native():
+      native = self.native()
+      return Fetcher(lambda positions: native.rows_at(fields, positions))
+    raw = self.open()
+    f = OffsetFile(raw)
+    reader = self.reader(f)
+    pick, types = self.picker(), self._types
+    def fetch(positions):
+      lines = []
+      for pos in positions:
+        f.seek(pos)
+        lines.append(pick(reader.next()))
+      return to_rows(lines, fields, types)
+    return Fetcher(fetch, raw)
+
+  def table(self):
+    """
+    Load the whole file into a columnar Table
+    """
+    tables = list(self.tables())
+    if not tables:
+      return Table.empty(self.fields, self.types)
+    return Table.concat(tables)
 
-  def proc_file(self, f):
-    fields = None
-    types = None
-    rows = None
-    dialect = csv.Sniffer().sniff(f.read(2048))
-    f.seek(0)
-    reader = csv.reader(f, dialect)
-    header = reader.next()
-    header = [v.split(":") for v in header]
-    fields, types = zip(*header)
-    rows = [dict(zip(fields, l)) for l in reader]
-    for row in rows:
-      for f,t in zip(fields, types):
-        if t == "num":
-          row[f] = float(row[f])
-
-    self.fields = fields
-    self.types = types
-    self.data = rows
-  
   def __str__(self):
+    if self.skip_preds:
+      skip = " and ".join("%s %s %s" % p for p in self.skip_preds)
+      return "Source:(%s AS %s ROW GROUPS WHERE %s)" % (self.filename, self.alias, skip)
     return "Source:(%s AS %s)" % (self.filename, self.alias)
 
-      
+
+class Fetcher(object):
+  """
+  Callable from a list of positions to the rows at them, in that order,
+  returned by Scan.fetcher().  Callers close() it when they are done
+  """
+  def __init__(self, fetch, f=None):
+    """
+    @fetch  function from positions to rows
+    @f      the open file fetch reads, if any
+    """
+    self.fetch = fetch
+    self.f = f
+
+  def __call__(self, positions):
+    return self.fetch(positions)
+
+  def close(self):
+    if self.f is not None:
+      self.f.close()
+      self.f = None
+
+
+class IndexScan(Scan):
+  """
+  Rows of a table whose column value is found in an index (see
+  index.py), instead of every row of the file
+  """
+  def __init__(self, scan, column, kind, lo=None, hi=None, lo_incl=True, hi_incl=True):
+    """
+    @scan     the Scan this replaces
+    @column   indexed column
+    @kind     "hash" or "sorted"
+    @lo, hi   key range, None for unbounded.  Hash indexes only support
+              lo == hi (equality)
+    @lo_incl, hi_incl  whether the bounds are inclusive
+    """
+    super(IndexScan, self).__init__(scan.filename, scan.alias, scan.chunk_size)
+    if scan.columns is not None:
+      self.prune(scan.columns)
+    self.column = column
+    self.kind = kind
+    self.lo = lo
+    self.hi = hi
+    self.lo_incl = lo_incl
+    self.hi_incl = hi_incl
+
+  def lookup(self):
+    """
+    positions of the matching rows
+    """
+    idx = get_index(self, self.column, self.kind)
+    if self.kind == "hash":
+      return idx.lookup(self.lo)
+    return idx.range(self.lo, self.hi, self.lo_incl, self.hi_incl)
+
+  def chunks(self):
+    positions = self.lookup()
+    fetch = self.fetcher()
+    try:
+      for start in xrange(0, len(positions), self.chunk_size):
+        yield fetch(positions[start:start + self.chunk_size])
+    finally:
+      fetch.close()
+
+  def tables(self):
+    for rows in self.chunks():
+      yield Table.from_rows(rows)
+
+  def cond_str(self):
+    if self.kind == "hash" or (self.lo == self.hi and self.lo_incl and self.hi_incl):
+      return "%s = %s" % (self.column, self.lo)
+    terms = []
+    if self.lo is not None:
+      terms.append("%s %s %s" % (self.column, self.lo_incl and ">=" or ">", self.lo))
+    if self.hi is not None:
+      terms.append("%s %s %s" % (self.column, self.hi_incl and "<=" or "<", self.hi))
+    return " and ".join(terms)
+
+  def __str__(self):
+    return "IndexScan:(%s AS %s USING %s(%s) WHERE %s)" % (
+        self.filename, self.alias, self.kind, self.column, self.cond_str())
+
+
 class Join(BinaryOp):
   """
   Theta Join
   """
-  def __init__(self, l, r, cond=None):
+  def __init__(self, l, r, cond=None, block_size=None):
     """
     @l    left (outer) table of the join
     @r    right (inner) table of the join
@@ -206,14 +578,50 @@ class Join(BinaryOp):
           one from the left table, one from the right
           OR
           an expression
+    @block_size  if set, nested loops buffer this many outer tuples at
+                 a time instead of buffering the whole inner table
     """
     super(Join, self).__init__(l, r)
     self.cond = cond or Bool(True)
+    self.block_size = block_size
 
   def __str__(self):
     return "JOIN:(\n\t%s\n\t%s ON %s)" % (str(self.l), str(self.r), str(self.cond))
 
 
+class IndexJoin(Join):
+  """
+  Index nested loop join: every tuple of the outer input is looked up
+  in an index (see index.py) on a column of the inner input, which must
+  be a Scan, and the inner input is never scanned
+  """
+  def __init__(self, l, r, cond, index_side, column, kind, key, residual=None):
+    """
+    @index_side  "l" or "r", the input that has the index
+    @column      indexed column of that input
+    @kind        "hash" or "sorted"
+    @key         expression over the other (outer) input whose value is
+                 looked up
+    @residual    list of conjuncts of cond still checked on every match
+    """
+    super(IndexJoin, self).__init__(l, r, cond)
+    self.index_side = index_side
+    self.column = column
+    self.kind = kind
+    self.key = key
+    self.residual = residual or []
+
+  def inner(self):
+    return self.index_side == "l" and self.l or self.r
+
+  def outer(self):
+    return self.index_side == "l" and self.r or self.l
+
+  def __str__(self):
+    return "INDEX JOIN:(\n\t%s\n\t%s ON %s USING %s(%s))" % (
+        str(self.l), str(self.r), str(self.cond), self.kind, self.column)
+
+
 class GroupBy(UnaryOp):
   def __init__(self, c, group_exprs):
     """
@@ -229,19 +637,27 @@ class GroupBy(UnaryOp):
 
 
 class OrderBy(UnaryOp):
-  def __init__(self, c, order_exprs, ascdesc):
+  def __init__(self, c, order_exprs, ascdesc, buffer_rows=None):
     """
     @p            parent operator
     @order_exprs  ordered list of function that take the tuple as input 
                   and outputs a scalar value
+    @ascdesc      "asc" or "desc" for each order expression
+    @buffer_rows  tuples sorted in memory before runs are spilled to
+                  disk (estimated from extsort.SORT_BUFFER_BYTES if None)
     """
     super(OrderBy, self).__init__(c)
     self.order_exprs = order_exprs
-    self.ascdesc = ascdesc or []
-    for i in xrange(len(order_exprs)):
-      if len(self.ascdesc) < i:
-        self.ascdesc.append("asc")
+    self.buffer_rows = buffer_rows
+    self.ascdesc = list(ascdesc or [])
+    while len(self.ascdesc) < len(order_exprs):
+      self.ascdesc.append("asc")
 
+  def descending(self):
+    """
+    list of booleans, True for each order expression sorted descending
+    """
+    return [str(d).strip().lower() == "desc" for d in self.ascdesc]
 
   def __str__(self):
     return "ORDER BY: %s\n%s" % (",".join(map(str, self.order_exprs)), self.c)
@@ -261,19 +677,60 @@ class Filter(UnaryOp):
     return "WHERE: %s\n%s" % (str(self.cond), self.c)
 
 
+def const_int(v):
+  """
+  LIMIT and OFFSET values may be numbers or constant expressions
+  """
+  if isinstance(v, Op):
+    v = v()
+  return int(v or 0)
+
 class Limit(UnaryOp):
-  def __init__(self, c, limit):
+  def __init__(self, c, limit, offset=0):
     """
     @p            parent operator
     @limit        number of tuples to return
+    @offset       number of tuples to skip first
     """
     super(Limit, self).__init__(c)
-    self.limit = limit
+    self.limit = const_int(limit)
+    self.offset = const_int(offset)
 
   def __str__(self):
+    if self.offset:
+      return "LIMIT: %s OFFSET %s\n%s" % (self.limit, self.offset, self.c)
     return "LIMIT: %s\n%s" % (self.limit,  self.c)
 
 
+class TopN(UnaryOp):
+  """
+  ORDER BY followed by LIMIT, computed with a bounded heap
+  """
+  def __init__(self, c, order_exprs, ascdesc, limit, offset=0):
+    """
+    @p            parent operator
+    @order_exprs  ordered list of function that take the tuple as input 
+                  and outputs a scalar value
+    @ascdesc      "asc" or "desc" for each order expression
+    @limit        number of tuples to return
+    @offset       number of tuples to skip first
+    """
+    super(TopN, self).__init__(c)
+    self.order_exprs = order_exprs
+    self.ascdesc = list(ascdesc or [])
+    while len(self.ascdesc) < len(order_exprs):
+      self.ascdesc.append("asc")
+    self.limit = const_int(limit)
+    self.offset = const_int(offset)
+
+  def descending(self):
+    return [str(d).strip().lower() == "desc" for d in self.ascdesc]
+
+  def __str__(self):
+    terms = ",".join(["%s %s" % t for t in zip(self.order_exprs, self.ascdesc)])
+    return "TOP %s OFFSET %s BY: %s\n%s" % (self.limit, self.offset, terms, self.c)
+
+
 class Project(UnaryOp):
   def __init__(self, c, exprs, aliases=None):
     """
@@ -299,7 +756,9 @@ class Project(UnaryOp):
     self.aliases.extend([None] * (len(self.exprs) - len(self.aliases)))
     print self.aliases
     for i in xrange(len(self.exprs)):
-      if not self.aliases[i] and not isinstance(self.exprs[i], Star):
+      if not self.aliases[i] and isinstance(self.exprs[i], Attr):
+        self.aliases[i] = self.exprs[i].attr
+      elif not self.aliases[i] and not isinstance(self.exprs[i], Star):
         self.aliases[i] = "attr%s" % i 
 
 
@@ -334,6 +793,106 @@ def binary(op, l, r):
   if op == ">=": return l >= r
   return True
 
+# operator functions that bind() resolves unary() and binary() to
+unary_lookup = {
+  "+": lambda v: v,
+  "-": operator.neg,
+  "not": operator.not_
+}
+
+binary_lookup = {
+  "+": operator.add,
+  "/": operator.div,
+  "*": operator.mul,
+  "-": operator.sub,
+  "=": operator.eq,
+  "<>": operator.ne,
+  "<": operator.lt,
+  ">": operator.gt,
+  "<=": operator.le,
+  ">=": operator.ge
+}
+
+def bind(e):
+  """
+  Compile an expression into a python callable (tup, tup2=None) once,
+  so that evaluating it per row skips the tree walk and the string
+  dispatch in unary()/binary().  Plain functions are returned as is.
+  """
+  if isinstance(e, Op) and hasattr(e, "bind"):
+    return e.bind()
+  return e
+
+def is_const(e):
+  if isinstance(e, (Literal, Bool)):
+    return True
+  if isinstance(e, Expr):
+    return is_const(e.l) and (e.r is None or is_const(e.r))
+  if isinstance(e, Between):
+    return all(map(is_const, [e.expr, e.lower, e.upper]))
+  return False
+
+def const_f(v):
+  def f(tup=None, tup2=None):
+    return v
+  return f
+
+class ZeroDivisor(Exception):
+  """
+  Raised by a column division with a zero divisor, where division by
+  zero in run_op raises ZeroDivisionError for some rows but numpy
+  returns inf or nan; vectorized.eval_column then evaluates the
+  expression row by row
+  """
+
+def vdivide(l, r):
+  if np.any(np.asarray(r) == 0):
+    raise ZeroDivisor()
+  return np.divide(l, r)
+
+# numpy versions of unary() and binary() that work on whole columns
+vunary_lookup = {
+  "+": lambda v: v,
+  "-": np.negative,
+  "not": np.logical_not
+}
+
+vbinary_lookup = {
+  "+": np.add,
+  "/": vdivide,
+  "*": np.multiply,
+  "-": np.subtract,
+  "=": np.equal,
+  "<>": np.not_equal,
+  "and": np.logical_and,
+  "or": np.logical_or,
+  "<": np.less,
+  ">": np.greater,
+  "<=": np.less_equal,
+  ">=": np.greater_equal
+}
+
+def vunary(op, v):
+  return vunary_lookup[op.lower()](v)
+
+def vbinary(op, l, r):
+  f = vbinary_lookup.get(op)
+  if f is None:
+    return True
+  return f(l, r)
+
+def broadcast(v, n):
+  """
+  turn the result of eval_batch into a column of n values
+  """
+  if np.ndim(v) > 0:
+    return v
+  if isinstance(v, float):
+    return np.repeat(np.float64(v), n)
+  arr = np.empty(n, dtype=object)
+  arr[:] = [v] * n
+  return arr
+
 
 class Expr(Op):
   def __init__(self, op, l, r=None):
@@ -353,6 +912,78 @@ class Expr(Op):
     r = self.r(tup, tup2)
     return binary(self.op, l, r)
 
+  def bind(self):
+    if is_const(self):
+      try:
+        return const_f(self(None))
+      except Exception:
+        pass
+
+    l = self.l.bind()
+    if self.r is None:
+      uf = unary_lookup.get(self.op.lower(), lambda v: None)
+      return lambda tup, tup2=None: uf(l(tup, tup2))
+
+    r = self.r.bind()
+    if self.op == "and":
+      return lambda tup, tup2=None: l(tup, tup2) and r(tup, tup2)
+    if self.op == "or":
+      return lambda tup, tup2=None: l(tup, tup2) or r(tup, tup2)
+    bf = binary_lookup.get(self.op)
+    if bf is None:
+      return const_f(True)
+    return lambda tup, tup2=None: bf(l(tup, tup2), r(tup, tup2))
+
+  def eval_batch(self, batch):
+    l = self.l.eval_batch(batch)
+    if self.r is None:
+      return vunary(self.op, l)
+    r = self.r.eval_batch(batch)
+    return vbinary(self.op, l, r)
+
+def conjuncts(expr):
+  """
+  Split a boolean expression into the list of its AND-ed terms
+  """
+  if isinstance(expr, Expr) and expr.op.lower() == "and" and expr.r is not None:
+    return conjuncts(expr.l) + conjuncts(expr.r)
+  return [expr]
+
+def conjoin(exprs):
+  """
+  AND a list of boolean expressions together, the inverse of conjuncts
+  """
+  if not exprs:
+    return Bool(True)
+  ret = exprs[0]
+  for e in exprs[1:]:
+    ret = Expr("and", ret, e)
+  return ret
+
+def attr_names(expr):
+  """
+  names of all attributes referenced in the expression
+  """
+  return set([a.attr for a in expr.collect(Attr)])
+
+def substitute(expr, f):
+  """
+  Copy of an expression where every Attr a is replaced by f(a)
+  """
+  if isinstance(expr, Attr):
+    return f(expr)
+  if isinstance(expr, Expr):
+    r = expr.r
+    if r is not None:
+      r = substitute(r, f)
+    return Expr(expr.op, substitute(expr.l, f), r)
+  if isinstance(expr, Between):
+    return Between(substitute(expr.expr, f),
+        substitute(expr.lower, f), substitute(expr.upper, f))
+  if isinstance(expr, Func):
+    return Func(expr.name, [substitute(arg, f) for arg in expr.args])
+  return expr
+
 class Between(Op):
   def __init__(self, expr, lower, upper):
     """
@@ -371,16 +1002,109 @@ class Between(Op):
     u = self.upper(tup, tup2)
     return e >= l and e <= u
 
+  def bind(self):
+    if is_const(self):
+      return const_f(self(None))
+    e, l, u = self.expr.bind(), self.lower.bind(), self.upper.bind()
+    def between_f(tup, tup2=None):
+      v = e(tup, tup2)
+      return v >= l(tup, tup2) and v <= u(tup, tup2)
+    return between_f
+
+  def eval_batch(self, batch):
+    e = self.expr.eval_batch(batch)
+    l = self.lower.eval_batch(batch)
+    u = self.upper.eval_batch(batch)
+    return np.logical_and(e >= l, e <= u)
+
+class CountState(object):
+  def __init__(self):
+    self.n = 0
+  def add(self, v):
+    self.n += 1
+  def value(self):
+    return self.n
+
+class SumState(object):
+  def __init__(self):
+    self.total = 0.0
+  def add(self, v):
+    self.total += v
+  def value(self):
+    return self.total
+
+class AvgState(object):
+  def __init__(self):
+    self.n = 0
+    self.total = 0.0
+  def add(self, v):
+    self.n += 1
+    self.total += v
+  def value(self):
+    return self.total / self.n
+
+class StdState(object):
+  """
+  population standard deviation (like np.std) with Welford's method
+  """
+  def __init__(self):
+    self.n = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+  def add(self, v):
+    self.n += 1
+    delta = v - self.mean
+    self.mean += delta / self.n
+    self.m2 += delta * (v - self.mean)
+  def value(self):
+    return math.sqrt(self.m2 / self.n)
+
+class MinState(object):
+  def __init__(self):
+    self.v = None
+  def add(self, v):
+    if self.v is None or v < self.v:
+      self.v = v
+  def value(self):
+    return self.v
+
+class MaxState(object):
+  def __init__(self):
+    self.v = None
+  def add(self, v):
+    if self.v is None or v > self.v:
+      self.v = v
+  def value(self):
+    return self.v
+
+
 class Func(Op): 
   """
   This object needs to deal with scalar AND aggregation functions.
+
+  Aggregates are either computed over the "__group__" list of the
+  input tuple, or read from its "__aggs__" dict when GroupBy already
+  computed them incrementally (see agg_state_lookup).
   """
   agg_func_lookup = dict(
     avg=np.mean,
     count=len,
     sum=np.sum,
     std=np.std,
-    stddev=np.std
+    stddev=np.std,
+    min=np.min,
+    max=np.max
+  )
+  # aggregates that can be computed one value at a time.  Each state
+  # has add(v) and value().  Aggregates missing here need the whole group.
+  agg_state_lookup = dict(
+    avg=AvgState,
+    count=CountState,
+    sum=SumState,
+    std=StdState,
+    stddev=StdState,
+    min=MinState,
+    max=MaxState
   )
   scalar_func_lookup = dict(
     lower=lambda s: str(s).lower()
@@ -395,9 +1119,17 @@ class Func(Op):
     args = ",".join(map(str, self.args))
     return "%s(%s)" % (self.name, args)
 
+  def is_agg(self):
+    return self.name in Func.agg_func_lookup
+
+  def is_incremental(self):
+    return self.name in Func.agg_state_lookup and len(self.args) == 1
+
   def __call__(self, tup, tup2=None):
     f = Func.agg_func_lookup.get(self.name, None)
     if f:
+      if "__aggs__" in tup:
+        return tup["__aggs__"][str(self)]
       if "__group__" not in tup:
         raise Exception("aggregation function %s called but input is not a group!")
       args = []
@@ -410,10 +1142,49 @@ class Func(Op):
       return f(*args)
 
 
-    f = agg_func_lookup.get(self.name, None)
+    f = Func.scalar_func_lookup.get(self.name, None)
     if f:
       args = [arg(tup, tup2) for arg in self.args]
-      return f(args)
+      return f(*args)
+
+    raise Exception("I don't recognize function %s" % self.name)
+
+  def bind(self):
+    args = [bind(arg) for arg in self.args]
+    f = Func.agg_func_lookup.get(self.name, None)
+    if f:
+      name, key = self.name, str(self)
+      def agg_f(tup, tup2=None):
+        if "__aggs__" in tup:
+          return tup["__aggs__"][key]
+        if "__group__" not in tup:
+          raise Exception("aggregation function %s called but input is not a group!" % name)
+        group = tup["__group__"]
+        if len(args) == 1:
+          arg = args[0]
+          return f([arg(gtup) for gtup in group])
+        return f(*zip(*[[arg(gtup) for arg in args] for gtup in group]))
+      return agg_f
+
+    f = Func.scalar_func_lookup.get(self.name, None)
+    if f:
+      return lambda tup, tup2=None: f(*[arg(tup, tup2) for arg in args])
+
+    raise Exception("I don't recognize function %s" % self.name)
+
+  def eval_batch(self, batch):
+    f = Func.agg_func_lookup.get(self.name, None)
+    if f:
+      if not hasattr(batch, "groups"):
+        raise Exception("aggregation function %s called but input is not a group!")
+      n = len(batch.input)
+      args = [broadcast(arg.eval_batch(batch.input), n) for arg in self.args]
+      return np.array([f(*[arg[idx] for arg in args]) for idx in batch.groups])
+
+    f = Func.scalar_func_lookup.get(self.name, None)
+    if f:
+      args = [arg.eval_batch(batch) for arg in self.args]
+      return np.frompyfunc(f, len(args), 1)(*args)
 
     raise Exception("I don't recognize function %s" % self.name)
 
@@ -424,6 +1195,12 @@ class Literal(Op):
   def __call__(self, tup=None, tup2=None): 
     return self.v
 
+  def bind(self):
+    return const_f(self.v)
+
+  def eval_batch(self, batch):
+    return self.v
+
   def __str__(self):
     if isinstance(self.v, basestring):
       return "'%s'" % self.v
@@ -434,6 +1211,10 @@ class Bool(Op):
     self.v = v
   def __call__(self, *args, **kwargs):
     return self.v
+  def bind(self):
+    return const_f(self.v)
+  def eval_batch(self, batch):
+    return self.v
   def __str__(self):
     return str(self.v)
 
@@ -449,6 +1230,22 @@ class Attr(Op):
       return tup2[self.attr]
     raise Exception("couldn't find %s in either tuple" % self.attr)
 
+  def bind(self):
+    attr = self.attr
+    def attr_f(tup, tup2=None):
+      try:
+        return tup[attr]
+      except KeyError:
+        if tup2 and attr in tup2:
+          return tup2[attr]
+        raise Exception("couldn't find %s in either tuple" % attr)
+    return attr_f
+
+  def eval_batch(self, batch):
+    if self.attr in batch.fields:
+      return batch.column(self.attr)
+    raise Exception("couldn't find %s in the batch" % self.attr)
+
   def __str__(self):
     if self.tablename:
       return "%s.%s" % (self.tablename, self.attr)
@@ -463,6 +1260,9 @@ class Star(Op):
   def __call__(self, tup, tup2=None):
     return tup
 
+  def bind(self):
+    return lambda tup, tup2=None: tup
+
   def __str__(self):
     if self.tablename:
       return "%s.*" % self.tablename
@@ -1,81 +1,880 @@
+import os
 from ops import *
+from index import index_kinds, indexed_columns
+from stats import table_stats
 from itertools import *
 from collections import *
 
-def pickone(l, attr):
-  return [(i and getattr(i, attr) or None) for i in l]
-
 def optimize(op):
   if not op:
     return None
 
   while op.collectone("From"):
     op = from_expansion(op)
+  op = push_predicates(op)
+  op = topn_rewrite(op)
+  op = index_join_rewrite(op)
+  op = index_rewrite(op)
+  row_group_rewrite(op)
+  prune_columns(op)
   print op
   return op
 
-def from_expansion(op):
+def provides(op, attr):
   """
-  Stupid method that replaces the first From operator with a Join tree
+  Whether the tuples op produces carry attr.  Qualified attributes
+  (t.a) are matched against the aliases of Scans and subqueries, other
+  attributes against the columns known to come out of op.
   """
-  print op
-  fromop = op.collectone("From")
-  filters = op.collect("Filter")
-  filters = filter(lambda f: fromop.is_ancestor(f), filters)
-  sources = fromop.cs
-
-
-  sourcealiases = [s.alias for s in sources]
-  alias2source = { s.alias: s for s in sources }
-
-  print "filters", len(filters)
-  exprs = []
-  for f in filters:
-    exprs.extend(f.collect(Expr))
-
-  pairs = defaultdict(list)
-  for expr in exprs:
-    if expr.op == "=":
-      lattrs = expr.l.collect(Attr)
-      rattrs = expr.r.collect(Attr)
-      names = sorted(set(pickone(chain(lattrs, rattrs), "tablename")))
-      if len(names) != 2:
+  klass = op.__class__.__name__
+  if klass in ("Scan", "IndexScan"):
+    if attr.tablename:
+      return attr.tablename == op.alias
+    return os.path.exists(op.filename) and attr.attr in op.fields
+  if klass == "SubQuerySource":
+    if attr.tablename:
+      return attr.tablename == op.alias
+    return provides(op.c, attr)
+  if klass == "Project":
+    if op.collect(Star):
+      return provides(op.c, attr)
+    return not attr.tablename and attr.attr in op.aliases
+  if isinstance(op, BinaryOp):
+    return provides(op.l, attr) or provides(op.r, attr)
+  if isinstance(op, UnaryOp):
+    return provides(op.c, attr)
+  return False
+
+def covers(op, cond):
+  attrs = cond.collect(Attr)
+  return bool(attrs) and all(provides(op, a) for a in attrs)
+
+def add_conjunct(cond, c):
+  """
+  cond AND c, unless c is already one of its conjuncts
+  """
+  if not isinstance(cond, Op) or isinstance(cond, Bool) and cond.v is True:
+    return c
+  if str(c) in map(str, conjuncts(cond)):
+    return cond
+  return Expr("and", cond, c)
+
+def filter_above(op, cond):
+  """
+  Evaluate cond over the output of op: add it to op's parent if that is
+  a Filter, otherwise insert a Filter between op and its parent
+  """
+  if isinstance(op.p, Filter):
+    op.p.cond = add_conjunct(op.p.cond, cond)
+    return
+  f = Filter(None, cond)
+  op.replace(f)
+  f.c = op
+
+def push_conjunct(op, c):
+  """
+  Move conjunct c, currently evaluated over the output of op, as far
+  down into op as the attributes it references allow
+
+  @return True if c was placed inside op's subtree
+  """
+  klass = op.__class__.__name__
+
+  if klass in ("Join", "IndexJoin"):
+    for child in (op.l, op.r):
+      if covers(child, c) and push_conjunct(child, c):
+        return True
+    if not covers(op, c):
+      return False
+    op.cond = add_conjunct(op.cond, c)
+    if klass == "IndexJoin":
+      op.residual.append(c)
+    return True
+
+  if klass == "Filter":
+    if not push_conjunct(op.c, c):
+      op.cond = add_conjunct(op.cond, c)
+    return True
+
+  if klass in ("Scan", "IndexScan"):
+    filter_above(op, c)
+    return True
+
+  if klass == "SubQuerySource":
+    alias = op.alias
+    def unqualify(a):
+      if a.tablename == alias:
+        return Attr(a.attr)
+      return a
+    return push_conjunct(op.c, substitute(c, unqualify))
+
+  if klass == "Project":
+    if any(func.is_agg() for e in op.exprs if isinstance(e, Op) for func in e.collect(Func)):
+      return False
+    exprs = dict(zip(op.aliases, op.exprs))
+    star = op.collect(Star)
+    if not all(a.attr in exprs or star for a in c.collect(Attr)):
+      return False
+    if not all(isinstance(e, Op) for e in exprs.values()):
+      return False
+    def rename(a):
+      if not a.tablename and a.attr in exprs:
+        return substitute(exprs[a.attr], lambda x: Attr(x.attr, x.tablename))
+      return a
+    c = substitute(c, rename)
+    if not push_conjunct(op.c, c):
+      filter_above(op.c, c)
+    return True
+
+  if klass == "OrderBy":
+    if not push_conjunct(op.c, c):
+      filter_above(op.c, c)
+    return True
+
+  return False
+
+def push_predicates(op):
+  """
+  Split every Filter's condition into conjuncts and move each one to
+  the lowest point of the plan that has all the attributes it needs:
+  above the Scan of a single table predicate, into the condition of
+  the lowest Join that covers both sides of a join predicate, and
+  through Project renames into subqueries.  Filters left empty are
+  removed.
+  """
+  for f in op.collect("Filter"):
+    if f.c is None or not isinstance(f.cond, Op):
+      continue
+    conds, f.cond = conjuncts(f.cond), Bool(True)
+    for c in conds:
+      if not (covers(f.c, c) and push_conjunct(f.c, c)):
+        f.cond = add_conjunct(f.cond, c)
+    if not (isinstance(f.cond, Bool) and f.cond.v is True):
+      continue
+    if f == op:
+      op = f.c
+      op.p = None
+    else:
+      f.replace(f.c)
+  return op
+
+def expr_attrs(exprs):
+  """
+  names of the attributes referenced by exprs, or None if they may
+  need every attribute (python functions, *)
+  """
+  names = set()
+  for e in exprs:
+    if not isinstance(e, Op) or e.collect(Star):
+      return None
+    names |= attr_names(e)
+  return names
+
+def prune_columns(op, needed=None):
+  """
+  Make every operator produce only the attributes its ancestors
+  reference: Scans only parse the needed columns and Projects drop
+  unused expressions.  Attributes are matched by name, whatever their
+  table qualifier.
+
+  @needed  names op's parent uses, None for all of them
+  """
+  klass = op.__class__.__name__
+  def plus(exprs):
+    names = expr_attrs(exprs)
+    if names is None or needed is None:
+      return None
+    return needed | names
+
+  if klass in ("Scan", "IndexScan"):
+    if needed is not None and os.path.exists(op.filename):
+      fields = op.full().fields
+      op.prune([f for f in fields if f in needed] or list(fields[:1]))
+
+  elif klass == "Project":
+    if needed is not None and expr_attrs(op.exprs) is not None:
+      keep = [(e, a) for e, a in zip(op.exprs, op.aliases) if a in needed]
+      keep = keep or [(op.exprs[0], op.aliases[0])]
+      op.exprs, op.aliases = map(list, zip(*keep))
+    prune_columns(op.c, expr_attrs(op.exprs))
+
+  elif klass == "Filter":
+    prune_columns(op.c, plus([op.cond]))
+  elif klass in ("OrderBy", "TopN"):
+    prune_columns(op.c, plus(op.order_exprs))
+  elif klass == "GroupBy":
+    prune_columns(op.c, plus(op.group_exprs))
+  elif klass in ("Limit", "SubQuerySource", "Source"):
+    prune_columns(op.c, needed)
+
+  elif klass in ("Join", "IndexJoin"):
+    exprs = [op.cond]
+    if klass == "IndexJoin":
+      exprs += [op.key] + op.residual
+    childneeded = plus(exprs)
+    prune_columns(op.l, childneeded)
+    prune_columns(op.r, childneeded)
+
+  elif isinstance(op, UnaryOp):
+    prune_columns(op.c, None)
+  elif isinstance(op, BinaryOp):
+    prune_columns(op.l, None)
+    prune_columns(op.r, None)
+  return op
+
+def topn_rewrite(op):
+  """
+  Replace every Limit directly above an OrderBy with a TopN operator
+  """
+  for limit in op.collect("Limit"):
+    orderby = limit.c
+    if not isinstance(orderby, OrderBy):
+      continue
+    topn = TopN(orderby.c, orderby.order_exprs, orderby.ascdesc,
+        limit.limit, limit.offset)
+    if limit == op:
+      op = topn
+    else:
+      limit.replace(topn)
+  return op
+
+# comparison with the attribute on the right -> same with it on the left
+flipped_ops = { "=": "=", "<": ">", "<=": ">=", ">": "<", ">=": "<=" }
+
+def sargable(cond, scan):
+  """
+  If cond compares a column of scan with a constant, return
+  (column, op, value) with the column on the left side of op, where op
+  is one of =, <, <=, >, >= or "between" (value is then (lower, upper))
+  """
+  fields = scan.fields
+  def column(e):
+    if isinstance(e, Attr) and e.attr in fields:
+      return e.attr
+    return None
+
+  if isinstance(cond, Between):
+    col = column(cond.expr)
+    if col and is_const(cond.lower) and is_const(cond.upper):
+      return col, "between", (cond.lower(None), cond.upper(None))
+  if isinstance(cond, Expr) and cond.r is not None and cond.op in flipped_ops:
+    col = column(cond.l)
+    if col and is_const(cond.r):
+      return col, cond.op, cond.r(None)
+    col = column(cond.r)
+    if col and is_const(cond.l):
+      return col, flipped_ops[cond.op], cond.l(None)
+  return None
+
+def index_scan(scan, conds):
+  """
+  Pick an index to evaluate some of the conjuncts conds over scan.
+  Equalities are preferred over ranges, and hash over sorted indexes.
+  All range conjuncts on the chosen column are answered by the index.
+
+  @return (IndexScan, residual conjuncts) or None
+  """
+  preds = [(c, sargable(c, scan)) for c in conds]
+  preds = [(c, p) for c, p in preds if p is not None]
+
+  for c, (col, op, v) in preds:
+    kinds = index_kinds(scan.filename, col)
+    if op == "=" and kinds:
+      kind = "hash" in kinds and "hash" or "sorted"
+      return IndexScan(scan, col, kind, v, v), [x for x in conds if x is not c]
+
+  for c, (col, op, v) in preds:
+    if "sorted" not in index_kinds(scan.filename, col):
+      continue
+    iscan = IndexScan(scan, col, "sorted")
+    used = []
+    for c2, (col2, op2, v2) in preds:
+      if col2 != col or op2 == "=":
         continue
-      if not all(a in sourcealiases for a in names):
+      if op2 == "between":
+        bounds = [(">=", v2[0]), ("<=", v2[1])]
+      else:
+        bounds = [(op2, v2)]
+      for bop, bv in bounds:
+        if bop in (">", ">=") and (iscan.lo is None or bv >= iscan.lo):
+          iscan.lo_incl = (bop == ">=") and (iscan.lo is None or bv > iscan.lo or iscan.lo_incl)
+          iscan.lo = bv
+        elif bop in ("<", "<=") and (iscan.hi is None or bv <= iscan.hi):
+          iscan.hi_incl = (bop == "<=") and (iscan.hi is None or bv < iscan.hi or iscan.hi_incl)
+          iscan.hi = bv
+      used.append(c2)
+    return iscan, [x for x in conds if x not in used]
+  return None
+
+def index_rewrite(op):
+  """
+  Replace Filter(Scan) by an IndexScan, followed by a Filter with the
+  rest of the condition, if the condition has a conjunct that an index
+  declared with index.create_index can answer
+  """
+  for f in op.collect("Filter"):
+    scan = f.c
+    if scan.__class__.__name__ != "Scan" or not indexed_columns(scan.filename):
+      continue
+    choice = index_scan(scan, conjuncts(f.cond))
+    if choice is None:
+      continue
+    iscan, residual = choice
+    if residual:
+      f.cond = conjoin(residual)
+      f.c = iscan
+    elif f == op:
+      op = iscan
+    else:
+      f.replace(iscan)
+  return op
+
+def row_group_rewrite(op):
+  """
+  Hand the conjuncts of a Filter directly above a Scan of a row group
+  file (rowgroup.py) that compare a column with a constant to the
+  Scan, which skips the row groups that cannot satisfy them.  The
+  Filter stays to evaluate them on the remaining rows
+  """
+  for f in op.collect("Filter"):
+    scan = f.c
+    if scan.__class__.__name__ != "Scan" or not is_rowgroupfile(scan.filename):
+      continue
+    preds = [sargable(c, scan) for c in conjuncts(f.cond)]
+    scan.skip_preds = [p for p in preds if p is not None]
+
+def index_join_key(cond, scan, kinds):
+  """
+  If cond is <indexed column of scan> = <expression over the other
+  input>, return (column, kind, expression)
+  """
+  if not (isinstance(cond, Expr) and cond.op == "=" and cond.r is not None):
+    return None
+  fields = set(scan.fields)
+  for col, other in ((cond.l, cond.r), (cond.r, cond.l)):
+    if not (isinstance(col, Attr) and col.attr in kinds):
+      continue
+    names = attr_names(other)
+    if names and not (names & fields):
+      ks = kinds[col.attr]
+      return col.attr, "hash" in ks and "hash" or "sorted", other
+  return None
+
+def index_join_rewrite(op):
+  """
+  Replace a Join with an IndexJoin if one of its inputs is a Scan with
+  an index on a column that the join condition equates with an
+  expression over the other input.  The right input is preferred as
+  the indexed (inner) side
+  """
+  for join in op.collect("Join"):
+    for side in ("r", "l"):
+      scan = getattr(join, side)
+      if scan.__class__.__name__ != "Scan":
         continue
-      key = tuple(names)
-      pairs[key].append(str(expr))
+      kinds = dict([(col, index_kinds(scan.filename, col))
+        for col in indexed_columns(scan.filename)])
+      if not kinds:
+        continue
+      conds = conjuncts(join.cond)
+      for c in conds:
+        found = index_join_key(c, scan, kinds)
+        if found is None:
+          continue
+        column, kind, key = found
+        residual = [x for x in conds if x is not c]
+        ijoin = IndexJoin(join.l, join.r, join.cond, side, column, kind, key, residual)
+        if join == op:
+          op = ijoin
+        else:
+          join.replace(ijoin)
+        break
+      else:
+        continue
+      break
+  return op
+
+# Cardinality estimates, from the statistics of stats.py when they
+# have been collected, otherwise from System R's default selectivities
+DEFAULT_ROWS = 1000
+EQ_SEL = 0.1
+RANGE_SEL = 1 / 3.0
+BETWEEN_SEL = 0.25
+DEFAULT_SEL = 0.5
+GROUP_FRACTION = 0.1
 
-  print pairs
+def scan_rows(scan):
+  """
+  Rows of a Scan's file: counted by its statistics, or extrapolated
+  from the length of its first lines
+  """
+  if not os.path.exists(scan.filename):
+    return DEFAULT_ROWS
+  stats = table_stats(scan.filename)
+  if stats is not None:
+    return stats.rows
+  if scan.is_native():
+    return scan.native().nrows
+  size = os.path.getsize(scan.filename)
+  with open(scan.filename) as f:
+    head = f.read(1 << 16)
+  lines = head.count("\n")
+  if not head or len(head) >= size:
+    return max(0, lines - 1)
+  return max(1, int(size * lines / float(len(head))) - 1)
+
+def column_stats(*ops):
+  """
+  @return function that maps an Attr to the ColumnStats of the column
+          of a Scan under ops that provides it, or None
+  """
+  scans = [s for op in ops for s in op.collect(["Scan", "IndexScan"])]
+  def column(attr):
+    for scan in scans:
+      if provides(scan, attr):
+        stats = table_stats(scan.filename)
+        return stats and stats.columns.get(attr.attr)
+    return None
+  return column
+
+def no_stats(attr):
+  return None
+
+def compare_selectivity(cond, column):
+  """
+  Selectivity of <attribute> <comparison> <constant>, or of
+  <attribute> = <attribute>, from the statistics of the attributes
+
+  @return None if there are no statistics for it
+  """
+  l, r, op = cond.l, cond.r, cond.op
+  if isinstance(r, Attr) and not isinstance(l, Attr):
+    l, r, op = r, l, flipped_ops.get(op, op)
+  c = isinstance(l, Attr) and column(l)
+  if not c:
+    return None
+
+  if isinstance(r, Attr):
+    c2 = column(r)
+    if op != "=" or not c2:
+      return None
+    # every value of the side with fewer distinct values has a match
+    return c.nonnull() * c2.nonnull() / max(c.ndv, c2.ndv, 1)
+
+  if not is_const(r):
+    return None
+  v = r(None)
+  if c.type == "num" and not isinstance(v, (int, long, float)):
+    return None
+  if op == "<>":
+    return (1.0 - c.equal(v)) * c.nonnull()
+  bounds = {
+    "=": (v, v, True, True),
+    "<": (None, v, True, False),
+    "<=": (None, v, True, True),
+    ">": (v, None, False, True),
+    ">=": (v, None, True, True)
+  }
+  if op not in bounds:
+    return None
+  return c.range(*bounds[op])
+
+def selectivity(cond, column=no_stats):
+  """
+  Fraction of tuples that satisfy cond
+
+  @column function Attr -> ColumnStats or None, see column_stats
+  """
+  if not isinstance(cond, Op):
+    return DEFAULT_SEL
+  if isinstance(cond, Bool):
+    return cond.v and 1.0 or 0.0
+  if isinstance(cond, Between):
+    c = isinstance(cond.expr, Attr) and column(cond.expr)
+    if c and is_const(cond.lower) and is_const(cond.upper):
+      sel = c.range(cond.lower(None), cond.upper(None))
+      if sel is not None:
+        return sel
+    return BETWEEN_SEL
+  if isinstance(cond, Expr):
+    op = cond.op.lower()
+    if op == "and":
+      return selectivity(cond.l, column) * selectivity(cond.r, column)
+    if op == "or":
+      l, r = selectivity(cond.l, column), selectivity(cond.r, column)
+      return l + r - l * r
+    if op == "not":
+      return 1.0 - selectivity(cond.l, column)
+    if cond.r is not None:
+      sel = compare_selectivity(cond, column)
+      if sel is not None:
+        return sel
+    if op in ("=", "=="):
+      return EQ_SEL
+    if op in ("<>", "!="):
+      return 1.0 - EQ_SEL
+    if op in ("<", "<=", ">", ">="):
+      return RANGE_SEL
+  return DEFAULT_SEL
+
+def group_rows(rows, exprs, column=no_stats):
+  """
+  Number of groups of rows tuples grouped by exprs: the product of the
+  distinct counts of the grouped attributes, at most rows
+  """
+  if not exprs:
+    return 1
+  groups = 1.0
+  for e in exprs:
+    c = isinstance(e, Attr) and column(e)
+    if not c:
+      return max(1, rows * GROUP_FRACTION)
+    groups *= max(c.ndv, 1)
+  return max(1, min(rows, groups))
+
+def estimate_rows(op):
+  """
+  Estimated number of tuples op produces
+  """
+  klass = op.__class__.__name__
+  if klass == "Scan":
+    return scan_rows(op)
+  if klass == "IndexScan":
+    c = column_stats(op)(Attr(op.column))
+    sel = c and c.range(op.lo, op.hi, op.lo_incl, op.hi_incl)
+    if sel is None:
+      sel = op.lo == op.hi and EQ_SEL or RANGE_SEL
+    return scan_rows(op) * sel
+  if klass == "Filter":
+    return estimate_rows(op.c) * selectivity(op.cond, column_stats(op))
+  if klass in ("Limit", "TopN"):
+    return min(op.limit, estimate_rows(op.c))
+  if klass == "GroupBy":
+    return group_rows(estimate_rows(op.c), op.group_exprs, column_stats(op))
+  if klass == "Project":
+    aggs = [e for e in op.exprs if isinstance(e, Op)
+        and any(func.is_agg() for func in e.collect(Func))]
+    if aggs and not isinstance(op.c, GroupBy):
+      return 1
+    return estimate_rows(op.c)
+  if isinstance(op, BinaryOp):
+    rows = estimate_rows(op.l) * estimate_rows(op.r)
+    return rows * selectivity(op.cond, column_stats(op))
+  if klass == "From":
+    rows = 1.0
+    for c in op.cs:
+      rows *= estimate_rows(c)
+    return rows * EQ_SEL ** (len(op.cs) - 1)
+  if isinstance(op, UnaryOp):
+    return estimate_rows(op.c)
+  return DEFAULT_ROWS
+
+# Costs of the join algorithms, in units of one tuple read or produced
+TUPLE_COST = 1.0
+HASH_BUILD_COST = 2.0     # per right (build) tuple inserted in the hash table
+INDEX_PROBE_COST = 2.0    # per left tuple looked up in an index
+PAIR_COST = 1.0           # per pair of tuples compared by a nested loop
+
+# Above this many relations join orders are picked greedily
+DP_MAX_RELATIONS = 12
+
+
+class JoinPred(object):
+  """
+  A conjunct of a query's WHERE clause and the relations (bitmask over
+  the From sources) it references.  For an equality, lmask and rmask
+  are the relations of each side.
+  """
+  def __init__(self, cond, mask, lmask=0, rmask=0):
+    self.cond = cond
+    self.mask = mask
+    self.lmask = lmask
+    self.rmask = rmask
+    self.sel = 1.0
+
+  def equates(self, m1, m2):
+    """
+    whether this is <expr over m1> = <expr over m2>, in either order
+    """
+    l, r = self.lmask, self.rmask
+    if not (l and r):
+      return False
+    return (not (l & ~m1) and not (r & ~m2)) or (not (l & ~m2) and not (r & ~m1))
+
+
+class JoinPlan(object):
+  """
+  A join tree over the relations in mask.  Operators are only created
+  by build(), once the order is chosen, since creating a Join reparents
+  its inputs.
+  """
+  def __init__(self, mask, rows, cost, source=None, l=None, r=None, preds=()):
+    self.mask = mask
+    self.rows = rows
+    self.cost = cost
+    self.source = source
+    self.l = l
+    self.r = r
+    self.preds = preds
+    self.filtered = False
+
+  def build(self):
+    if self.source is not None:
+      return self.source
+    return Join(self.l.build(), self.r.build(), conjoin([p.cond for p in self.preds]))
+
+
+def schema_known(op):
+  """
+  whether provides() knows every attribute op produces: false if the
+  file of a Scan under op does not exist (yet)
+  """
+  return all(os.path.exists(s.filename) for s in op.collect(["Scan", "IndexScan"]))
 
-  join_order = []
-  for pair, conds in pairs.iteritems():
-    pair = filter(lambda name: name not in join_order, pair)
-    if not pair: 
+def relations(expr, sources):
+  """
+  bitmask of the sources that provide expr's attributes.  An attribute
+  that several sources provide counts for all of them, and one that no
+  source is known to provide for all the sources whose schema is not
+  known, so a predicate always connects every source it may reference.
+
+  @return the mask, or None if an attribute can come from no source
+  """
+  mask = 0
+  for a in expr.collect(Attr):
+    owners = [i for i, s in enumerate(sources) if provides(s, a)]
+    if not owners:
+      owners = [i for i, s in enumerate(sources) if not schema_known(s)]
+    if not owners:
+      return None
+    for i in owners:
+      mask |= 1 << i
+  return mask
+
+def join_preds(conds, sources):
+  """
+  JoinPreds of the conjuncts that reference the sources.  The others,
+  whose attributes no source provides, are left out of the join tree
+  and stay in the Filters above it (see from_expansion)
+  """
+  preds = []
+  for c in conds:
+    if not isinstance(c, Op):
+      continue
+    mask = relations(c, sources)
+    if not mask:
+      continue
+    pred = JoinPred(c, mask)
+    if isinstance(c, Expr) and c.op == "=" and c.r is not None:
+      pred.lmask = relations(c.l, sources) or 0
+      pred.rmask = relations(c.r, sources) or 0
+      if pred.lmask & pred.rmask:
+        # not an equality between two disjoint sets of relations
+        pred.lmask = pred.rmask = 0
+    preds.append(pred)
+  return preds
+
+def join_selectivity(pred, base_rows, column):
+  """
+  Selectivity of a predicate between relations.  Without statistics an
+  equality is assumed to match each value of the larger relation once
+  """
+  if pred.lmask and pred.rmask:
+    sel = compare_selectivity(pred.cond, column)
+    if sel is not None:
+      return sel
+    rows = [n for i, n in enumerate(base_rows) if pred.mask & (1 << i)]
+    return 1.0 / max(max(rows), 1)
+  return selectivity(pred.cond, column)
+
+def index_probe(plan, preds, outer):
+  """
+  Whether a Join with plan as its right input can become an IndexJoin
+  (see index_join_rewrite): plan is a bare Scan with an index on a
+  column that one of preds equates with an expression over outer
+  """
+  scan = plan.source
+  if scan is None or plan.filtered or scan.__class__.__name__ != "Scan":
+    return False
+  columns = indexed_columns(scan.filename)
+  for p in preds:
+    if not p.equates(outer, plan.mask):
       continue
-    join_order.extend(pair)
+    for side in (p.cond.l, p.cond.r):
+      if isinstance(side, Attr) and side.attr in columns and provides(scan, side):
+        return True
+  return False
+
+def join_plan(p1, p2, preds):
+  """
+  Cheapest way to join two plans over disjoint relations: hash join if
+  some predicate equates them, index nested loops if the right input
+  is an indexed Scan, otherwise nested loops; with either one as the
+  right input
+  """
+  m1, m2 = p1.mask, p2.mask
+  mask = m1 | m2
+  # predicates with relations on both sides and none elsewhere
+  conds = [p for p in preds if p.mask & m1 and p.mask & m2 and not p.mask & ~mask]
+  rows = p1.rows * p2.rows
+  for p in conds:
+    rows *= p.sel
+  equi = any(p.equates(p1.mask, p2.mask) for p in conds)
 
-  for alias in sourcealiases:
-    if alias not in join_order:
-      join_order.append(alias)
+  best = None
+  for l, r in ((p1, p2), (p2, p1)):
+    costs = [l.cost + r.cost + PAIR_COST * l.rows * r.rows]
+    if equi:
+      costs.append(l.cost + r.cost + HASH_BUILD_COST * r.rows + TUPLE_COST * l.rows)
+    if index_probe(r, conds, l.mask):
+      costs.append(l.cost + INDEX_PROBE_COST * l.rows)
+    cost = min(costs) + TUPLE_COST * rows
+    if best is None or cost < best.cost:
+      best = JoinPlan(mask, rows, cost, l=l, r=r, preds=conds)
+  return best
 
-  print join_order
-  join_op = None
-  for i, alias in enumerate(join_order):
-    if not join_op:
-      join_op = alias2source[alias]
+def connected(mask, preds):
+  """
+  whether the predicates among the relations of mask connect all of them
+  """
+  reached = mask & -mask
+  inside = [p.mask for p in preds if not (p.mask & ~mask)]
+  while True:
+    more = reached
+    for m in inside:
+      if m & reached:
+        more |= m
+    if more == reached:
+      return reached == mask
+    reached = more
+
+def components(mask, preds):
+  """
+  split mask into the groups of relations connected by preds
+  """
+  ret = []
+  while mask:
+    comp = mask & -mask
+    while True:
+      more = comp
+      for p in preds:
+        if p.mask & comp and not (p.mask & ~mask):
+          more |= p.mask
+      if more == comp:
+        break
+      comp = more
+    ret.append(comp)
+    mask &= ~comp
+  return ret
+
+def bits(mask):
+  return [1 << i for i in xrange(mask.bit_length()) if mask & (1 << i)]
+
+def dp_order(mask, leaves, preds):
+  """
+  Best join tree (bushy ones included) over the connected relations of
+  mask: dynamic programming over its connected subsets, each split
+  into two connected subsets that some predicate joins
+  """
+  best = dict((m, leaves[m]) for m in bits(mask))
+  subsets = []
+  sub = mask
+  while sub:
+    if sub & (sub - 1):
+      subsets.append(sub)
+    sub = (sub - 1) & mask
+  subsets.sort(key=lambda s: bin(s).count("1"))
+
+  for s in subsets:
+    inside = [p for p in preds if not (p.mask & ~s)]
+    if not connected(s, inside):
+      continue
+    low = s & -s
+    # s1 always holds the lowest relation, so every split is seen once
+    s1 = (s - 1) & s
+    while s1:
+      if s1 & low:
+        s2 = s ^ s1
+        if s1 in best and s2 in best:
+          plan = join_plan(best[s1], best[s2], inside)
+          if plan.preds and (s not in best or plan.cost < best[s].cost):
+            best[s] = plan
+      s1 = (s1 - 1) & s
+
+  if mask not in best:
+    # predicates over 3+ relations can connect a group that no split
+    # into two connected halves joins
+    return greedy_order([leaves[m] for m in bits(mask)], preds)
+  return best[mask]
+
+def greedy_order(plans, preds):
+  """
+  Repeatedly join the two plans whose join is the cheapest.  Pairs
+  that no predicate connects (cross products) are only joined once no
+  connected pair is left
+  """
+  plans = list(plans)
+  while len(plans) > 1:
+    best = None
+    for i, p1 in enumerate(plans):
+      for p2 in plans[i+1:]:
+        plan = join_plan(p1, p2, preds)
+        if best is None or (not plan.preds, plan.cost) < (not best.preds, best.cost):
+          best = plan
+    plans = [p for p in plans if p.mask & best.mask == 0] + [best]
+  return plans[0]
+
+def order_joins(sources, conds):
+  """
+  Cost based join order of sources, given the conjuncts of the WHERE
+  clause.  Each connected group of relations is ordered by dynamic
+  programming (or greedily if it has more than DP_MAX_RELATIONS
+  relations); cross products are only used to combine the groups.
+
+  @return JoinPlan
+  """
+  preds = join_preds(conds, sources)
+  base_rows = map(estimate_rows, sources)
+  column = column_stats(*sources)
+  for p in preds:
+    p.sel = join_selectivity(p, base_rows, column)
+  leaves = {}
+  for i, source in enumerate(sources):
+    m = 1 << i
+    plan = JoinPlan(m, base_rows[i], TUPLE_COST * base_rows[i], source=source)
+    for p in preds:
+      if p.mask == m:
+        plan.rows *= p.sel
+        plan.filtered = True
+    leaves[m] = plan
+
+  plans = []
+  for comp in components((1 << len(sources)) - 1, preds):
+    if len(bits(comp)) <= DP_MAX_RELATIONS:
+      plans.append(dp_order(comp, leaves, preds))
     else:
-      key = (join_order[i-1], join_order[i])
-      if key in pairs:
-        exprs = pairs[key]
-        expr = exprs[0]
-        for e in exprs[1:]:
-          expr = Expr("and", expr, e)
-        join_op = Join(join_op, alias2source[alias], expr)
-      else:
-        join_op = Join(join_op, alias2source[alias])
+      plans.append(greedy_order([leaves[m] for m in bits(comp)], preds))
+  return greedy_order(plans, preds)
 
+def from_expansion(op):
+  """
+  Replace the first From operator with the cheapest Join tree of its
+  sources according to order_joins.  Join predicates come from the
+  Filters between the From and the top of its query block; they stay in
+  the Filters as well and push_predicates later drops the duplicates.
+  Conjuncts that order_joins could not attribute to the sources are
+  only in the Filters, so they are still evaluated above the join tree.
+  """
+  fromop = op.collectone("From")
+  conds = []
+  p = fromop.p
+  while p is not None and p.__class__.__name__ != "SubQuerySource":
+    if isinstance(p, Filter) and isinstance(p.cond, Op):
+      conds.extend(conjuncts(p.cond))
+    p = p.p
 
+  join_op = order_joins(fromop.cs, conds).build()
+  if fromop == op:
+    return join_op
   fromop.replace(join_op)
-
   return op
@@ -1,6 +1,11 @@
+import os
 import re
+import sys
 import math
 import numpy as np
+if __name__ == "__main__":
+  # ../common holds the csv reader the engines share
+  sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
 from ops import *
 
 from parsimonious.grammar import Grammar
@@ -64,7 +69,7 @@ grammar = Grammar(
     orderby        = ORDER BY ordering_term (ws "," ordering_term)*
     ordering_term  = ws expr (ASC/DESC)?
 
-    limit          = LIMIT wsp expr (OFFSET expr)?
+    limit          = LIMIT wsp expr (OFFSET wsp expr)?
 
     col_ref        = (table_name ".")? column_name
 
@@ -308,10 +313,14 @@ class Visitor(NodeVisitor):
     order = children[2] or "asc"
     return (expr, order)
 
+  def visit_ASC(self, node, children):
+    return "asc"
+
+  def visit_DESC(self, node, children):
+    return "desc"
+
   def visit_limit(self, node, children):
-    if children[3]:
-      print "WARN: don't support offset yet"
-    return Limit(None, children[2])
+    return Limit(None, children[2], children[3] or 0)
 
   def visit_col_ref(self, node, children):
     return Attr(children[1], children[0])
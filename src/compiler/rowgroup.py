@@ -0,0 +1,430 @@
+"""
+Compressed row group table format (.rgf), for tables kept at rest.
+
+    python rowgroup.py [--no-zlib] data.csv [data.rgf]    convert a csv file
+    Scan("data.rgf")
+
+Rows are stored in groups of GROUP_ROWS rows.  Each column of a group
+is one chunk, encoded with whichever of these suits its values:
+
+    int       num columns of integers: the integers, see below
+    dict      a dictionary of the distinct values (float64 or strings)
+              and the integer codes of the values into it
+    plain     float64 values, or the integer lengths of the strings
+              followed by their bytes
+
+and integers (values, codes, lengths) with the smallest of
+
+    bitpack   offset from the minimum, in as few bits as the largest needs
+    delta     the first value and the bitpacked differences of the others
+    rle       the bitpacked values and lengths of the runs of equal values
+
+A chunk is then zlib compressed, unless that does not make it smaller
+or compression is turned off.
+
+Layout:
+
+    "RGFILE01"      magic
+    column chunks
+    footer          json: schema, and per row group its row count and
+                    per column chunk its position, encoding and the
+                    min and max of its values
+    footer length   little endian uint64
+    "RGFILE01"
+
+A Scan reads only the chunks of the columns it produces, and skips
+the row groups whose min and max show that no row satisfies a
+conjunct the optimizer pushed to it (Scan.skip_preds).
+"""
+import os
+import sys
+import json
+import zlib
+import struct
+import numpy as np
+from table import Table
+
+SUFFIX = ".rgf"
+MAGIC = "RGFILE01"
+# rows per row group
+GROUP_ROWS = 65536
+# num columns with at most this fraction of distinct values are
+# dictionary encoded; string columns with at most DICT_STR_FRACTION
+DICT_NUM_FRACTION = 0.25
+DICT_STR_FRACTION = 0.5
+ZLIB_LEVEL = 6
+# integral floats beyond this are not stored as integers
+MAX_INT = 1 << 53
+
+
+def is_rowgroupfile(filename):
+  return filename.endswith(SUFFIX)
+
+
+def pack(u, width):
+  """
+  Bitpack non negative int64 values, width bits each
+  """
+  if not width or not len(u):
+    return ""
+  bits = np.empty((len(u), width), dtype=np.uint8)
+  for b in xrange(width):
+    bits[:, b] = (u >> b) & 1
+  return np.packbits(bits).tostring()
+
+def unpack(buf, n, width):
+  if not width:
+    return np.zeros(n, dtype=np.int64)
+  bits = np.unpackbits(np.frombuffer(buf, dtype=np.uint8))[:n * width]
+  bits = bits.reshape(n, width)
+  u = np.zeros(n, dtype=np.int64)
+  for b in xrange(width):
+    u |= bits[:, b].astype(np.int64) << b
+  return u
+
+def frame(x):
+  """
+  @return (minimum, bits needed for the offsets from it) of int64 values
+  """
+  if not len(x):
+    return 0, 0
+  base = int(x.min())
+  return base, (int(x.max()) - base).bit_length()
+
+
+def encode_ints(x):
+  """
+  @x     int64 array
+  @return (meta dict, bytes)
+  """
+  n = len(x)
+  base, width = frame(x)
+  choices = [(n * width, "bitpack")]
+  if n > 1:
+    d = np.diff(x)
+    dbase, dwidth = frame(d)
+    choices.append(((n - 1) * dwidth, "delta"))
+    starts = np.concatenate(([0], np.flatnonzero(d) + 1))
+    values = x[starts]
+    lengths = np.diff(np.append(starts, n))
+    vframe, lframe = frame(values), frame(lengths)
+    choices.append((len(starts) * (vframe[1] + lframe[1]), "rle"))
+  kind = min(choices)[1]
+
+  if kind == "bitpack":
+    return dict(kind=kind, base=base, width=width), pack(x - base, width)
+  if kind == "delta":
+    meta = dict(kind=kind, first=int(x[0]), base=dbase, width=dwidth)
+    return meta, pack(d - dbase, dwidth)
+  vdata = pack(values - vframe[0], vframe[1])
+  ldata = pack(lengths - lframe[0], lframe[1])
+  meta = dict(kind=kind, runs=len(starts), values=vframe, lengths=lframe,
+      split=len(vdata))
+  return meta, vdata + ldata
+
+def decode_ints(meta, buf, n):
+  kind = meta["kind"]
+  if not n:
+    return np.zeros(0, dtype=np.int64)
+  if kind == "bitpack":
+    return unpack(buf, n, meta["width"]) + meta["base"]
+  if kind == "delta":
+    x = np.empty(n, dtype=np.int64)
+    x[0] = meta["first"]
+    x[1:] = unpack(buf, n - 1, meta["width"]) + meta["base"]
+    return np.cumsum(x)
+  runs, split = meta["runs"], meta["split"]
+  (vbase, vwidth), (lbase, lwidth) = meta["values"], meta["lengths"]
+  values = unpack(buf[:split], runs, vwidth) + vbase
+  lengths = unpack(buf[split:], runs, lwidth) + lbase
+  return np.repeat(values, lengths)
+
+
+def encode_strings(vals):
+  lengths = np.array([len(v) for v in vals], dtype=np.int64)
+  meta, data = encode_ints(lengths)
+  return dict(lengths=meta, split=len(data)), data + "".join(vals)
+
+def decode_strings(meta, buf, n):
+  split = meta["split"]
+  ends = np.cumsum(decode_ints(meta["lengths"], buf[:split], n)).tolist()
+  heap = buf[split:]
+  ret = np.empty(n, dtype=object)
+  ret[:] = [heap[a:b] for a, b in zip([0] + ends[:-1], ends)]
+  return ret
+
+
+def text(v):
+  """
+  json representation of a min or max; strings need not be utf-8
+  """
+  if isinstance(v, str):
+    return v.decode("latin-1")
+  return v
+
+def untext(v):
+  if isinstance(v, unicode):
+    return v.encode("latin-1")
+  return v
+
+
+def encode_chunk(values, type, compress=True):
+  """
+  @values num column: float64 array, others: object array of strings
+  @return (meta dict, bytes) of the column chunk
+  """
+  n = len(values)
+  if type == "num":
+    values = np.asarray(values, dtype=np.float64)
+    lo, hi = float(values.min()), float(values.max())
+    if np.isnan(lo) or np.isnan(hi):
+      lo = hi = None
+    if (lo is not None and -MAX_INT < lo and hi < MAX_INT
+        and (np.floor(values) == values).all()):
+      meta, data = encode_ints(values.astype(np.int64))
+      meta = dict(encoding="int", ints=meta)
+    else:
+      uniq, codes = np.unique(values, return_inverse=True)
+      if len(uniq) <= n * DICT_NUM_FRACTION:
+        cmeta, cdata = encode_ints(codes.astype(np.int64))
+        udata = uniq.astype("<f8").tostring()
+        meta = dict(encoding="dict", size=len(uniq), ints=cmeta, split=len(udata))
+        data = udata + cdata
+      else:
+        meta, data = dict(encoding="plain"), values.astype("<f8").tostring()
+  else:
+    uniq, codes = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+    lo, hi = uniq[0], uniq[-1]
+    if len(uniq) <= n * DICT_STR_FRACTION:
+      smeta, sdata = encode_strings(uniq)
+      cmeta, cdata = encode_ints(codes.astype(np.int64))
+      meta = dict(encoding="dict", size=len(uniq), strings=smeta,
+          ints=cmeta, split=len(sdata))
+      data = sdata + cdata
+    else:
+      smeta, data = encode_strings(values)
+      meta = dict(encoding="plain", strings=smeta)
+
+  meta["zlib"] = False
+  if compress:
+    z = zlib.compress(data, ZLIB_LEVEL)
+    if len(z) < len(data):
+      meta["zlib"], data = True, z
+  meta["min"], meta["max"] = text(lo), text(hi)
+  return meta, data
+
+def decode_chunk(meta, data, type, n):
+  """
+  @return (column, dictionary) as Table stores them: float64 values
+          and None for num columns, otherwise int32 codes into a sorted
+          array of the distinct strings
+  """
+  if meta["zlib"]:
+    data = zlib.decompress(data)
+  encoding = meta["encoding"]
+  if type == "num":
+    if encoding == "int":
+      return decode_ints(meta["ints"], data, n).astype(np.float64), None
+    if encoding == "dict":
+      split = meta["split"]
+      uniq = np.frombuffer(data[:split], dtype="<f8")
+      return uniq[decode_ints(meta["ints"], data[split:], n)], None
+    return np.frombuffer(data, dtype="<f8").copy(), None
+
+  if encoding == "dict":
+    split = meta["split"]
+    uniq = decode_strings(meta["strings"], data[:split], meta["size"])
+    return decode_ints(meta["ints"], data[split:], n).astype(np.int32), uniq
+  uniq, codes = np.unique(decode_strings(meta["strings"], data, n),
+      return_inverse=True)
+  return codes.astype(np.int32), uniq
+
+
+def chunk_matches(lo, hi, op, v):
+  """
+  whether a chunk whose values lie in [lo, hi] may hold a value that
+  satisfies <value> op v.  op and v as optimizer.sargable returns them
+  """
+  if op == "between":
+    return v[0] <= hi and v[1] >= lo
+  if op == "=":
+    return lo <= v <= hi
+  if op == "<":
+    return lo < v
+  if op == "<=":
+    return lo <= v
+  if op == ">":
+    return hi > v
+  if op == ">=":
+    return hi >= v
+  return True
+
+
+class RowGroupFile(object):
+  def __init__(self, filename):
+    tail = len(MAGIC) + 8
+    with open(filename, "rb") as f:
+      f.seek(0, os.SEEK_END)
+      size = f.tell()
+      f.seek(max(0, size - tail))
+      end = f.read(tail)
+      if size < len(MAGIC) + tail or end[8:] != MAGIC:
+        raise Exception("%s is not a row group file" % filename)
+      flen, = struct.unpack("<Q", end[:8])
+      f.seek(size - tail - flen)
+      footer = json.loads(f.read(flen))
+    self.filename = filename
+    self.fields = tuple(str(f) for f in footer["fields"])
+    self.types = tuple(str(t) for t in footer["types"])
+    self.groups = footer["groups"]
+    self.nrows = sum(g["rows"] for g in self.groups)
+
+  def schema(self):
+    return self.fields, self.types
+
+  def matches(self, group, preds):
+    """
+    whether rows of the group may satisfy all the (column, op, value)
+    preds, judging by the min and max of its chunks
+    """
+    for col, op, v in preds:
+      chunk = group["columns"].get(col)
+      if chunk is None or chunk["min"] is None:
+        continue
+      num = self.types[self.fields.index(col)] == "num"
+      vals = op == "between" and v or (v,)
+      if num and not all(isinstance(x, (int, long, float)) for x in vals):
+        continue
+      if not num and not all(isinstance(x, str) for x in vals):
+        continue
+      if not chunk_matches(untext(chunk["min"]), untext(chunk["max"]), op, v):
+        return False
+    return True
+
+  def tables(self, fields, preds=()):
+    """
+    Generate a Table of the fields per row group, skipping the groups
+    that cannot satisfy preds.  Only the chunks of fields are read
+    """
+    with open(self.filename, "rb") as f:
+      for group in self.groups:
+        if not self.matches(group, preds):
+          continue
+        yield self.group_table(f, group, fields)
+
+  def group_table(self, f, group, fields):
+    """
+    Table of the fields of a row group, read from the open file f
+    """
+    types = [self.types[self.fields.index(field)] for field in fields]
+    columns, dictionaries = {}, {}
+    for field, t in zip(fields, types):
+      chunk = group["columns"][field]
+      f.seek(chunk["offset"])
+      col, uniq = decode_chunk(chunk, f.read(chunk["length"]), t, group["rows"])
+      columns[field] = col
+      if uniq is not None:
+        dictionaries[field] = uniq
+    return Table(fields, types, columns, dictionaries)
+
+  def rows_at(self, fields, positions):
+    """
+    rows (dicts of the fields) at the given row numbers, in that order.
+    Only the row groups holding them are decoded
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    starts = np.cumsum([0] + [g["rows"] for g in self.groups])
+    gids = np.searchsorted(starts, positions, side="right") - 1
+    rows = [None] * len(positions)
+    with open(self.filename, "rb") as f:
+      for gid in np.unique(gids).tolist():
+        sel = np.nonzero(gids == gid)[0]
+        table = self.group_table(f, self.groups[gid], fields)
+        for i, row in zip(sel.tolist(), table.take(positions[sel] - starts[gid])):
+          rows[i] = row
+    return rows
+
+
+class RowGroupWriter(object):
+  """
+  Writes a row group file from chunks of columns, a row group at a time
+  """
+  def __init__(self, filename, fields, types, group_rows=None, compress=True):
+    self.filename = filename
+    self.fields = list(fields)
+    self.types = ["num" if t == "num" else "str" for t in types]
+    self.group_rows = group_rows or GROUP_ROWS
+    self.compress = compress
+    self.groups = []
+    self.pending = [[] for f in self.fields]
+    self.npending = 0
+    self.tmp = "%s.%d.tmp" % (filename, os.getpid())
+    self.out = open(self.tmp, "wb")
+    self.out.write(MAGIC)
+
+  def add(self, cols):
+    """
+    @cols list of columns, in fields order, of the same length: arrays
+          or lists of floats for num columns, strings otherwise
+    """
+    if not cols or not len(cols[0]):
+      return
+    for pending, col in zip(self.pending, cols):
+      pending.append(col)
+    self.npending += len(cols[0])
+    while self.npending >= self.group_rows:
+      self.flush(self.group_rows)
+
+  def flush(self, n):
+    """
+    Write the first n pending rows as a row group
+    """
+    group = dict(rows=n, columns={})
+    for i, (field, t) in enumerate(zip(self.fields, self.types)):
+      if t == "num":
+        col = np.concatenate([np.asarray(c, dtype=np.float64) for c in self.pending[i]])
+      else:
+        col = np.empty(self.npending, dtype=object)
+        col[:] = [str(v) for c in self.pending[i] for v in c]
+      self.pending[i] = [col[n:]]
+      meta, data = encode_chunk(col[:n], t, self.compress)
+      meta["offset"], meta["length"] = self.out.tell(), len(data)
+      self.out.write(data)
+      group["columns"][field] = meta
+    self.groups.append(group)
+    self.npending -= n
+
+  def close(self):
+    if self.npending:
+      self.flush(self.npending)
+    footer = json.dumps(dict(fields=self.fields, types=self.types, groups=self.groups))
+    self.out.write(footer)
+    self.out.write(struct.pack("<Q", len(footer)))
+    self.out.write(MAGIC)
+    self.out.close()
+    os.rename(self.tmp, self.filename)
+
+
+def convert(src, dst=None, compress=True):
+  """
+  Write the table of a Scan'able file (e.g. a csv) as a row group file
+
+  @return name of the row group file
+  """
+  from ops import Scan
+  scan = Scan(src)
+  dst = dst or os.path.splitext(scan.filename)[0] + SUFFIX
+  writer = RowGroupWriter(dst, scan.fields, scan.types, compress=compress)
+  for table in scan.tables():
+    writer.add([table.column(f) for f in scan.fields])
+  writer.close()
+  return dst
+
+
+if __name__ == "__main__":
+  sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+  args = [a for a in sys.argv[1:] if a != "--no-zlib"]
+  if len(args) not in (1, 2):
+    print "usage: python rowgroup.py [--no-zlib] <table.csv> [<table.rgf>]"
+    sys.exit(1)
+  print convert(*args, compress="--no-zlib" not in sys.argv[1:])
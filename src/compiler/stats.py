@@ -0,0 +1,349 @@
+"""
+Table statistics for cardinality estimation.
+
+    analyze("data.csv")          # ANALYZE: scan the file and keep its stats
+    table_stats("data.csv")      # TableStats, or None if not collected
+    python stats.py data.csv     # the same from the command line
+
+Queries do not collect statistics: without analyze() the optimizer
+falls back to its default estimates.  With the DB_AUTO_STATS
+environment variable set, statistics are also collected as a side
+effect of any Scan that reads its file to the end (Scan.proc_file,
+Scan.native_tables), for the columns that Scan reads.
+Per table they hold the row count and, per column:
+
+    nulls     number of empty cells
+    min, max  over the non empty cells
+    ndv       distinct values, estimated with a k minimum values sketch
+    hist      equi-depth histogram bounds (num columns only), built
+              from a systematic sample of the column
+
+They are kept per file, in memory and in the table catalog
+(catalog.py), and dropped as soon as the file's size or modification
+time change.  The optimizer's estimators
+(optimizer.selectivity, optimizer.estimate_rows) turn them into
+predicate selectivities and join and group by cardinalities.
+"""
+import os
+import bisect
+import heapq
+import numpy as np
+import catalog
+from catalog import table_path, file_stamp
+
+# buckets of the equi-depth histograms
+HIST_BUCKETS = 32
+# values sampled per column to build the histogram
+SAMPLE_SIZE = 4096
+# hashes kept by the distinct value sketch
+SKETCH_SIZE = 1024
+
+# collect statistics in every Scan that reads its file to the end, not
+# only in analyze()
+auto = bool(os.environ.get("DB_AUTO_STATS"))
+
+MASK64 = (1 << 64) - 1
+# odd 64 bit multiplier (2^64 / golden ratio) that spreads python's hash
+# of the cells over [0, 2^64)
+MIX = 0x9E3779B97F4A7C15
+
+
+class ColumnStats(object):
+  def __init__(self, name, type, nulls, min, max, ndv, hist=None, rows=0):
+    self.name = name
+    self.type = type
+    self.nulls = nulls
+    self.min = min
+    self.max = max
+    self.ndv = ndv
+    self.hist = hist
+    self.rows = rows
+
+  def nonnull(self):
+    """
+    fraction of the rows that are not null
+    """
+    if not self.rows:
+      return 0.0
+    return (self.rows - self.nulls) / float(self.rows)
+
+  def below(self, v):
+    """
+    fraction of the non null values < v, interpolated in the histogram
+    """
+    b = self.hist
+    if v <= b[0]:
+      return 0.0
+    if v > b[-1]:
+      return 1.0
+    # b[i] < v <= b[i+1]
+    i = bisect.bisect_left(b, v) - 1
+    return (i + (v - b[i]) / float(b[i+1] - b[i])) / (len(b) - 1)
+
+  def equal(self, v):
+    """
+    fraction of the non null values = v.  A value that bounds several
+    buckets is frequent enough to fill those buckets.
+    """
+    if self.min is None or v < self.min or v > self.max:
+      return 0.0
+    sel = 1.0 / max(self.ndv, 1)
+    if self.hist:
+      b = self.hist
+      spanned = bisect.bisect_right(b, v) - bisect.bisect_left(b, v) - 1
+      sel = max(sel, spanned / float(len(b) - 1))
+    return sel
+
+  def range(self, lo=None, hi=None, lo_incl=True, hi_incl=True):
+    """
+    fraction of the rows whose value is between lo and hi, None meaning
+    unbounded, or None if the column has no histogram
+    """
+    if lo is not None and lo == hi and lo_incl and hi_incl:
+      return self.equal(lo) * self.nonnull()
+    if not self.hist:
+      return None
+    upper, lower = 1.0, 0.0
+    if hi is not None:
+      upper = self.below(hi) + (hi_incl and self.equal(hi) or 0.0)
+    if lo is not None:
+      lower = self.below(lo) + (not lo_incl and self.equal(lo) or 0.0)
+    return min(1.0, max(0.0, upper - lower)) * self.nonnull()
+
+  def to_dict(self):
+    return dict(self.__dict__)
+
+  @staticmethod
+  def from_dict(d):
+    d = dict((str(k), v) for k, v in d.items())
+    if d["type"] != "num":
+      d["min"], d["max"] = catalog.encode(d["min"]), catalog.encode(d["max"])
+    return ColumnStats(**d)
+
+  def __str__(self):
+    return "%s:%s nulls=%d min=%s max=%s ndv=%d" % (
+        self.name, self.type, self.nulls, self.min, self.max, self.ndv)
+
+
+class TableStats(object):
+  def __init__(self, rows, columns):
+    """
+    @columns dict of column name -> ColumnStats
+    """
+    self.rows = rows
+    self.columns = columns
+
+  def to_dict(self):
+    return dict(rows=self.rows,
+        columns=dict((name, c.to_dict()) for name, c in self.columns.items()))
+
+  @staticmethod
+  def from_dict(d):
+    columns = dict((catalog.encode(name), ColumnStats.from_dict(c))
+        for name, c in d["columns"].items())
+    return TableStats(d["rows"], columns)
+
+  def __str__(self):
+    return "\n".join(["rows=%d" % self.rows] + map(str, self.columns.values()))
+
+
+class ColumnCollector(object):
+  """
+  Accumulates the statistics of one column over chunks of raw csv cells
+  """
+  def __init__(self, name, type):
+    self.name = name
+    self.type = type
+    self.nulls = 0
+    self.min = self.max = None
+    self.sketch = []
+    self.sketched = set()
+    self.sample = []
+    self.stride = 1
+    self.pos = 0
+
+  def add(self, cells):
+    vals = [v for v in cells if v != ""]
+    self.nulls += len(cells) - len(vals)
+    if not vals:
+      return
+    if self.type == "num":
+      vals = np.array(vals, dtype=np.float64)
+      # every stride-th non null value; the stride doubles whenever the
+      # sample grows over twice its size
+      start = (-self.pos) % self.stride
+      self.sample.extend(vals[start::self.stride].tolist())
+      self.pos += len(vals)
+      while len(self.sample) > 2 * SAMPLE_SIZE:
+        self.sample = self.sample[::2]
+        self.stride *= 2
+      lo, hi = float(vals.min()), float(vals.max())
+    else:
+      lo, hi = min(vals), max(vals)
+    if self.min is None or lo < self.min:
+      self.min = lo
+    if self.max is None or hi > self.max:
+      self.max = hi
+    self.add_sketch(cells)
+
+  def add_sketch(self, cells):
+    """
+    keep the SKETCH_SIZE smallest hashes of the distinct values
+    """
+    sketch, sketched = self.sketch, self.sketched
+    limit = len(sketch) >= SKETCH_SIZE and -sketch[0] or MASK64 + 1
+    for v in set(cells):
+      if v == "":
+        continue
+      h = (hash(v) * MIX) & MASK64
+      if h >= limit or h in sketched:
+        continue
+      heapq.heappush(sketch, -h)
+      sketched.add(h)
+      if len(sketch) > SKETCH_SIZE:
+        sketched.discard(-heapq.heappop(sketch))
+        limit = -sketch[0]
+
+  def ndv(self):
+    if len(self.sketch) < SKETCH_SIZE:
+      return len(self.sketch)
+    kth = -self.sketch[0]
+    return int((SKETCH_SIZE - 1) * float(MASK64) / max(kth, 1))
+
+  def stats(self, rows):
+    hist = None
+    if self.type == "num" and self.sample:
+      sample = np.sort(np.array(self.sample))
+      idx = np.linspace(0, len(sample) - 1, HIST_BUCKETS + 1).astype(int)
+      hist = sample[idx].tolist()
+      hist[0], hist[-1] = self.min, self.max
+    return ColumnStats(self.name, self.type, self.nulls, self.min, self.max,
+        self.ndv(), hist, rows)
+
+
+class StatsCollector(object):
+  """
+  Statistics of the columns of a file as it is read chunk by chunk.
+  Only a file read to the end yields statistics (see finish)
+  """
+  def __init__(self, filename, fields, types):
+    self.path = table_path(filename)
+    self.stamp = file_stamp(self.path)
+    self.rows = 0
+    self.columns = [ColumnCollector(f, t) for f, t in zip(fields, types)]
+
+  def add(self, lines):
+    """
+    @lines list of rows of raw csv cells, in fields order
+    """
+    if lines:
+      self.add_columns(zip(*lines))
+
+  def add_columns(self, cols):
+    """
+    @cols columns of the same length, in fields order
+    """
+    if not cols:
+      return
+    self.rows += len(cols[0])
+    for col, cells in zip(self.columns, cols):
+      col.add(cells)
+
+  def finish(self):
+    """
+    Store the statistics, unless the file changed while it was read
+    """
+    if file_stamp(self.path) != self.stamp:
+      return None
+    columns = dict((c.name, c.stats(self.rows)) for c in self.columns)
+    return store(self.path, self.stamp, TableStats(self.rows, columns))
+
+
+# path -> (file stamp, TableStats)
+collected = {}
+
+
+def store(path, stamp, stats):
+  """
+  Merge stats into the statistics kept for the file
+  """
+  if path in collected and collected[path][0] == stamp:
+    collected[path][1].columns.update(stats.columns)
+  else:
+    collected[path] = (stamp, stats)
+  stats = collected[path][1]
+  catalog.set_stats(path, stats.to_dict())
+  return stats
+
+def table_stats(filename):
+  """
+  @return TableStats of the file's current version, or None
+  """
+  path = table_path(filename)
+  try:
+    stamp = file_stamp(path)
+  except OSError:
+    collected.pop(path, None)
+    return None
+  if path in collected and collected[path][0] != stamp:
+    del collected[path]
+  if path not in collected:
+    saved = catalog.stats(path)
+    if not saved:
+      return None
+    collected[path] = (stamp, TableStats.from_dict(saved))
+  return collected[path][1]
+
+def needs_stats(filename, fields):
+  """
+  whether reading fields of the file would collect missing statistics
+  """
+  stats = table_stats(filename)
+  return stats is None or not all(f in stats.columns for f in fields)
+
+def collector(filename, fields, types, force=False):
+  """
+  StatsCollector for a scan of fields, or None if their statistics are
+  already known or neither auto nor force is set
+  """
+  if not (auto or force):
+    return None
+  try:
+    if needs_stats(filename, fields):
+      return StatsCollector(filename, fields, types)
+  except OSError:
+    pass
+  return None
+
+def analyze(filename):
+  """
+  Read the whole file to collect the statistics of all its columns
+
+  @return TableStats
+  """
+  from ops import Scan
+  drop_stats(filename)
+  scan = Scan(filename)
+  scan.collect_stats = True
+  # statistics are collected from the csv cells, not from cached columns
+  scan.cache = False
+  for rows in scan.chunks():
+    pass
+  return table_stats(filename)
+
+def drop_stats(filename):
+  collected.pop(table_path(filename), None)
+  if catalog.stats(filename):
+    catalog.set_stats(filename, None)
+
+
+if __name__ == "__main__":
+  import sys
+  sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+  if len(sys.argv) < 2:
+    print "usage: python stats.py table ..."
+    sys.exit(1)
+  for filename in sys.argv[1:]:
+    print table_path(filename)
+    print analyze(filename)
+  catalog.save()
@@ -0,0 +1,145 @@
+import numpy as np
+
+
+class Table(object):
+  """
+  Columnar table.
+
+  Every column is one numpy array:
+    num columns are float64 arrays
+    all other columns are dictionary encoded: an int32 array of codes
+    into a sorted object array of the distinct strings
+
+  Tables are built from chunks of raw csv rows (see Scan.table) and can
+  be sliced into batches without copying.
+  """
+  def __init__(self, fields, types, columns, dictionaries=None):
+    """
+    @fields       column names
+    @types        column types ("num" or anything else for strings)
+    @columns      dict of column name -> numpy array
+    @dictionaries dict of column name -> array of distinct strings for
+                  dictionary encoded columns
+    """
+    self.fields = tuple(fields)
+    self.types = tuple(types)
+    self.columns = columns
+    self.dictionaries = dictionaries or {}
+    self.nrows = len(columns[fields[0]]) if fields else 0
+
+  @staticmethod
+  def from_strings(fields, types, cols):
+    """
+    @cols list of columns, each a sequence of the csv cells as strings
+    """
+    columns = {}
+    dictionaries = {}
+    for field, t, col in zip(fields, types, cols):
+      if t == "num":
+        columns[field] = np.array(col, dtype=np.float64)
+      else:
+        uniq, codes = np.unique(np.array(col, dtype=object), return_inverse=True)
+        dictionaries[field] = uniq
+        columns[field] = codes.astype(np.int32)
+    return Table(fields, types, columns, dictionaries)
+
+  @staticmethod
+  def from_arrays(fields, arrays):
+    """
+    Table over already computed (decoded) arrays
+    """
+    types = ["num" if arr.dtype.kind in "fiub" else "str" for arr in arrays]
+    return Table(fields, types, dict(zip(fields, arrays)))
+
+  @staticmethod
+  def from_rows(rows):
+    """
+    Table over a list of row dicts, e.g. the output of run_op
+    """
+    if not rows:
+      return Table((), (), {})
+    fields = rows[0].keys()
+    arrays = []
+    for field in fields:
+      vals = [row[field] for row in rows]
+      if all(isinstance(v, float) for v in vals):
+        arrays.append(np.array(vals, dtype=np.float64))
+      else:
+        arr = np.empty(len(vals), dtype=object)
+        arr[:] = vals
+        arrays.append(arr)
+    return Table.from_arrays(fields, arrays)
+
+  @staticmethod
+  def empty(fields, types):
+    return Table.from_strings(fields, types, [[] for f in fields])
+
+  @staticmethod
+  def concat(tables):
+    """
+    Concatenate tables with the same schema, merging string dictionaries
+    """
+    if len(tables) == 1:
+      return tables[0]
+    fields, types = tables[0].fields, tables[0].types
+    columns = {}
+    dictionaries = {}
+    for field, t in zip(fields, types):
+      if field not in tables[0].dictionaries:
+        columns[field] = np.concatenate([tb.columns[field] for tb in tables])
+        continue
+      uniq = np.unique(np.concatenate([tb.dictionaries[field] for tb in tables]))
+      codes = []
+      for tb in tables:
+        remap = np.searchsorted(uniq, tb.dictionaries[field]).astype(np.int32)
+        codes.append(remap[tb.columns[field]])
+      dictionaries[field] = uniq
+      columns[field] = np.concatenate(codes)
+    return Table(fields, types, columns, dictionaries)
+
+  def __len__(self):
+    return self.nrows
+
+  def column(self, field):
+    """
+    Decoded values of a column: float64 for num columns, an object
+    array of strings otherwise
+    """
+    col = self.columns[field]
+    if field in self.dictionaries:
+      return self.dictionaries[field][col]
+    return col
+
+  def slice(self, start, stop):
+    columns = dict([(f, col[start:stop]) for f, col in self.columns.iteritems()])
+    return Table(self.fields, self.types, columns, self.dictionaries)
+
+  def take(self, idx):
+    """
+    Rows selected by a boolean mask or an array of row indices
+    """
+    columns = dict([(f, col[idx]) for f, col in self.columns.iteritems()])
+    return Table(self.fields, self.types, columns, self.dictionaries)
+
+  def batches(self, size):
+    for start in xrange(0, self.nrows, size):
+      yield self.slice(start, start + size)
+
+  def __iter__(self):
+    """
+    Rows as dicts, the same shape Scan produces when run by run_op
+    """
+    cols = [self.column(f).tolist() for f in self.fields]
+    for vals in zip(*cols):
+      yield dict(zip(self.fields, vals))
+
+  @property
+  def nbytes(self):
+    n = sum(col.nbytes for col in self.columns.values())
+    for uniq in self.dictionaries.values():
+      n += uniq.nbytes + sum(len(s) for s in uniq)
+    return n
+
+  def __str__(self):
+    schema = ", ".join(["%s:%s" % ft for ft in zip(self.fields, self.types)])
+    return "Table(%s) %d rows" % (schema, self.nrows)
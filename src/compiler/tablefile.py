@@ -0,0 +1,232 @@
+"""
+Native table file format (.tbl), read by Scan without parsing.
+
+    python tablefile.py data.csv data.tbl      convert a csv file
+    Scan("data.tbl")
+
+Layout:
+
+    "TBLFILE1"                  magic
+    header length               little endian uint64
+    header                      json: nrows and per column its name,
+                                type and where its data starts
+    column data                 from the first multiple of ALIGN after
+                                the header, each column region aligned
+                                to ALIGN
+
+num columns are nrows contiguous little endian float64.  Other columns
+are nrows + 1 int64 offsets followed by a heap of the strings' bytes:
+row i is heap[offsets[i]:offsets[i+1]].
+
+The file is memory mapped and columns are numpy views of the mapping,
+so opening a table only reads its header, a scan only touches the
+pages of the columns it reads, and processes share the page cache.
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+import shutil
+import tempfile
+import numpy as np
+from table import Table
+
+SUFFIX = ".tbl"
+MAGIC = "TBLFILE1"
+ALIGN = 4096
+
+
+def is_tablefile(filename):
+  return filename.endswith(SUFFIX)
+
+def aligned(n):
+  return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+class TableFile(object):
+  def __init__(self, filename):
+    with open(filename, "rb") as f:
+      if f.read(len(MAGIC)) != MAGIC:
+        raise Exception("%s is not a table file" % filename)
+      hlen, = struct.unpack("<Q", f.read(8))
+      header = json.loads(f.read(hlen))
+      self.mm = None
+      if os.fstat(f.fileno()).st_size:
+        self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    self.filename = filename
+    self.base = aligned(len(MAGIC) + 8 + hlen)
+    self.nrows = header["nrows"]
+    self.columns = dict((str(c["name"]), c) for c in header["columns"])
+    self.fields = tuple(str(c["name"]) for c in header["columns"])
+    self.types = tuple(str(c["type"]) for c in header["columns"])
+
+  def schema(self):
+    return self.fields, self.types
+
+  def array(self, offset, dtype, n):
+    if not n:
+      return np.empty(0, dtype=dtype)
+    return np.ndarray((n,), dtype=dtype, buffer=self.mm, offset=self.base + offset)
+
+  def values(self, field):
+    """
+    float64 view of a num column
+    """
+    return self.array(self.columns[field]["data"], "<f8", self.nrows)
+
+  def strings(self, field, lo, hi):
+    """
+    object array of the strings of rows lo to hi of a string column
+    """
+    col = self.columns[field]
+    hi = min(hi, self.nrows)
+    offsets = self.array(col["offsets"], "<i8", self.nrows + 1)[lo:hi+1].tolist()
+    ret = np.empty(max(0, hi - lo), dtype=object)
+    if hi <= lo:
+      return ret
+    start = self.base + col["heap"]
+    heap = self.mm[start + offsets[0]:start + offsets[-1]]
+    first = offsets[0]
+    ret[:] = [heap[a - first:b - first] for a, b in zip(offsets, offsets[1:])]
+    return ret
+
+  def column(self, field, lo, hi):
+    if self.columns[field]["type"] == "num":
+      return self.values(field)[lo:hi]
+    return self.strings(field, lo, hi)
+
+  def table(self, fields, lo, hi):
+    """
+    Table of rows lo to hi.  num columns are views of the file, string
+    columns are decoded object arrays.
+    """
+    types = [self.columns[f]["type"] for f in fields]
+    columns = dict((f, self.column(f, lo, hi)) for f in fields)
+    return Table(fields, types, columns)
+
+  def tables(self, fields, size):
+    """
+    Generate Tables of the fields, size rows at a time
+    """
+    for lo in xrange(0, self.nrows, size):
+      yield self.table(fields, lo, lo + size)
+
+  def rows_at(self, fields, positions):
+    """
+    rows (dicts of the fields) at the given row numbers, in that order
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    cols = []
+    for field in fields:
+      col = self.columns[field]
+      if col["type"] == "num":
+        cols.append(self.values(field)[positions].tolist())
+        continue
+      offsets = self.array(col["offsets"], "<i8", self.nrows + 1)
+      starts = (self.base + col["heap"] + offsets[positions]).tolist()
+      ends = (self.base + col["heap"] + offsets[positions + 1]).tolist()
+      cols.append([self.mm[a:b] for a, b in zip(starts, ends)])
+    return [dict(zip(fields, vals)) for vals in zip(*cols)]
+
+
+class TableWriter(object):
+  """
+  Writes a table file from chunks of columns.  Columns are spooled to
+  temporary files until close() knows where each one starts.
+  """
+  def __init__(self, filename, fields, types):
+    self.filename = filename
+    self.fields = list(fields)
+    self.types = ["num" if t == "num" else "str" for t in types]
+    self.nrows = 0
+    self.tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(filename)))
+    self.data = []
+    self.heaps = []
+    self.heapsize = [0] * len(self.fields)
+    for i in xrange(len(self.fields)):
+      self.data.append(open(os.path.join(self.tmpdir, "%d.data" % i), "wb"))
+      self.heaps.append(open(os.path.join(self.tmpdir, "%d.heap" % i), "wb"))
+    for i, t in enumerate(self.types):
+      if t != "num":
+        np.zeros(1, dtype="<i8").tofile(self.data[i])
+
+  def add(self, cols):
+    """
+    @cols list of columns, in fields order, of the same length: arrays
+          or lists of floats for num columns, strings otherwise
+    """
+    if not cols:
+      return
+    self.nrows += len(cols[0])
+    for i, (t, col) in enumerate(zip(self.types, cols)):
+      if t == "num":
+        np.asarray(col, dtype="<f8").tofile(self.data[i])
+        continue
+      col = map(str, col)
+      ends = self.heapsize[i] + np.cumsum([len(v) for v in col], dtype=np.int64)
+      ends.astype("<i8").tofile(self.data[i])
+      if len(ends):
+        self.heapsize[i] = int(ends[-1])
+      self.heaps[i].write("".join(col))
+
+  def close(self):
+    for f in self.data + self.heaps:
+      f.close()
+    columns = []
+    offset = 0
+    parts = []
+    for i, (field, t) in enumerate(zip(self.fields, self.types)):
+      data = os.path.join(self.tmpdir, "%d.data" % i)
+      col = dict(name=field, type=t)
+      if t == "num":
+        col["data"] = offset
+      else:
+        col["offsets"] = offset
+      parts.append((offset, data))
+      offset = aligned(offset + os.path.getsize(data))
+      if t != "num":
+        heap = os.path.join(self.tmpdir, "%d.heap" % i)
+        col["heap"] = offset
+        parts.append((offset, heap))
+        offset = aligned(offset + os.path.getsize(heap))
+      columns.append(col)
+
+    header = json.dumps(dict(nrows=self.nrows, columns=columns))
+    base = aligned(len(MAGIC) + 8 + len(header))
+    tmp = os.path.join(self.tmpdir, "table")
+    with open(tmp, "wb") as out:
+      out.write(MAGIC)
+      out.write(struct.pack("<Q", len(header)))
+      out.write(header)
+      for offset, part in parts:
+        out.seek(base + offset)
+        with open(part, "rb") as f:
+          shutil.copyfileobj(f, out, 1 << 20)
+      out.truncate(max(out.tell(), base))
+    os.rename(tmp, self.filename)
+    shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def convert(src, dst=None):
+  """
+  Write the table of a Scan'able file (e.g. a csv) as a table file
+
+  @return name of the table file
+  """
+  from ops import Scan
+  scan = Scan(src)
+  dst = dst or os.path.splitext(scan.filename)[0] + SUFFIX
+  writer = TableWriter(dst, scan.fields, scan.types)
+  for table in scan.tables():
+    writer.add([table.column(f) for f in scan.fields])
+  writer.close()
+  return dst
+
+
+if __name__ == "__main__":
+  sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+  if len(sys.argv) not in (2, 3):
+    print "usage: python tablefile.py <table.csv> [<table.tbl>]"
+    sys.exit(1)
+  print convert(*sys.argv[1:])
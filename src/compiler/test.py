@@ -1,4 +1,8 @@
+import os
+import sys
 from collections import *
+# ../common holds the csv reader the engines share
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
 try:
   import instabase.notebook.ipython.utils as ib
   ib.import_pyfile('./interpretor.py', 'interpretor')
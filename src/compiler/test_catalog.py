@@ -0,0 +1,117 @@
+"""
+Table catalog (catalog.py): entries saved to and loaded from its file,
+and entries of files that changed
+"""
+import os
+import json
+import unittest
+from testutil import TableTestCase
+import catalog
+import stats
+from ops import Scan
+from parser import parse
+from optimizer import optimize
+from interpretor import execute
+
+
+class CatalogTest(TableTestCase):
+  def setUp(self):
+    super(CatalogTest, self).setUp()
+    catalog.path = os.path.join(self.dir, "catalog.json")
+
+  def reload(self):
+    """
+    forget the entries in memory, as a new process would
+    """
+    catalog.entries = None
+    catalog.dirty.clear()
+
+  def ondisk(self):
+    with open(catalog.path) as f:
+      return json.load(f)
+
+  def test_round_trip(self):
+    scan = Scan("facts")
+    list(scan)
+    catalog.set_artifact("facts", "thing", "value")
+    catalog.save()
+    self.reload()
+    dialect, fields, types = catalog.lookup("facts")
+    self.assertEqual((tuple(fields), tuple(types)), (scan.fields, scan.types))
+    self.assertTrue(all(isinstance(v, str) for v in fields + types))
+    self.assertEqual(dialect["delimiter"], ",")
+    self.assertEqual(catalog.artifact("facts", "thing"), "value")
+    self.assertEqual(list(Scan("facts")), list(scan))
+
+  def test_batched(self):
+    catalog.set_artifact("facts", "a", 1)
+    catalog.set_artifact("facts", "b", 2)
+    catalog.set_artifact("dim", "a", 3)
+    self.assertFalse(os.path.exists(catalog.path))
+    catalog.save()
+    self.assertEqual(sorted(self.ondisk()), sorted(map(catalog.table_path, ["dim", "facts"])))
+    self.assertFalse(catalog.dirty)
+
+  def test_saved_by_execute(self):
+    execute(optimize(parse("SELECT e_id FROM dim2")), lambda t: t)
+    self.assertFalse(catalog.dirty)
+    self.assertTrue(catalog.table_path("dim2") in self.ondisk())
+
+  def test_keeps_other_writers(self):
+    catalog.set_artifact("facts", "a", 1)
+    catalog.save()
+    # another process saves its entry of dim meanwhile
+    catalog.entries = None
+    catalog.set_artifact("dim", "b", 2)
+    catalog.save()
+    self.reload()
+    catalog.set_artifact("dim2", "c", 3)
+    catalog.save()
+    self.assertEqual(len(self.ondisk()), 3)
+    catalog.drop("facts")
+    catalog.save()
+    self.assertFalse(catalog.table_path("facts") in self.ondisk())
+
+  def test_stale_entry(self):
+    list(Scan("facts"))
+    stats.analyze("facts")
+    catalog.set_artifact("facts", "thing", "value")
+    catalog.set_indexes("facts", "k1", ["hash"])
+    catalog.save()
+    with open(self.paths["facts"], "a") as f:
+      f.write("100000,1,3,g1,1.5,0.5\n")
+    self.reload()
+    self.assertEqual(catalog.lookup("facts"), None)
+    self.assertEqual(catalog.stats("facts"), None)
+    self.assertEqual(catalog.artifact("facts", "thing"), None)
+    # declarations outlive the version of the file
+    self.assertEqual(catalog.indexes(), [(catalog.table_path("facts"), "k1", ["hash"])])
+    self.assertEqual(len(list(Scan("facts"))), 601)
+    catalog.save()
+    self.reload()
+    self.assertNotEqual(catalog.lookup("facts"), None)
+
+  def test_missing_file(self):
+    catalog.set_artifact("facts", "a", 1)
+    os.remove(self.paths["facts"])
+    self.assertEqual(catalog.entry("facts"), None)
+    self.assertEqual(catalog.lookup("facts"), None)
+
+  def test_corrupt_file(self):
+    with open(catalog.path, "w") as f:
+      f.write("{not json")
+    self.assertEqual(catalog.lookup("facts"), None)
+    list(Scan("facts"))
+    catalog.save()
+    self.assertTrue(catalog.table_path("facts") in self.ondisk())
+
+  def test_in_memory(self):
+    catalog.path = ""
+    list(Scan("facts"))
+    catalog.save()
+    self.assertNotEqual(catalog.lookup("facts"), None)
+    self.assertFalse(os.path.exists(os.path.join(self.dir, "catalog.json")))
+
+
+if __name__ == "__main__":
+  unittest.main()
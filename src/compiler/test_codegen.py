@@ -0,0 +1,73 @@
+"""
+Whole-plan code generation (codegen.py): the plan cache, GroupBy
+aggregates and join schemas
+"""
+import unittest
+from testutil import TableTestCase, canonical
+import codegen
+import index
+from ops import Func
+from parser import parse
+from optimizer import optimize
+from interpretor import execute
+
+
+def run(q, mode):
+  out = []
+  execute(optimize(parse(q)), out.append, mode)
+  return canonical(out)
+
+
+class CodeGenTest(TableTestCase):
+  def setUp(self):
+    super(CodeGenTest, self).setUp()
+    self.cache_size = codegen.CACHE_SIZE
+    codegen._cache.clear()
+
+  def tearDown(self):
+    codegen.CACHE_SIZE = self.cache_size
+    codegen._cache.clear()
+    super(CodeGenTest, self).tearDown()
+
+  def test_cache_bounded(self):
+    codegen.CACHE_SIZE = 3
+    queries = ["SELECT id FROM facts WHERE v1 < %d" % i for i in xrange(5)]
+    for q in queries:
+      codegen.compile_plan(optimize(parse(q)))
+    self.assertEqual(len(codegen._cache), 3)
+    # a cache hit makes a plan the most recently used
+    key = codegen.fingerprint(optimize(parse(queries[2])))
+    codegen.compile_plan(optimize(parse(queries[2])))
+    codegen.compile_plan(optimize(parse(queries[0])))
+    self.assertTrue(key in codegen._cache)
+    self.assertEqual(len(codegen._cache), 3)
+
+  def test_incremental_group_by(self):
+    q = "SELECT grp, count(v1) AS n, sum(v2) AS s, avg(v1) AS a FROM facts GROUP BY grp"
+    src = codegen.plan_source(optimize(parse(q)))
+    self.assertTrue("__aggs__" in src)
+    self.assertFalse(".append(" in src)
+    self.assertEqual(run(q, "compiled"), run(q, "row"))
+
+  def test_buffered_group_by(self):
+    # an aggregate without an incremental state needs the group's tuples
+    states = Func.agg_state_lookup
+    Func.agg_state_lookup = dict(states)
+    del Func.agg_state_lookup["sum"]
+    self.addCleanup(setattr, Func, "agg_state_lookup", states)
+    q = "SELECT grp, count(v1) AS n, sum(v2) AS s FROM facts GROUP BY grp"
+    src = codegen.plan_source(optimize(parse(q)))
+    self.assertTrue("['__group__'] = " in src)
+    self.assertEqual(run(q, "compiled"), run(q, "row"))
+
+  def test_index_join_schema(self):
+    index.create_index("dim", "d_id")
+    plan = optimize(parse("SELECT id, d_cat FROM facts, dim WHERE k1 = d_id AND v2 < 0.2"))
+    join = plan.collectone("IndexJoin")
+    self.assertEqual(codegen.schema(join),
+        codegen.schema(join.l) + codegen.schema(join.r))
+    self.assertTrue("d_cat" in codegen.schema(join))
+
+
+if __name__ == "__main__":
+  unittest.main()
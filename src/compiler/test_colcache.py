@@ -0,0 +1,89 @@
+"""
+Binary column cache (colcache.py), including concurrent scans of the
+same file
+"""
+import os
+import unittest
+from testutil import MODES, TableTestCase, canonical
+import colcache
+from ops import Scan
+from parser import parse
+from optimizer import optimize
+from interpretor import execute
+
+
+class ColCacheTest(TableTestCase):
+  def setUp(self):
+    super(ColCacheTest, self).setUp()
+    colcache.root = os.path.join(self.dir, "cache")
+    colcache.writing.clear()
+    Scan.cache = False
+    self.expected = list(Scan("facts"))
+    Scan.cache = True
+
+  def tearDown(self):
+    Scan.cache = True
+    super(ColCacheTest, self).tearDown()
+
+  def cache_files(self):
+    ret = []
+    for d, _, names in os.walk(colcache.root):
+      ret.extend(names)
+    return ret
+
+  def test_cached_scan(self):
+    self.assertEqual(list(Scan("facts")), self.expected)
+    fields = Scan("facts").fields
+    self.assertNotEqual(colcache.lookup("facts", fields), None)
+    self.assertEqual(list(Scan("facts")), self.expected)
+    self.assertEqual(canonical(Scan("facts").table()), canonical(self.expected))
+
+  def test_interleaved_scans(self):
+    a = Scan("facts", chunk_size=70).chunks()
+    b = Scan("facts", chunk_size=30).chunks()
+    rows_a, rows_b = [], []
+    for chunk_a, chunk_b in map(None, a, b):
+      rows_a.extend(chunk_a or [])
+      rows_b.extend(chunk_b or [])
+    self.assertEqual(rows_a, self.expected)
+    self.assertEqual(rows_b, self.expected)
+    self.assertFalse(colcache.writing)
+    self.assertFalse([n for n in self.cache_files() if n.endswith(".tmp")])
+    self.assertEqual(list(Scan("facts")), self.expected)
+
+  def test_self_join(self):
+    q = "SELECT a.id, b.id FROM facts AS a, facts AS b WHERE a.id = b.k2 AND a.v1 < 30"
+    def run(mode):
+      out = []
+      execute(optimize(parse(q)), out.append, mode)
+      return canonical(out)
+    colcache.root = ""
+    expected = run("row")
+    self.assertTrue(expected)
+    colcache.root = os.path.join(self.dir, "cache")
+    for mode in MODES:
+      self.assertEqual(run(mode), expected, mode)
+      self.assertEqual(run(mode), expected, mode)
+
+  def test_failed_finish(self):
+    rename = os.rename
+    def failing_rename(src, dst):
+      raise OSError("rename failed")
+    os.rename = failing_rename
+    try:
+      rows = list(Scan("facts"))
+    finally:
+      os.rename = rename
+    self.assertEqual(rows, self.expected)
+    self.assertEqual(colcache.lookup("facts", Scan("facts").fields), None)
+    self.assertFalse(colcache.writing)
+    self.assertFalse([n for n in self.cache_files() if n.endswith(".tmp")])
+
+  def test_disabled(self):
+    colcache.root = ""
+    self.assertEqual(list(Scan("facts")), self.expected)
+    self.assertFalse(os.path.exists(os.path.join(self.dir, "cache")))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,87 @@
+"""
+EXPLAIN ANALYZE (explain.py): the report's row counts are the rows the
+operators produce, and its JSON output parses
+"""
+import json
+import unittest
+from testutil import TableTestCase
+import interpretor
+from explain import explain_analyze, plan_children
+from parser import parse
+from optimizer import optimize
+from interpretor import run_op
+
+QUERIES = [
+  "SELECT id, v1 FROM facts WHERE v1 < 100",
+  "SELECT id, d_cat, e_name FROM facts, dim, dim2 WHERE k1 = d_id AND d_e = e_id AND v1 < 50",
+  "SELECT grp, count(v1) AS n, sum(v2) AS s FROM facts GROUP BY grp",
+  "SELECT id, v1 FROM facts ORDER BY v1 DESC LIMIT 7",
+]
+
+
+def rows_of(op):
+  out = []
+  run_op(op, out.append)
+  return len(out)
+
+def nodes(op, node):
+  """
+  (operator, report node) pairs of the plan, in the same order
+  """
+  pairs = [(op, node)]
+  for c, n in zip(plan_children(op), node["children"]):
+    pairs.extend(nodes(c, n))
+  return pairs
+
+
+class ExplainTest(TableTestCase):
+  def check(self, plan):
+    out = []
+    report = explain_analyze(plan, out.append)
+    self.assertEqual(interpretor.tracer, None)
+    root = report.to_json()["plan"]
+    self.assertEqual(root["rows_out"], len(out))
+    for op, node in nodes(plan, root):
+      self.assertEqual(node["op"], op.__class__.__name__)
+      self.assertTrue(node["loops"] >= 1, node["label"])
+      # every execution of the subtree produces the same rows
+      self.assertEqual(node["rows_out"], node["loops"] * rows_of(op), node["label"])
+      self.assertEqual(node["rows_in"], sum(c["rows_out"] for c in node["children"]))
+      self.assertTrue(0 <= node["self"] <= node["time"] + 1e-9)
+    return report
+
+  def test_row_counts(self):
+    for q in QUERIES:
+      self.check(optimize(parse(q)))
+
+  def test_loops(self):
+    # a block nested loop join runs its inner input once per block
+    plan = optimize(parse("SELECT id, d_id FROM facts, dim WHERE k1 < d_id AND v1 < 30"))
+    join = plan.collectone("Join")
+    join.block_size = 5
+    report = self.check(plan)
+    inner = [n for op, n in nodes(plan, report.to_json()["plan"]) if op is join.r][0]
+    blocks = (rows_of(join.l) + 4) // 5
+    self.assertTrue(blocks > 1)
+    self.assertEqual(inner["loops"], blocks)
+
+  def test_json(self):
+    report = explain_analyze("EXPLAIN ANALYZE " + QUERIES[1])
+    doc = json.loads(report.json(indent=2))
+    self.assertEqual(doc, json.loads(json.dumps(report.to_json())))
+    self.assertTrue(doc["total_time"] >= doc["plan"]["time"] >= 0)
+    labels = []
+    def visit(node):
+      self.assertEqual(sorted(node), ["children", "label", "loops", "op",
+          "rows_in", "rows_out", "self", "time"])
+      labels.append(node["label"])
+      map(visit, node["children"])
+    visit(doc["plan"])
+    text = report.text().split("\n")
+    self.assertEqual(len(text), len(labels) + 1)
+    for line, lbl in zip(text, labels):
+      self.assertTrue(lbl in line, (lbl, line))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,161 @@
+"""
+External merge sort (extsort.py) and OrderBy plans that spill runs
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from testutil import MODES, TableTestCase
+import extsort
+from extsort import ExternalSorter, TopNHeap, sort_key
+from parser import parse
+from optimizer import optimize
+from interpretor import execute
+
+
+def tuples(n, seed=0):
+  rand = random.Random(seed)
+  return [dict(i=i, a=rand.randrange(10), b=rand.choice("xyz"), c=rand.random(),
+      s=rand.choice(["", "\0", "a", "a\0", "a\0b", "ab", "b\xff", "b"]),
+      u=rand.choice([None, u"x", u"y"]))
+      for i in xrange(n)]
+
+def reference(tups, keys, descending):
+  """
+  tups sorted by stable sorts from the last key to the first
+  """
+  tups = list(tups)
+  for key, desc in reversed(zip(keys, descending)):
+    tups.sort(key=lambda t: t[key], reverse=desc)
+  return tups
+
+
+class ExternalSorterTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+  def sorter(self, keys, descending, buffer_rows):
+    funcs = [lambda t, k=k: t[k] for k in keys]
+    return ExternalSorter(funcs, descending, buffer_rows, self.tmpdir)
+
+  def check(self, keys, descending, n=500, buffer_rows=37):
+    tups = tuples(n)
+    sorter = self.sorter(keys, descending, buffer_rows)
+    for tup in tups:
+      sorter.add(tup)
+    # the last buffer is merged without being spilled
+    self.assertEqual(len(sorter.runs), max(n - 1, 0) // buffer_rows)
+    self.assertEqual(list(sorter), reference(tups, keys, descending))
+    self.assertEqual(os.listdir(self.tmpdir), [])
+
+  def test_spills(self):
+    self.check(["c"], [False])
+    self.check(["c"], [True])
+
+  def test_mixed_directions(self):
+    self.check(["a", "b", "c"], [False, True, False])
+    self.check(["b", "a"], [True, False])
+
+  def test_stable(self):
+    # ties on the keys keep their input order across runs
+    self.check(["a"], [False])
+    self.check(["a", "b"], [True, True])
+
+  def test_in_memory(self):
+    self.check(["a", "c"], [False, True], n=30, buffer_rows=100)
+
+  def test_empty(self):
+    self.check(["a"], [False], n=0)
+
+  def test_full_buffer(self):
+    self.check(["c"], [False], n=100, buffer_rows=100)
+    self.check(["c"], [False], n=101, buffer_rows=100)
+
+  def test_byte_budget(self):
+    tups = tuples(2000)
+    saved = extsort.SORT_BUFFER_BYTES
+    try:
+      sorter = self.sorter(["c"], [False], None)
+      for tup in tups:
+        sorter.add(tup)
+      self.assertEqual(sorter.runs, [])
+      extsort.SORT_BUFFER_BYTES = extsort.tuple_bytes(tups[0]) * 300
+      sorter = self.sorter(["c"], [False], None)
+      for tup in tups:
+        sorter.add(tup)
+      self.assertTrue(250 <= sorter.buffer_rows <= 350, sorter.buffer_rows)
+      self.assertTrue(len(sorter.runs) >= 5)
+      self.assertEqual(list(sorter), reference(tups, ["c"], [False]))
+    finally:
+      extsort.SORT_BUFFER_BYTES = saved
+
+  def test_early_close(self):
+    sorter = self.sorter(["c"], [False], 10)
+    for tup in tuples(100):
+      sorter.add(tup)
+    it = iter(sorter)
+    first = [it.next() for i in xrange(5)]
+    self.assertEqual(first, reference(tuples(100), ["c"], [False])[:5])
+    self.assertTrue(os.listdir(self.tmpdir))
+    it.close()
+    self.assertEqual(os.listdir(self.tmpdir), [])
+
+  def test_topn_heap(self):
+    tups = tuples(300)
+    for limit, offset in [(10, 0), (7, 5), (0, 0), (400, 3)]:
+      heap = TopNHeap([lambda t: t["a"], lambda t: t["c"]], [True, False], limit, offset)
+      for tup in tups:
+        heap.add(tup)
+      expected = reference(tups, ["a", "c"], [True, False])[offset:offset + limit]
+      self.assertEqual(list(heap), expected)
+
+  def test_topn_directions(self):
+    tups = tuples(1000)
+    for keys, descending in [(["a"], [True]), (["s", "i"], [True, False]),
+        (["b", "a"], [False, True]), (["s", "a"], [True, True]), (["u", "c"], [True, False])]:
+      heap = TopNHeap([lambda t, k=k: t[k] for k in keys], descending, 20, 3)
+      for tup in tups:
+        heap.add(tup)
+      self.assertEqual(list(heap), reference(tups, keys, descending)[3:23], keys)
+
+  def test_sort_keys(self):
+    tups = tuples(300)
+    for keys, descending in [(["s"], [True]), (["a", "s", "c"], [False, True, True]),
+        (["u"], [True]), ([], [])]:
+      key = sort_key([lambda t, k=k: t[k] for k in keys], descending)
+      self.assertEqual(sorted(tups, key=key), reference(tups, keys, descending), keys)
+
+
+class OrderByTest(TableTestCase):
+  def setUp(self):
+    super(OrderByTest, self).setUp()
+    self.spills = []
+    spill = ExternalSorter.spill
+    def counted_spill(sorter):
+      self.spills.append(sorter)
+      return spill(sorter)
+    ExternalSorter.spill = counted_spill
+    self.addCleanup(setattr, ExternalSorter, "spill", spill)
+
+  def test_spilling_plans(self):
+    q = "SELECT id, k2, v1 FROM facts ORDER BY k2 DESC, v1"
+    expected = []
+    execute(optimize(parse(q)), expected.append)
+    self.assertEqual(expected, reference(expected, ["k2", "v1"], [True, False]))
+    self.assertEqual(self.spills, [])
+    for mode in MODES:
+      plan = optimize(parse(q))
+      plan.collectone("OrderBy").buffer_rows = 50
+      out = []
+      execute(plan, out.append, mode)
+      self.assertEqual(out, expected, mode)
+      self.assertEqual(len(self.spills), (len(expected) - 1) // 50, mode)
+      del self.spills[:]
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,127 @@
+"""
+Native table files (tablefile.py) hold the same rows as the csv files
+they were converted from
+"""
+import os
+import csv
+import unittest
+from testutil import MODES, TableTestCase, canonical, write_csv
+import tablefile
+import rowgroup
+from ops import Scan
+from parser import parse
+from optimizer import optimize
+from interpretor import execute
+
+STRINGS = ["", "plain", "with,comma", 'with "quotes"', "caf\xc3\xa9", "x" * 300]
+
+
+class FormatTests(object):
+  """
+  Tests of a format, mixed into a TableTestCase that sets format
+  """
+  # module of the format: convert(), SUFFIX
+  format = None
+
+  def convert(self, src, dst):
+    return self.format.convert(src, dst)
+
+  def assertRoundTrip(self, src, dst):
+    self.convert(src, dst)
+    expected = list(Scan(src))
+    scan = Scan(dst)
+    self.assertEqual((scan.fields, scan.types), (Scan(src).fields, Scan(src).types))
+    self.assertEqual(list(scan), expected)
+    self.assertEqual(list(Scan(dst).table()), expected)
+    return expected
+
+  def strings_table(self):
+    path = os.path.join(self.dir, "strings.csv")
+    with open(path, "wb") as f:
+      w = csv.writer(f, lineterminator="\n")
+      w.writerow(["i:num", "s:str"])
+      for i in xrange(200):
+        w.writerow([i, STRINGS[i % len(STRINGS)]])
+    return path
+
+  def test_round_trip(self):
+    self.assertRoundTrip("facts.csv", "copy" + self.format.SUFFIX)
+    self.assertRoundTrip("dim.csv", "dim" + self.format.SUFFIX)
+
+  def test_strings(self):
+    rows = self.assertRoundTrip(self.strings_table(), "strings" + self.format.SUFFIX)
+    self.assertEqual([r["s"] for r in rows[:len(STRINGS)]], STRINGS)
+
+  def test_empty(self):
+    write_csv(os.path.join(self.dir, "empty.csv"), ["a:num", "b:str"], [])
+    self.assertEqual(self.assertRoundTrip("empty.csv", "empty" + self.format.SUFFIX), [])
+
+  def test_pruned(self):
+    self.convert("facts.csv", "copy" + self.format.SUFFIX)
+    scan = Scan("copy" + self.format.SUFFIX)
+    scan.prune(["v1", "grp"])
+    self.assertEqual(scan.fields, ("grp", "v1"))
+    expected = [dict(grp=r["grp"], v1=r["v1"]) for r in Scan("facts.csv")]
+    self.assertEqual(list(scan), expected)
+
+  def test_rows_at(self):
+    self.convert("facts.csv", "copy" + self.format.SUFFIX)
+    expected = list(Scan("facts.csv"))
+    positions = [5, 0, 599, 5, 300]
+    fetch = Scan("copy" + self.format.SUFFIX).fetcher()
+    rows = fetch(positions)
+    fetch.close()
+    self.assertEqual(rows, [expected[i] for i in positions])
+
+  def test_queries(self):
+    """
+    bare table names resolve to the native file once the csv is gone
+    """
+    q = "SELECT grp, count(v1) AS n, sum(v2) AS s FROM facts, dim WHERE k1 = d_id AND v1 < 500 GROUP BY grp"
+    out = []
+    execute(optimize(parse(q)), out.append)
+    expected = canonical(out)
+    self.convert("facts.csv", "facts" + self.format.SUFFIX)
+    os.remove("facts.csv")
+    self.assertEqual(Scan("facts").filename, "facts" + self.format.SUFFIX)
+    for mode in MODES:
+      out = []
+      execute(optimize(parse(q)), out.append, mode)
+      self.assertEqual(canonical(out), expected, mode)
+
+
+class TableFileTest(FormatTests, TableTestCase):
+  format = tablefile
+
+
+class RowGroupFileTest(FormatTests, TableTestCase):
+  format = rowgroup
+  # small groups, so the tables span several
+  group_rows = 64
+  compress = True
+
+  def setUp(self):
+    super(RowGroupFileTest, self).setUp()
+    self.saved_group_rows = rowgroup.GROUP_ROWS
+    rowgroup.GROUP_ROWS = self.group_rows
+
+  def tearDown(self):
+    rowgroup.GROUP_ROWS = self.saved_group_rows
+    super(RowGroupFileTest, self).tearDown()
+
+  def convert(self, src, dst):
+    return rowgroup.convert(src, dst, compress=self.compress)
+
+  def test_groups(self):
+    self.convert("facts.csv", "copy.rgf")
+    f = rowgroup.RowGroupFile("copy.rgf")
+    self.assertTrue(len(f.groups) > 1)
+    self.assertEqual(f.nrows, len(list(Scan("facts.csv"))))
+
+
+class UncompressedRowGroupFileTest(RowGroupFileTest):
+  compress = False
+
+
+if __name__ == "__main__":
+  unittest.main()
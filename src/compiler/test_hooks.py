@@ -0,0 +1,137 @@
+"""
+Profiling and tracing hooks (hooks.py) attached to run_op
+"""
+import os
+import sys
+import types
+import unittest
+from StringIO import StringIO
+from testutil import TableTestCase
+import hooks
+import interpretor
+from hooks import Hooks, CountHooks, ProfileHooks, attach, engine_of
+from ops import Scan
+from parser import parse
+from optimizer import optimize
+from interpretor import run_op
+
+Q = "SELECT id, d_cat FROM facts, dim WHERE k1 = d_id AND v1 < 300"
+
+
+class Recorder(Hooks):
+  sample_every = 10
+
+  def __init__(self):
+    self.events = []
+    self.rows = []
+
+  def start(self):
+    self.events.append("start")
+
+  def stop(self):
+    self.events.append("stop")
+
+  def op_open(self, op):
+    self.events.append(("open", op))
+
+  def op_close(self, op, stats):
+    self.events.append(("close", op, stats["rows"]))
+
+  def row(self, op, tup):
+    self.rows.append(op)
+
+
+class HooksTest(TableTestCase):
+  def run_plan(self, plan):
+    out = []
+    run_op(plan, out.append)
+    return out
+
+  def test_attach(self):
+    expected = self.run_plan(optimize(parse(Q)))
+    plan = optimize(parse(Q))
+    rec = Recorder()
+    with attach(plan, rec):
+      self.assertTrue(interpretor.tracer is not None)
+      out = self.run_plan(plan)
+    self.assertEqual(interpretor.tracer, None)
+    self.assertEqual(out, expected)
+    self.assertEqual(rec.events[0], "start")
+    self.assertEqual(rec.events[-1], "stop")
+    closes = [e for e in rec.events if e[0] == "close"]
+    self.assertEqual(len(closes), len([e for e in rec.events if e[0] == "open"]))
+    # the last operator to finish is the root
+    self.assertEqual(closes[-1][1:], (plan, len(expected)))
+    self.assertEqual(len([op for op in rec.rows if op is plan]), len(expected) // 10)
+
+  def test_detached_on_error(self):
+    plan = optimize(parse("SELECT id FROM facts WHERE 1 < v1 / (k2 - k2)"))
+    with self.assertRaises(ZeroDivisionError):
+      with attach(plan, Recorder()):
+        self.run_plan(plan)
+    self.assertEqual(interpretor.tracer, None)
+
+  def test_count_hooks(self):
+    plan = optimize(parse(Q))
+    counts = CountHooks()
+    with attach(plan, counts):
+      out = self.run_plan(plan)
+    self.assertEqual(counts.ops["Project"], dict(counts.ops["Project"], loops=1, rows=len(out)))
+    scans = plan.collect("Scan")
+    self.assertEqual(counts.ops["Scan"]["rows"],
+        sum(len(list(Scan(s.filename))) for s in scans))
+    # the filter is evaluated once per facts row
+    conds = [str(f.cond) for f in plan.collect("Filter")]
+    self.assertEqual([counts.exprs[c] for c in conds], [600] * len(conds))
+
+  def test_profile_hooks(self):
+    plan = optimize(parse(Q))
+    profile = ProfileHooks()
+    with attach(plan, profile):
+      self.run_plan(plan)
+    out = StringIO()
+    profile.print_stats(out)
+    self.assertTrue("interpret_op" in out.getvalue())
+
+  def test_combined(self):
+    plan = optimize(parse(Q))
+    counts, rec = CountHooks(), Recorder()
+    with attach(plan, counts):
+      with attach(plan, rec):
+        out = self.run_plan(plan)
+    self.assertEqual(counts.ops["Project"]["rows"], len(out))
+    self.assertTrue(("close", plan, len(out)) in rec.events)
+
+
+class EngineTest(unittest.TestCase):
+  def test_this_engine(self):
+    self.assertTrue(engine_of(Scan("facts")) is interpretor)
+
+  def test_other_engine(self):
+    """
+    operators of another engine's ops module resolve to the interpretor
+    module next to it
+    """
+    d = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql")
+    fake_ops = types.ModuleType("fake_sql_ops")
+    fake_ops.__file__ = os.path.join(d, "ops.py")
+    fake_interpretor = types.ModuleType("fake_sql_interpretor")
+    fake_interpretor.__file__ = os.path.join(d, "interpretor.pyc")
+    fake_interpretor.tracer = None
+    Op = type("Op", (object,), {"__module__": "fake_sql_ops"})
+    sys.modules.update(fake_sql_ops=fake_ops, fake_sql_interpretor=fake_interpretor)
+    try:
+      self.assertTrue(engine_of(Op()) is fake_interpretor)
+      with attach(Op(), CountHooks()):
+        self.assertTrue(isinstance(fake_interpretor.tracer, hooks.HookTracer))
+        self.assertEqual(interpretor.tracer, None)
+      self.assertEqual(fake_interpretor.tracer, None)
+      del sys.modules["fake_sql_interpretor"]
+      self.assertRaises(Exception, engine_of, Op())
+    finally:
+      sys.modules.pop("fake_sql_ops", None)
+      sys.modules.pop("fake_sql_interpretor", None)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,102 @@
+"""
+The join algorithms of run_op (interpretor.hash_join and
+block_nested_loop_join), run directly on small tables: empty inputs,
+duplicate keys and conditions that are not only equalities
+"""
+import unittest
+from testutil import TableTestCase, canonical, write_csv
+import volcano
+from ops import Scan, Join, Expr, Project, Star
+from parser import parseexpr
+from interpretor import (HashJoinTable, hash_join, block_nested_loop_join,
+    join_keys, join_tup)
+
+L = ["a:num", "b:num", "s:str"]
+R = ["x:num", "y:num", "t:str"]
+
+
+def conds(*exprs):
+  return reduce(lambda l, r: Expr("and", l, r), map(parseexpr, exprs))
+
+def reference(cond, left, right):
+  """
+  rows of the join of the two files, by a nested loop in python
+  """
+  ltups, rtups = list(Scan(left)), list(Scan(right))
+  bound = cond.bind()
+  return canonical([join_tup(l, r) for l in ltups for r in rtups if bound(l, r)])
+
+def run(algorithm, op):
+  out = []
+  algorithm(op, out.append)
+  return canonical(out)
+
+
+class JoinAlgorithmTest(TableTestCase):
+  def setUp(self):
+    super(JoinAlgorithmTest, self).setUp()
+    # b and y have duplicate keys on both sides
+    write_csv("l.csv", L, [(i, i % 4, "s%d" % (i % 3)) for i in xrange(30)])
+    write_csv("r.csv", R, [(i, i % 6, "s%d" % (i % 2)) for i in xrange(20)])
+    write_csv("empty_l.csv", L, [])
+    write_csv("empty_r.csv", R, [])
+
+  def check(self, cond, left="l.csv", right="r.csv", block_sizes=(None, 1, 7)):
+    expected = reference(cond, left, right)
+    self.assertEqual(run(hash_join, Join(Scan(left), Scan(right), cond)), expected)
+    self.assertEqual(canonical(volcano.iter_op(Join(Scan(left), Scan(right), cond))), expected)
+    for size in block_sizes:
+      op = Join(Scan(left), Scan(right), cond, block_size=size)
+      self.assertEqual(run(block_nested_loop_join, op), expected, size)
+    return expected
+
+  def test_duplicate_keys(self):
+    expected = self.check(conds("b = y"))
+    self.assertEqual(len(expected), sum(
+        1 for i in xrange(30) for j in xrange(20) if i % 4 == j % 6))
+    self.check(conds("y = b"))
+    self.check(conds("b = y", "s = t"))
+
+  def test_residuals(self):
+    self.assertTrue(self.check(conds("b = y", "a < x")))
+    self.assertTrue(self.check(conds("s = t", "a + 1 > x * 2")))
+    # equality of expressions over both inputs is not a hash key
+    self.assertTrue(self.check(conds("b = y", "a = x + b")))
+
+  def test_non_equi(self):
+    self.assertTrue(self.check(conds("a < x")))
+    self.assertTrue(self.check(conds("a < x", "b <> y")))
+
+  def test_empty_inputs(self):
+    for left, right in [("empty_l.csv", "r.csv"), ("l.csv", "empty_r.csv"),
+        ("empty_l.csv", "empty_r.csv")]:
+      self.assertEqual(self.check(conds("b = y"), left, right), [])
+      self.assertEqual(self.check(conds("a < x"), left, right), [])
+
+  def test_keys_from_schema(self):
+    """
+    the keys are chosen before any tuple is seen, from the inputs' fields
+    """
+    op = Join(Scan("l.csv"), Scan("r.csv"), conds("y = b", "a < x"))
+    keys, residual = join_keys(op)
+    self.assertEqual([(str(l), str(r)) for l, r in keys], [("b", "y")])
+    self.assertEqual(map(str, residual), ["a < x"])
+    table = HashJoinTable(op, list(Scan("r.csv")))
+    self.assertEqual(sorted(table.table), [(float(k),) for k in xrange(6)])
+
+  def test_unknown_schema(self):
+    """
+    a left input without a known schema joins with a nested loop over
+    the buffered right input
+    """
+    cond = conds("b = y", "a < x")
+    # the fields of SELECT * are not known from the plan
+    left = Project(Scan("l.csv"), [Star()], [])
+    op = Join(left, Scan("r.csv"), cond)
+    self.assertEqual(join_keys(op)[0], [])
+    self.assertEqual(map(str, join_keys(op)[1]), ["b = y", "a < x"])
+    self.assertEqual(HashJoinTable(op, list(Scan("r.csv"))).table, None)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,128 @@
+"""
+Join ordering (optimizer.order_joins): reordered plans produce the rows
+of the plan that joins the sources in FROM order, and every predicate
+is kept
+"""
+import unittest
+from testutil import MODES, TableTestCase, canonical, write_csv
+import optimizer
+from ops import Join, Bool
+from parser import parse
+from optimizer import optimize, push_predicates
+from interpretor import execute
+
+CHAIN = """SELECT id, d_cat, e_name, y_id FROM facts, dim, dim2, x1, x2
+           WHERE k1 = d_id AND d_e = e_id AND x_e = e_id AND y_x = x_id AND v1 < 100"""
+# the FROM order starts with two sources no predicate joins
+CROSS = """SELECT id, d_cat, e_name FROM dim2, facts, dim
+           WHERE k1 = d_id AND d_e = e_id AND v2 < 0.3"""
+CYCLE = """SELECT id, e_name, x_id FROM facts, dim, dim2, x1
+           WHERE k1 = d_id AND d_e = e_id AND x_e = e_id AND x_id = k2 AND d_w < 0.5"""
+QUERIES = [CHAIN, CROSS, CYCLE]
+
+
+def unreordered(q):
+  """
+  plan of q with the sources of every FROM joined left deep in FROM
+  order, and its predicates placed
+  """
+  op = parse(q)
+  while op.collectone("From"):
+    fromop = op.collectone("From")
+    join = reduce(lambda l, r: Join(l, r, Bool(True)), fromop.cs)
+    if fromop == op:
+      op = join
+    else:
+      fromop.replace(join)
+  return push_predicates(op)
+
+def run(plan, mode="row"):
+  out = []
+  execute(plan, out.append, mode)
+  return canonical(out)
+
+def cross_products(plan):
+  return [j for j in plan.collect("Join") if isinstance(j.cond, Bool) and j.cond.v is True]
+
+
+class JoinOrderTest(TableTestCase):
+  def setUp(self):
+    super(JoinOrderTest, self).setUp()
+    write_csv("x1.csv", ["x_id:num", "x_e:num"], [(i, i % 10) for i in xrange(20)])
+    write_csv("x2.csv", ["y_id:num", "y_x:num"], [(i, i % 25) for i in xrange(15)])
+    self.dp_max = optimizer.DP_MAX_RELATIONS
+
+  def tearDown(self):
+    optimizer.DP_MAX_RELATIONS = self.dp_max
+    super(JoinOrderTest, self).tearDown()
+
+  def check(self, q):
+    expected = run(unreordered(q))
+    self.assertTrue(expected, q)
+    plan = optimize(parse(q))
+    self.assertEqual(cross_products(plan), [], q)
+    for mode in MODES:
+      self.assertEqual(run(optimize(parse(q)), mode), expected, "%s: %s" % (mode, q))
+
+  def test_dp_order(self):
+    for q in QUERIES:
+      self.check(q)
+
+  def test_greedy_order(self):
+    optimizer.DP_MAX_RELATIONS = 1
+    for q in QUERIES:
+      self.check(q)
+
+  def test_cutoff(self):
+    calls = []
+    dp_order, greedy_order = optimizer.dp_order, optimizer.greedy_order
+    def counted_dp(mask, leaves, preds):
+      calls.append(("dp", bin(mask).count("1")))
+      return dp_order(mask, leaves, preds)
+    def counted_greedy(plans, preds):
+      calls.append(("greedy", len(plans)))
+      return greedy_order(plans, preds)
+    optimizer.dp_order, optimizer.greedy_order = counted_dp, counted_greedy
+    try:
+      optimizer.DP_MAX_RELATIONS = 5
+      optimize(parse(CHAIN))
+      self.assertEqual(calls, [("dp", 5), ("greedy", 1)])
+      del calls[:]
+      optimizer.DP_MAX_RELATIONS = 4
+      optimize(parse(CHAIN))
+      self.assertEqual(calls, [("greedy", 5), ("greedy", 1)])
+    finally:
+      optimizer.dp_order, optimizer.greedy_order = dp_order, greedy_order
+
+  def test_unknown_schema(self):
+    """
+    a predicate over a table whose file does not exist yet still joins it
+    """
+    q = "SELECT id FROM facts, ghost, dim WHERE k1 = d_id AND g_x = d_e"
+    plan = optimize(parse(q))
+    self.assertEqual(len(plan.collect("Join")), 2)
+    self.assertEqual(cross_products(plan), [])
+
+  def test_ambiguous_attribute(self):
+    """
+    k2 < 3 may reference either facts, so it connects both
+    """
+    q = "SELECT a.id FROM facts AS a, dim, facts AS b WHERE a.k1 = d_id AND d_id = b.k2 AND k2 < 3"
+    plan = optimize(parse(q))
+    self.assertEqual(cross_products(plan), [])
+    self.assertTrue([op for op in plan.collect(["Join", "Filter"]) if "k2 < 3" in str(op.cond)])
+
+  def test_unattributed_predicate(self):
+    """
+    a conjunct over no source's attributes stays above the join tree
+    """
+    q = "SELECT id FROM facts, dim WHERE k1 = d_id AND nosuch < 5"
+    plan = optimize(parse(q))
+    self.assertEqual(cross_products(plan), [])
+    filters = [f for f in plan.collect("Filter") if "nosuch" in str(f.cond)]
+    self.assertEqual(len(filters), 1)
+    self.assertTrue(filters[0].collect("Join"))
+
+
+if __name__ == "__main__":
+  unittest.main()
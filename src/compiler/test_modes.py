@@ -0,0 +1,71 @@
+"""
+Every execution mode of interpretor.execute produces the same rows
+"""
+import unittest
+from testutil import MODES, TableTestCase, canonical
+from parser import parse
+from optimizer import optimize
+from interpretor import execute
+
+QUERIES = [
+  "SELECT id, v1 FROM facts WHERE v1 < 100",
+  "SELECT id, v1 * 2 + v2 AS x FROM facts",
+  "SELECT grp, count(v1) AS n, sum(v2) AS s FROM facts, dim WHERE k1 = d_id AND v1 < 500 GROUP BY grp",
+  "SELECT grp, std(v1) AS s, count(v1) AS n FROM facts GROUP BY grp",
+  "SELECT id, d_cat, e_name FROM facts, dim, dim2 WHERE k1 = d_id AND d_e = e_id AND v1 < 50",
+  "SELECT id, d_id FROM facts, dim WHERE k1 < d_id AND v1 < 3 AND d_w < 0.1",
+  "SELECT id, v1 FROM facts ORDER BY v1 DESC LIMIT 7",
+  "SELECT k2, v1 FROM facts ORDER BY k2, v1 LIMIT 5 OFFSET 3",
+]
+
+SUBQUERIES = [
+  "SELECT s.id, s.v1 FROM (SELECT id, v1 FROM facts WHERE v1 < 100) AS s WHERE s.v1 > 50",
+  "SELECT id, d_cat FROM (SELECT id, k1 FROM facts WHERE v1 < 60) AS s, dim WHERE k1 = d_id",
+]
+
+
+def run(q, mode):
+  out = []
+  execute(optimize(parse(q)), out.append, mode)
+  return out
+
+
+class ModesTest(TableTestCase):
+  def check(self, q):
+    expected = canonical(run(q, "row"))
+    self.assertTrue(expected, "no rows: %s" % q)
+    for mode in MODES[1:]:
+      self.assertEqual(canonical(run(q, mode)), expected, "%s: %s" % (mode, q))
+
+  def test_queries(self):
+    for q in QUERIES:
+      self.check(q)
+
+  def test_subqueries(self):
+    for q in SUBQUERIES:
+      self.check(q)
+
+  def test_divide_by_zero(self):
+    # k2 - k2 is 0 for every row
+    for q in ["SELECT id, v1 / (k2 - k2) AS x FROM facts",
+        "SELECT id FROM facts WHERE 1 < v1 / (k2 - k2)",
+        "SELECT grp, sum(v1 / (k2 - 3)) AS s FROM facts GROUP BY grp"]:
+      for mode in MODES:
+        self.assertRaises(ZeroDivisionError, run, q, mode)
+
+  def test_skipped_zero_divisors(self):
+    # rows whose divisor is zero are filtered out, or their division is
+    # not evaluated (WHERE evaluates its last conjunct first)
+    self.check("SELECT id, v1 / (k2 - 3) AS x FROM facts WHERE k2 <> 3")
+    self.check("SELECT id, v1 FROM facts WHERE 10 < v1 / (k2 - 3) AND k2 <> 3")
+
+  def test_ordered(self):
+    q = "SELECT id, v1 FROM facts ORDER BY v1 DESC LIMIT 20"
+    expected = [r["v1"] for r in run(q, "row")]
+    self.assertEqual(expected, sorted(expected, reverse=True))
+    for mode in MODES[1:]:
+      self.assertEqual([r["v1"] for r in run(q, mode)], expected, mode)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,74 @@
+"""
+Column pruning (optimizer.prune_columns): pruned plans read fewer
+columns and produce the rows of the same plans without pruning
+"""
+import unittest
+from testutil import MODES, TableTestCase, canonical
+import optimizer
+from ops import Scan
+from parser import parse
+from optimizer import optimize
+from interpretor import execute
+
+QUERIES = [
+  # join keys that are not selected
+  "SELECT id, d_cat FROM facts, dim WHERE k1 = d_id AND v1 < 200",
+  "SELECT e_name FROM facts, dim, dim2 WHERE k1 = d_id AND d_e = e_id AND v2 < 0.1",
+  # aliases of tables, columns and subqueries
+  "SELECT a.id AS x, b.v1 AS y FROM facts AS a, facts AS b WHERE a.k1 = b.id AND a.v1 < 100",
+  "SELECT s.i, s.w FROM (SELECT id AS i, v1 * 2 AS w, k2 FROM facts WHERE v2 < 0.2) AS s WHERE s.k2 < 5",
+  "SELECT s.n, d_cat FROM (SELECT k1 AS n, v1 FROM facts) AS s, dim WHERE s.n = d_id AND d_w < 0.3",
+  # group keys and aggregate arguments that are not selected
+  "SELECT count(v1) AS n, sum(v2) AS s FROM facts GROUP BY grp",
+  "SELECT grp, avg(v1) AS a FROM facts, dim WHERE k1 = d_id GROUP BY grp, d_cat",
+  # order keys
+  "SELECT id, v1 FROM facts WHERE k2 < 4 ORDER BY v1 DESC LIMIT 9",
+  "SELECT * FROM dim WHERE d_w < 0.2",
+]
+
+
+def unpruned(q):
+  prune = optimizer.prune_columns
+  optimizer.prune_columns = lambda op, needed=None: op
+  try:
+    return optimize(parse(q))
+  finally:
+    optimizer.prune_columns = prune
+
+def run(plan, mode):
+  out = []
+  execute(plan, out.append, mode)
+  return canonical(out)
+
+
+class PruneTest(TableTestCase):
+  def test_same_rows(self):
+    for q in QUERIES:
+      expected = run(unpruned(q), "row")
+      self.assertTrue(expected, q)
+      for mode in MODES:
+        self.assertEqual(run(optimize(parse(q)), mode), expected, "%s: %s" % (mode, q))
+
+  def test_pruned_scans(self):
+    plan = optimize(parse(QUERIES[0]))
+    fields = dict((s.alias, s.fields) for s in plan.collect("Scan"))
+    self.assertEqual(sorted(fields["facts"]), ["id", "k1", "v1"])
+    self.assertEqual(sorted(fields["dim"]), ["d_cat", "d_id"])
+
+    plan = optimize(parse(QUERIES[5]))
+    self.assertEqual(sorted(plan.collectone("Scan").fields), ["grp", "v1", "v2"])
+
+  def test_aliased_subquery(self):
+    plan = optimize(parse(QUERIES[3]))
+    self.assertEqual(sorted(plan.collectone("Scan").fields), ["id", "k2", "v1", "v2"])
+    # s.k2 < 5 is pushed into the subquery, so its Project drops k2
+    inner = plan.collectone("SubQuerySource").collectone("Project")
+    self.assertEqual(inner.aliases, ["i", "w"])
+
+  def test_star(self):
+    plan = optimize(parse(QUERIES[-1]))
+    self.assertEqual(plan.collectone("Scan").fields, Scan("dim").fields)
+
+
+if __name__ == "__main__":
+  unittest.main()
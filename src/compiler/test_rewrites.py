@@ -0,0 +1,179 @@
+"""
+Plans rewritten by the optimizer produce the same rows as the plans
+before the rewrites, in every execution mode
+"""
+import os
+import unittest
+from testutil import MODES, TableTestCase, canonical, write_csv
+import index
+import catalog
+import rowgroup
+from ops import Scan, Expr, Join, IndexJoin
+from parser import parse, parseexpr
+from optimizer import optimize, from_expansion, push_predicates
+from interpretor import execute
+
+
+def unrewritten(q):
+  """
+  plan of q with its joins and predicates placed, but none of the
+  rewrites that depend on indexes, file formats or limits
+  """
+  op = parse(q)
+  while op.collectone("From"):
+    op = from_expansion(op)
+  return push_predicates(op)
+
+def run(plan, mode):
+  out = []
+  execute(plan, out.append, mode)
+  return out
+
+
+class RewriteTestCase(TableTestCase):
+  def check(self, q, klass, ordered=False):
+    """
+    @klass  name of an operator the rewritten plan must contain
+    """
+    same = ordered and (lambda rows: rows) or canonical
+    expected = same(run(unrewritten(q), "row"))
+    self.assertTrue(expected, "no rows: %s" % q)
+    plan = optimize(parse(q))
+    self.assertTrue(plan.collect(klass), "no %s in the plan of %s" % (klass, q))
+    for mode in MODES:
+      self.assertEqual(same(run(optimize(parse(q)), mode)), expected, "%s: %s" % (mode, q))
+
+
+class IndexRewriteTest(RewriteTestCase):
+  def test_hash_index(self):
+    index.create_index("facts", "k1")
+    self.check("SELECT id, v1 FROM facts WHERE k1 = 7", "IndexScan")
+    self.check("SELECT id, v1 FROM facts WHERE k1 = 7 AND v1 < 500", "IndexScan")
+
+  def test_sorted_index(self):
+    index.create_index("facts", "v1", "sorted")
+    self.check("SELECT id, grp FROM facts WHERE v1 < 80 AND v1 > 20", "IndexScan")
+    self.check("SELECT id, grp FROM facts WHERE v1 < 300 AND k2 < 5", "IndexScan")
+
+  def test_index_join(self):
+    index.create_index("dim", "d_id")
+    self.check("SELECT id, d_cat FROM facts, dim WHERE k1 = d_id AND v2 < 0.2", "IndexJoin")
+
+  def test_index_join_sides(self):
+    """
+    an IndexJoin produces the rows of the hash join of its inputs, with
+    the index on either input, and closes the inner table's file
+    """
+    index.create_index("dim", "d_id")
+    index.create_index("dim", "d_id", "sorted")
+    fetchers = []
+    fetcher = Scan.fetcher
+    def recorded(scan):
+      fetchers.append(fetcher(scan))
+      return fetchers[-1]
+    Scan.fetcher = recorded
+    self.addCleanup(setattr, Scan, "fetcher", fetcher)
+
+    def inputs(side):
+      facts, dim = Scan("facts"), Scan("dim")
+      return side == "l" and (dim, facts) or (facts, dim)
+    residual = [parseexpr("v2 < d_w")]
+    cond = Expr("and", parseexpr("k1 = d_id"), residual[0])
+    for side in "lr":
+      expected = canonical(run(Join(*inputs(side) + (cond,)), "row"))
+      self.assertTrue(expected)
+      for kind in ("hash", "sorted"):
+        for mode in MODES:
+          plan = IndexJoin(*inputs(side) + (cond, side, "d_id", kind, parseexpr("k1"), residual))
+          self.assertEqual(canonical(run(plan, mode)), expected, (side, kind, mode))
+    self.assertTrue(fetchers)
+    self.assertEqual([f for f in fetchers if f.f is not None], [])
+
+  def test_saved_index(self):
+    index.create_index("facts", "k2")
+    q = "SELECT id, k2 FROM facts WHERE k2 = 3"
+    self.check(q, "IndexScan")
+    saved = os.listdir(index.root)
+    self.assertEqual(len(saved), 1)
+    # as a new process, without the catalog's entries
+    index.built.clear()
+    catalog.entries = None
+    self.assertNotEqual(index.load_index("facts", "k2", "hash"), None)
+    self.check(q, "IndexScan")
+    index.drop_index("facts", "k2")
+    self.assertEqual(os.listdir(index.root), [])
+
+  def test_in_memory(self):
+    index.root = ""
+    index.create_index("facts", "k2")
+    self.check("SELECT id, k2 FROM facts WHERE k2 = 3", "IndexScan")
+    self.assertEqual(index.load_index("facts", "k2", "hash"), None)
+    self.assertFalse(os.path.exists(os.path.join(self.dir, "index")))
+
+  def test_changed_file(self):
+    index.create_index("facts", "k2")
+    q = "SELECT id, k2 FROM facts WHERE k2 = 3"
+    self.check(q, "IndexScan")
+    with open(self.paths["facts"], "a") as f:
+      f.write("100000,1,3,g1,1.5,0.5\n")
+    # the saved index is of the old file
+    self.assertEqual(index.load_index("facts", "k2", "hash"), None)
+    self.check(q, "IndexScan")
+    ids = [r["id"] for r in run(optimize(parse(q)), "row")]
+    self.assertTrue(100000.0 in ids)
+    index.built.clear()
+    self.assertNotEqual(index.load_index("facts", "k2", "hash"), None)
+
+
+class TopNRewriteTest(RewriteTestCase):
+  def test_topn(self):
+    self.check("SELECT id, v1 FROM facts ORDER BY v1 DESC LIMIT 7", "TopN", ordered=True)
+    self.check("SELECT id, v1 FROM facts ORDER BY v1 LIMIT 12", "TopN", ordered=True)
+
+  def test_offset(self):
+    self.check("SELECT id, k2, v1 FROM facts ORDER BY k2, v1 DESC LIMIT 5 OFFSET 3",
+        "TopN", ordered=True)
+
+  def test_limit_past_end(self):
+    self.check("SELECT id, v1 FROM facts WHERE v1 < 50 ORDER BY v1 LIMIT 100000",
+        "TopN", ordered=True)
+
+
+class RowGroupRewriteTest(RewriteTestCase):
+  def setUp(self):
+    super(RowGroupRewriteTest, self).setUp()
+    self.saved_group_rows = rowgroup.GROUP_ROWS
+    rowgroup.GROUP_ROWS = 50
+    # sorted on v1, so row groups have disjoint v1 ranges and skip
+    rows = sorted(Scan("facts.csv"), key=lambda r: r["v1"])
+    fields = Scan("facts.csv").fields
+    write_csv("sorted.csv", ["%s:%s" % ft for ft in zip(fields, Scan("facts.csv").types)],
+        [[r[f] for f in fields] for r in rows])
+    rowgroup.convert("sorted.csv", "rg.rgf")
+    os.remove("sorted.csv")
+
+  def tearDown(self):
+    rowgroup.GROUP_ROWS = self.saved_group_rows
+    super(RowGroupRewriteTest, self).tearDown()
+
+  def check_skipped(self, q):
+    self.check(q, "Scan")
+    scan = [s for s in optimize(parse(q)).collect("Scan") if s.filename == "rg.rgf"][0]
+    self.assertTrue(scan.skip_preds, q)
+    read = sum(len(t) for t in scan.tables())
+    self.assertTrue(0 < read < rowgroup.RowGroupFile("rg.rgf").nrows, q)
+
+  def test_range(self):
+    self.check_skipped("SELECT id, v1 FROM rg WHERE v1 < 100")
+    self.check_skipped("SELECT id, grp FROM rg WHERE v1 > 200 AND v1 < 300 AND k2 < 10")
+
+  def test_equality(self):
+    v1 = list(Scan("rg"))[123]["v1"]
+    self.check_skipped("SELECT id, v1 FROM rg WHERE v1 = %s" % v1)
+
+  def test_join(self):
+    self.check_skipped("SELECT id, d_cat FROM rg, dim WHERE k1 = d_id AND v1 < 150")
+
+
+if __name__ == "__main__":
+  unittest.main()
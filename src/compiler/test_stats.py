@@ -0,0 +1,127 @@
+"""
+Table statistics (stats.py): the distinct value sketch's error, the
+histograms' selectivities, and when statistics are collected
+"""
+import random
+import unittest
+import numpy as np
+from testutil import TableTestCase, write_csv
+import stats
+from stats import ColumnCollector, SKETCH_SIZE
+from ops import Scan
+from optimizer import estimate_rows
+from parser import parse
+
+
+def collect(name, type, cells, chunk=1000):
+  c = ColumnCollector(name, type)
+  for i in xrange(0, len(cells), chunk):
+    c.add(cells[i:i + chunk])
+  return c.stats(len(cells))
+
+def true_range(vals, lo=None, hi=None):
+  return sum(1 for v in vals
+      if (lo is None or v >= lo) and (hi is None or v <= hi)) / float(len(vals))
+
+
+class DistinctValuesTest(unittest.TestCase):
+  def test_exact_below_sketch_size(self):
+    cells = ["v%d" % (i % 700) for i in xrange(5000)]
+    self.assertEqual(collect("s", "str", cells).ndv, 700)
+
+  def test_error_bound(self):
+    # the k minimum values estimate has a relative standard error of
+    # about 1/sqrt(k - 2); allow four times that
+    bound = 4 / np.sqrt(SKETCH_SIZE - 2)
+    rand = random.Random(0)
+    for ndv in (2000, 20000, 200000):
+      for seed in xrange(3):
+        cells = [str(rand.randrange(ndv) + seed * 10 ** 7) for i in xrange(3 * ndv)]
+        true = len(set(cells))
+        est = collect("n", "num", cells, chunk=4096).ndv
+        self.assertTrue(abs(est - true) / float(true) < bound,
+            "ndv %d estimated as %d" % (true, est))
+
+  def test_nulls(self):
+    cells = ["", "1", "2", "", "2"] * 100
+    s = collect("n", "num", cells)
+    self.assertEqual((s.nulls, s.ndv, s.min, s.max), (200, 2, 1.0, 2.0))
+    self.assertAlmostEqual(s.nonnull(), 0.6)
+
+
+class HistogramTest(unittest.TestCase):
+  def check(self, vals, ranges, tolerance=0.03):
+    s = collect("v", "num", map(repr, vals))
+    for lo, hi in ranges:
+      est = s.range(lo, hi)
+      true = true_range(vals, lo, hi)
+      self.assertTrue(abs(est - true) < tolerance,
+          "[%s, %s]: estimated %.3f, actual %.3f" % (lo, hi, est, true))
+
+  def ranges(self, vals):
+    lo, hi = min(vals), max(vals)
+    points = [lo + (hi - lo) * f for f in (0.05, 0.2, 0.5, 0.77, 0.95)]
+    return ([(None, p) for p in points] + [(p, None) for p in points] +
+        [(points[0], points[2]), (points[1], points[3]), (lo - 1, hi + 1)])
+
+  def test_uniform(self):
+    rand = random.Random(1)
+    vals = [rand.uniform(0, 1000) for i in xrange(50000)]
+    self.check(vals, self.ranges(vals))
+
+  def test_skewed(self):
+    rand = random.Random(2)
+    vals = [rand.expovariate(0.01) for i in xrange(50000)]
+    self.check(vals, self.ranges(vals) + [(None, 10), (None, 50), (300, None)])
+
+  def test_frequent_value(self):
+    rand = random.Random(3)
+    vals = [rand.random() < 0.3 and 42.0 or rand.uniform(0, 1000) for i in xrange(20000)]
+    s = collect("v", "num", map(repr, vals))
+    self.assertTrue(abs(s.range(42.0, 42.0) - true_range(vals, 42.0, 42.0)) < 0.05)
+    self.assertEqual(s.range(2000.0, 2000.0), 0.0)
+
+  def test_nulls(self):
+    vals = [float(i % 100) for i in xrange(1000)]
+    s = collect("v", "num", [i % 2 and repr(v) or "" for i, v in enumerate(vals)])
+    self.assertTrue(abs(s.range(None, 49.0) - 0.25) < 0.03)
+
+
+class CollectionTest(TableTestCase):
+  def setUp(self):
+    super(CollectionTest, self).setUp()
+    self.auto = stats.auto
+    stats.auto = False
+    stats.collected.clear()
+
+  def tearDown(self):
+    stats.auto = self.auto
+    stats.collected.clear()
+    super(CollectionTest, self).tearDown()
+
+  def test_not_collected_by_scans(self):
+    list(Scan("facts"))
+    self.assertEqual(stats.table_stats("facts"), None)
+
+  def test_analyze(self):
+    s = stats.analyze("facts")
+    self.assertEqual(s.rows, 600)
+    self.assertEqual(sorted(s.columns), sorted(Scan("facts").fields))
+    self.assertEqual(s.columns["grp"].ndv, 7)
+    self.assertEqual(stats.table_stats("facts").rows, 600)
+    plan = parse("SELECT id FROM facts WHERE v1 < 250").collectone("Filter")
+    self.assertTrue(100 < estimate_rows(plan) < 200)
+
+  def test_auto(self):
+    stats.auto = True
+    list(Scan("dim"))
+    self.assertEqual(stats.table_stats("dim").rows, 50)
+
+  def test_changed_file(self):
+    stats.analyze("dim2")
+    write_csv("dim2.csv", ["e_id:num", "e_name:str"], [(1, "a"), (2, "b"), (3, "c")])
+    self.assertEqual(stats.table_stats("dim2"), None)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,93 @@
+"""
+Fixtures of the test_*.py modules.
+
+    python -m unittest discover -p "test_*.py"
+
+Test modules import testutil before the engine's modules, since it
+puts ../common (the csv reader the engines share) on sys.path.
+
+TableTestCase runs every test in a temporary directory holding small
+facts, dim and dim2 csv tables (the schema of ../bench/datagen.py), with
+an in-memory catalog, no declared indexes, no column cache and indexes
+saved under the temporary directory, so tests do not read or change the
+files that DB_CATALOG, DB_CACHE or DB_INDEX name.
+"""
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+# the tests chdir to their tables, and execute() imports the modes lazily
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "common"))
+import catalog
+import colcache
+import index
+
+MODES = ("row", "vector", "compiled", "pull")
+
+
+def write_csv(path, header, rows):
+  with open(path, "w") as f:
+    f.write(",".join(header) + "\n")
+    for row in rows:
+      f.write(",".join(map(str, row)) + "\n")
+  return path
+
+def make_tables(d, nfacts=600, ndim=50, ndim2=10, seed=0):
+  """
+  @return dict of table name -> csv path
+  """
+  rand = random.Random(seed)
+  paths = {}
+  paths["facts"] = write_csv(os.path.join(d, "facts.csv"),
+      ["id:num", "k1:num", "k2:num", "grp:str", "v1:num", "v2:num"],
+      [(i, rand.randrange(ndim), rand.randrange(20), "g%d" % rand.randrange(7),
+        round(rand.uniform(0, 1000), 2), round(rand.random(), 4))
+       for i in xrange(nfacts)])
+  paths["dim"] = write_csv(os.path.join(d, "dim.csv"),
+      ["d_id:num", "d_e:num", "d_cat:str", "d_w:num"],
+      [(i, rand.randrange(ndim2), "c%d" % (i % 5), round(rand.random(), 2))
+       for i in xrange(ndim)])
+  paths["dim2"] = write_csv(os.path.join(d, "dim2.csv"),
+      ["e_id:num", "e_name:str"],
+      [(i, "e%d" % i) for i in xrange(ndim2)])
+  return paths
+
+def canonical(rows):
+  """
+  rows as a sorted list, with floats rounded, to compare results
+  that may differ in order and float summation order
+  """
+  def value(v):
+    return isinstance(v, float) and round(v, 6) or v
+  return sorted(tuple(sorted((k, value(v)) for k, v in row.iteritems()))
+      for row in rows)
+
+
+class TableTestCase(unittest.TestCase):
+  def setUp(self):
+    self.cwd = os.getcwd()
+    self.dir = tempfile.mkdtemp()
+    self.paths = make_tables(self.dir)
+    os.chdir(self.dir)
+    self.saved = (catalog.path, colcache.root, index.root)
+    catalog.path = ""
+    catalog.entries = None
+    catalog.dirty.clear()
+    colcache.root = ""
+    index.root = os.path.join(self.dir, "index")
+    index.declared = None
+    index.built.clear()
+
+  def tearDown(self):
+    os.chdir(self.cwd)
+    catalog.path, colcache.root, index.root = self.saved
+    catalog.entries = None
+    catalog.dirty.clear()
+    index.declared = None
+    index.built.clear()
+    shutil.rmtree(self.dir, ignore_errors=True)
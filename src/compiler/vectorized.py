@@ -0,0 +1,194 @@
+"""
+Vectorized executor.
+
+Instead of pushing one dict at a time through callbacks, operators
+pass batches (columnar Tables of up to BATCH_SIZE rows) to their
+parents.  Expressions are evaluated over whole columns with
+eval_batch(), and Filter turns its condition into a selection mask.
+
+Operators or expressions that have no vectorized implementation are
+run by run_op and their output is converted into batches, so any plan
+produces the same rows as run_op.
+"""
+try:
+  import instabase.notebook.ipython.utils as ib
+  ib.import_pyfile('./interpretor.py', 'interpretor')
+  ib.import_pyfile('./table.py', 'table')
+except:
+  pass
+import numpy as np
+from interpretor import *
+from table import Table
+
+# number of rows moved between operators at a time
+BATCH_SIZE = 4096
+
+
+class GroupBatch(object):
+  """
+  Output of a vectorized GroupBy: one row per group.
+
+  Non-aggregate expressions see the last input row of each group (like
+  run_op), and aggregate functions see the group's rows in self.input
+  """
+  def __init__(self, reps, input, groups, keys):
+    """
+    @reps    Table with the last input row of every group
+    @input   Table with all input rows
+    @groups  list of arrays of row indices into input, one per group
+    @keys    list of group key tuples
+    """
+    self.reps = reps
+    self.input = input
+    self.groups = groups
+    self.keys = keys
+    self.fields = reps.fields
+
+  def __len__(self):
+    return len(self.groups)
+
+  def column(self, field):
+    return self.reps.column(field)
+
+  def take(self, idx):
+    idx = np.arange(len(self))[idx]
+    return GroupBatch(self.reps.take(idx), self.input,
+        [self.groups[i] for i in idx], [self.keys[i] for i in idx])
+
+  def slice(self, start, stop):
+    return self.take(slice(start, stop))
+
+  def __iter__(self):
+    for tup, key, idx in zip(self.reps, self.keys, self.groups):
+      tup["__key__"] = key
+      tup["__group__"] = list(self.input.take(idx))
+      yield tup
+
+
+def vectorizable(op):
+  klass = op.__class__.__name__
+  if klass not in ("Scan", "Filter", "Project", "GroupBy", "Limit"):
+    return False
+
+  exprs = []
+  if klass == "Filter":
+    exprs = [op.cond]
+  elif klass == "Project":
+    exprs = op.exprs
+  elif klass == "GroupBy":
+    exprs = op.group_exprs
+  for e in exprs:
+    if not isinstance(e, Op):
+      return False
+    if not all(hasattr(node, "eval_batch") for node in e.collect(Op)):
+      return False
+  return True
+
+def run_batches(op, batch_size=BATCH_SIZE):
+  """
+  Generate the output of op as batches
+  """
+  klass = op.__class__.__name__
+
+  if not vectorizable(op):
+    rows = []
+    run_op(op, rows.append)
+    for batch in Table.from_rows(rows).batches(batch_size):
+      yield batch
+
+  elif klass == "Scan":
+    for table in op.tables():
+      for batch in table.batches(batch_size):
+        yield batch
+
+  elif klass == "Limit":
+    skip, remaining = op.offset, op.limit
+    for batch in run_batches(op.c, batch_size):
+      if remaining <= 0:
+        break
+      if skip:
+        n = min(skip, len(batch))
+        skip -= n
+        batch = batch.slice(n, len(batch))
+      if len(batch) > remaining:
+        batch = batch.slice(0, remaining)
+      remaining -= len(batch)
+      if len(batch):
+        yield batch
+
+  elif klass == "Filter":
+    for batch in run_batches(op.c, batch_size):
+      mask = eval_column(op.cond, batch).astype(bool)
+      if mask.all():
+        yield batch
+      elif mask.any():
+        yield batch.take(mask)
+
+  elif klass == "Project":
+    for batch in run_batches(op.c, batch_size):
+      arrays = [eval_column(e, batch) for e in op.exprs]
+      yield Table.from_arrays(op.aliases, arrays)
+
+  elif klass == "GroupBy":
+    batches = list(run_batches(op.c, batch_size))
+    if not batches:
+      return
+    groups = group_batch(Table.concat(batches), op.group_exprs)
+    for start in xrange(0, len(groups), batch_size):
+      yield groups.slice(start, start + batch_size)
+
+def eval_column(e, batch):
+  """
+  Column of the values of expression e over the rows of batch.  A
+  division by zero evaluates e row by row, like run_op, so that it
+  raises ZeroDivisionError only if run_op would (e.g. not when AND
+  skips the division for that row)
+  """
+  try:
+    return broadcast(e.eval_batch(batch), len(batch))
+  except ZeroDivisor:
+    fn = bind(e)
+    vals = [fn(tup) for tup in batch]
+    if all(isinstance(v, float) for v in vals):
+      return np.array(vals, dtype=np.float64)
+    col = np.empty(len(vals), dtype=object)
+    col[:] = vals
+    return col
+
+def group_batch(input, group_exprs):
+  """
+  Split the input Table into groups on the values of group_exprs
+  """
+  n = len(input)
+  keys = [eval_column(e, input) for e in group_exprs]
+
+  # combine the per-expression codes into one group id per row
+  gids = np.zeros(n, dtype=np.int64)
+  for key in keys:
+    uniq, codes = np.unique(key, return_inverse=True)
+    gids = gids * len(uniq) + codes
+  uniq, gids = np.unique(gids, return_inverse=True)
+
+  # stable sort so that each group keeps the input order
+  order = np.argsort(gids, kind="mergesort")
+  counts = np.bincount(gids)
+  groups = np.split(order, np.cumsum(counts)[:-1])
+
+  reps = input.take(np.array([idx[-1] for idx in groups]))
+  keyvals = [key.tolist() for key in keys]
+  keytups = [tuple([vals[idx[0]] for vals in keyvals]) for idx in groups]
+  return GroupBatch(reps, input, groups, keytups)
+
+def run_vectorized(op, f=lambda t:t, batch_size=BATCH_SIZE):
+  """
+  Execute op in batches and call f for every output tuple, like run_op
+  """
+  if op.__class__.__name__ == "Print":
+    def print_f(tup):
+      print tup
+    op, f = op.c, print_f
+
+  for batch in run_batches(op, batch_size):
+    for tup in batch:
+      if f(tup) == False:
+        return
@@ -0,0 +1,210 @@
+"""
+Pull-based (Volcano style) executor.
+
+iter_op(op) returns a python generator over op's output tuples.  The
+consumer pulls tuples, so when it stops (a Limit is full, or the
+caller breaks out of its loop) the generators below are closed and no
+more upstream work happens, including inside joins and scans.
+
+Chains of Filter, Project and Limit are fused into a single generator
+that applies them as stages in one loop, so the generator nesting (and
+python stack depth) only grows with joins and pipeline breakers, not
+with the number of operators in the plan.
+"""
+try:
+  import instabase.notebook.ipython.utils as ib
+  ib.import_pyfile('./interpretor.py', 'interpretor')
+except:
+  pass
+from itertools import islice
+from interpretor import *
+
+# operators that transform one tuple at a time and can be fused
+STREAMING = ("Filter", "Project", "Limit")
+
+
+class FilterStage(object):
+  def __init__(self, op):
+    self.cond = bind_expr(op.cond)
+  def __call__(self, tup):
+    if self.cond(tup):
+      return tup
+    return None
+
+class ProjectStage(object):
+  def __init__(self, op):
+    self.exprs = zip(map(bind_expr, op.exprs), op.aliases)
+  def __call__(self, tup):
+    ret = dict()
+    for exp, alias in self.exprs:
+      ret[alias] = exp(tup)
+    return ret
+
+class LimitStage(object):
+  def __init__(self, op):
+    self.offset = op.offset
+    self.end = op.offset + op.limit
+    self.n = 0
+    self.done = self.end <= 0
+  def __call__(self, tup):
+    self.n += 1
+    if self.n >= self.end:
+      self.done = True
+    if self.n > self.offset:
+      return tup
+    return None
+
+
+def iter_op(op):
+  """
+  @return generator over the output tuples of op
+  """
+  klass = op.__class__.__name__
+
+  if klass in STREAMING:
+    stages = []
+    while op.__class__.__name__ in STREAMING:
+      stages.append(globals()["%sStage" % op.__class__.__name__](op))
+      op = op.c
+    stages.reverse()
+    return iter_stages(iter_op(op), stages)
+
+  if klass in ("Scan", "IndexScan"):
+    return iter(op)
+  if klass in ("Source", "SubQuerySource"):
+    return iter_op(op.c)
+  if klass == "Print":
+    return iter_print(op)
+  if klass == "IndexJoin":
+    return iter_index_join(op)
+  if klass == "Join":
+    if equijoin_candidates(op.cond):
+      return iter_hash_join(op)
+    return iter_nested_loop_join(op)
+  if klass == "GroupBy":
+    return iter_group_by(op)
+  if klass == "OrderBy":
+    return iter_order_by(op)
+  if klass == "TopN":
+    return iter_top_n(op)
+  raise Exception("can't execute %s" % klass)
+
+def iter_stages(source, stages):
+  limits = [s for s in stages if isinstance(s, LimitStage)]
+  try:
+    if any(l.done for l in limits):
+      return
+    for tup in source:
+      for stage in stages:
+        tup = stage(tup)
+        if tup is None:
+          break
+      else:
+        yield tup
+      if limits and any(l.done for l in limits):
+        return
+  finally:
+    source.close()
+
+def iter_print(op):
+  for tup in iter_op(op.c):
+    print tup
+    yield tup
+
+def iter_hash_join(op):
+  build = list(iter_op(op.r))
+  if not build:
+    return
+  table = HashJoinTable(op, build)
+
+  left_input = iter_op(op.l)
+  try:
+    for left in left_input:
+      matches, conds = table.probe(left)
+      for right in matches:
+        if all(c(left, right) for c in conds):
+          yield join_tup(left, right)
+  finally:
+    left_input.close()
+
+def iter_index_join(op):
+  idx = get_index(op.inner(), op.column, op.kind)
+  fetch = op.inner().fetcher()
+  key = bind_expr(op.key)
+  residual = map(bind_expr, op.residual)
+  inner_is_left = op.index_side == "l"
+
+  outer_input = iter_op(op.outer())
+  try:
+    for tup in outer_input:
+      for match in fetch(idx.lookup(key(tup))):
+        left, right = inner_is_left and (match, tup) or (tup, match)
+        if all(c(left, right) for c in residual):
+          yield join_tup(left, right)
+  finally:
+    outer_input.close()
+    fetch.close()
+
+def iter_nested_loop_join(op):
+  cond = bind_expr(op.cond)
+  left_input = iter_op(op.l)
+  try:
+    if not op.block_size:
+      inner = list(iter_op(op.r))
+      if not inner:
+        return
+      for left in left_input:
+        for right in inner:
+          if cond(left, right):
+            yield join_tup(left, right)
+      return
+
+    while True:
+      block = list(islice(left_input, op.block_size))
+      if not block:
+        return
+      for right in iter_op(op.r):
+        for left in block:
+          if cond(left, right):
+            yield join_tup(left, right)
+  finally:
+    left_input.close()
+
+def iter_group_by(op):
+  groups = GroupTable(op)
+  for tup in iter_op(op.c):
+    groups.add(tup)
+  for tup in groups:
+    yield tup
+
+def iter_order_by(op):
+  sorter = ExternalSorter(
+      map(bind_expr, op.order_exprs), op.descending(), op.buffer_rows)
+  for tup in iter_op(op.c):
+    sorter.add(tup)
+  try:
+    for tup in sorter:
+      yield tup
+  finally:
+    sorter.close()
+
+def iter_top_n(op):
+  heap = TopNHeap(map(bind_expr, op.order_exprs), op.descending(), op.limit, op.offset)
+  if heap.size <= 0:
+    return
+  for tup in iter_op(op.c):
+    heap.add(tup)
+  for tup in heap:
+    yield tup
+
+def run_pull(op, f=lambda t:t):
+  """
+  Pull every output tuple of op and call f on it, like run_op
+  """
+  tups = iter_op(op)
+  try:
+    for tup in tups:
+      if f(tup) == False:
+        break
+  finally:
+    tups.close()
@@ -6,6 +6,19 @@ except:
   pass
 from ops import *
 
+# Object that observes execution, None when nothing is attached (see
+# hooks.attach in ../compiler).  It has two methods:
+#   run(op, f, run_f)   execute op by calling run_f(op, f), possibly
+#                       with a wrapped f
+#   wrap_expr(e, fn)    return the callable to use for expression e,
+#                       bound to fn
+tracer = None
+
+def bind_expr(fn):
+  if tracer is not None:
+    return tracer.wrap_expr(fn, fn)
+  return fn
+
 def run_op(op, f=lambda t:t):
   """
   This function interprets the current operator and constructs an 
@@ -14,6 +27,11 @@ def run_op(op, f=lambda t:t):
   @op current operator to execute
   @f the function to call for every output tuple of this operator (op)
   """
+  if tracer is not None:
+    return tracer.run(op, f, interpret_op)
+  return interpret_op(op, f)
+
+def interpret_op(op, f):
   klass = op.__class__.__name__
 
   if klass == "Print":
@@ -22,14 +40,15 @@ def run_op(op, f=lambda t:t):
     run_op(op.p, print_f)
 
   elif klass == "Scan":
-    for tup in op.data:
+    for tup in op:
       if f(tup) == False:
         break
 
   elif klass == "Join":
+    cond = bind_expr(op.cond)
     def outer_loop(left):
       def inner_loop(right):
-        if op.cond(left, right):
+        if cond(left, right):
           newtup = dict()
           newtup.update(left)
           newtup.update(right)
@@ -53,8 +72,9 @@ def run_op(op, f=lambda t:t):
 
   elif klass == "GroupBy":
     hashtable = defaultdict(lambda: [None, None, []])
+    group_exprs = map(bind_expr, op.group_exprs)
     def group_f(tup):
-      key = tuple([e(tup) for e in op.group_exprs])
+      key = tuple([e(tup) for e in group_exprs])
       hashtable[key][0] = key
       hashtable[key][1] = tup
       hashtable[key][2].append(tup)
@@ -73,15 +93,17 @@ def run_op(op, f=lambda t:t):
     run_op(op.p, order_f)
 
   elif klass == "Filter":
+    cond = bind_expr(op.cond)
     def where_f(tup):
-      if op.cond(tup):
+      if cond(tup):
         f(tup)
     run_op(op.p, where_f)
 
   elif klass == "Project":
+    exprs = zip(map(bind_expr, op.exprs), op.aliases)
     def project_f(tup):
       ret = dict()
-      for exp, alias in zip(op.exprs, op.aliases):
+      for exp, alias in exprs:
         ret[alias] = exp(tup)
       f(ret)
     run_op(op.p, project_f)
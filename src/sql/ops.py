@@ -1,10 +1,11 @@
-import csv
 try:
   import instabase.notebook.ipython.utils as ib
   ib.import_pyfile('./parser.py', 'parser')
+  ib.import_pyfile('../common/csvscan.py', 'csvscan')
 except:
   pass
 from parser import parse
+from csvscan import ChunkedScan
 
 def cond_to_func(expr_or_func):
   """
@@ -33,35 +34,14 @@ class Print(Op):
   def __init__(self, p):
     self.p = p
 
-class Scan(Op):
-  def __init__(self, filename):
-    openfile = open
-    try:
-      openfile = ib.open
-    except:
-      pass
-
-    with openfile(filename) as f:
-        self.proc_file(f)
-
-  def proc_file(self, f):
-    fields = None
-    types = None
-    rows = None
-    dialect = csv.Sniffer().sniff(f.read(2048))
-    f.seek(0)
-    reader = csv.reader(f, dialect)
-    header = reader.next()
-    header = [v.split(":") for v in header]
-    fields, types = zip(*header)
-    rows = [dict(zip(fields, l)) for l in reader]
-    for row in rows:
-      for f,t in zip(fields, types):
-        if t == "num":
-          row[f] = float(row[f])
-    self.fields = fields
-    self.types = types
-    self.data = rows
+class Scan(Op, ChunkedScan):
+  def __init__(self, filename, chunk_size=None):
+    """
+    The file is only opened when the scan is executed (see csvscan.py)
+    """
+    ChunkedScan.__init__(self, filename, chunk_size)
+    self.fields = None
+    self.types = None
 
       
 class Join(Op):